@@ -1,104 +1,223 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
-from typing import Optional, List
-import sqlite3
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, Dict, Any
+import asyncio
+import contextlib
 import uuid
 import os
 import json
 import hashlib
+import time
+import threading
 from datetime import datetime
 import uvicorn
 
+from utils.db_pool import ConnectionPool, DB_PATH, ensure_column
+from utils.async_db import AsyncDatabase, Durability, CHAT_LOG_DURABILITY, AI_TASK_DURABILITY, strongest
+from utils.sessions import SessionStore
+from utils.rag import RAGSystem
+from utils.context_packer import CONTEXT_CANDIDATES
+from utils.vector_store import CHROMA_WARM_WORKSPACES
+from utils.generation_scheduler import GenerationScheduler, GenerationQueueFull
+from utils import metrics
+from utils import usage
+from utils.usage import UsageCounters, USAGE_DAILY_MAX_DAYS
+from utils.bulk_tasks import (
+    TASK_BULK_MAX, InvalidImportLine, insert_tasks, update_tasks, delete_tasks, iter_ndjson_batches
+)
+from utils.pagination import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, InvalidPageRequest, parse_fields, keyset_page
+from workers.ingestion import JobQueue, JobStatus, IngestionWorkerPool, IngestionIndexer, INGEST_WORKERS
+from utils.uploads import (
+    MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_SESSION_TTL, UPLOAD_CLEANUP_INTERVAL, UploadTooLarge, UploadBusy,
+    upload_path, iter_upload_file, stream_to_disk, lock_upload, hash_file, stale_part_files
+)
+
 # Initialize
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("vector_db", exist_ok=True)
 os.makedirs("database", exist_ok=True)
 
-DB_PATH = "database/ai_workspace.db"
+db_pool = ConnectionPool(DB_PATH)
 
 # Initialize database
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
     
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT DEFAULT 'user',
-            workspace_id TEXT,
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+        # Users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                role TEXT DEFAULT 'user',
+                workspace_id TEXT,
+                is_active BOOLEAN DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
-    # Documents table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id TEXT PRIMARY KEY,
-            filename TEXT NOT NULL,
-            file_path TEXT,
-            file_size INTEGER,
-            file_type TEXT,
-            status TEXT DEFAULT 'pending',
-            metadata TEXT,
-            user_id INTEGER,
-            workspace_id TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+        # Documents table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                file_path TEXT,
+                file_size INTEGER,
+                file_type TEXT,
+                status TEXT DEFAULT 'pending',
+                metadata TEXT,
+                user_id INTEGER,
+                workspace_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                version INTEGER DEFAULT 1
+            )
+        ''')
+        ensure_column(cursor, "documents", "version", "INTEGER DEFAULT 1")
     
-    # Tasks table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id TEXT PRIMARY KEY,
-            title TEXT NOT NULL,
-            description TEXT,
-            due_date TIMESTAMP,
-            priority TEXT DEFAULT 'medium',
-            status TEXT DEFAULT 'todo',
-            linked_documents TEXT,
-            user_id INTEGER,
-            created_by_ai BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+        # Tasks table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                description TEXT,
+                due_date TIMESTAMP,
+                priority TEXT DEFAULT 'medium',
+                status TEXT DEFAULT 'todo',
+                linked_documents TEXT,
+                user_id INTEGER,
+                created_by_ai BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
-    # Chats table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chats (
-            id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            message TEXT,
-            response TEXT,
-            tools_called TEXT,
-            metadata TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create admin user if not exists
-    cursor.execute("SELECT * FROM users WHERE username = 'admin'")
-    if not cursor.fetchone():
-        password_hash = hashlib.sha256("admin123".encode()).hexdigest()
-        cursor.execute(
-            "INSERT INTO users (username, email, password_hash, role, workspace_id) VALUES (?, ?, ?, ?, ?)",
-            ("admin", "admin@example.com", password_hash, "admin", str(uuid.uuid4()))
-        )
-        print("Created admin user: admin/admin123")
+        # Chats table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chats (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                message TEXT,
+                response TEXT,
+                tools_called TEXT,
+                metadata TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Sessions table (token digest is the primary key, so lookups are indexed)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                token_hash TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)")
+
+        # Listing indexes: keyset pages walk (created_at, id) within a user
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_user_created ON documents(user_id, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks(user_id, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_status_priority ON tasks(user_id, status, priority, created_at, id)")
+
+        # Chunked upload sessions (resumable uploads of large files)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                total_size INTEGER NOT NULL,
+                received_bytes INTEGER DEFAULT 0,
+                user_id INTEGER,
+                workspace_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at REAL
+            )
+        ''')
+        # Time of the last chunk, for expiring abandoned uploads
+        ensure_column(cursor, "upload_sessions", "updated_at", "REAL")
+
+        # Ingestion job queue (drained by workers/ingestion.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                locked_by TEXT,
+                lease_expires REAL,
+                available_at REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at REAL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs(status, id)")
+
+        # Embedded chunks staged between the worker processes and the indexer
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ingestion_chunks (
+                document_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                metadata TEXT,
+                PRIMARY KEY (document_id, chunk_index)
+            )
+        ''')
+        ensure_column(cursor, "ingestion_chunks", "metadata", "TEXT")
+
+        # Chunks currently in the vector DB per document, by content hash (re-indexing diffs against it)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_chunks (
+                document_id TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                metadata_hash TEXT NOT NULL,
+                PRIMARY KEY (document_id, chunk_id)
+            )
+        ''')
+
+        # Usage counters and daily rollups, kept up to date by triggers on chats / tasks / users
+        usage.install(cursor)
+
+        # Create admin user if not exists
+        cursor.execute("SELECT * FROM users WHERE username = 'admin'")
+        if not cursor.fetchone():
+            password_hash = hashlib.sha256("admin123".encode()).hexdigest()
+            cursor.execute(
+                "INSERT INTO users (username, email, password_hash, role, workspace_id) VALUES (?, ?, ?, ?, ?)",
+                ("admin", "admin@example.com", password_hash, "admin", str(uuid.uuid4()))
+            )
+            print("Created admin user: admin/admin123")
     
-    conn.commit()
-    conn.close()
+        conn.commit()
     print("Database initialized")
 
 # Initialize database
 init_db()
 
+# Handlers await their queries: reads run on DB_READ_THREADS threads, writes on one writer thread
+db = AsyncDatabase(DB_PATH)
+
+session_store = SessionStore(db_pool)
+usage_counters = UsageCounters(db_pool)
+session_store.purge_expired()
+
+rag_system = RAGSystem()
+response_cache = rag_system.response_cache
+# The instance the RAG pipeline looks up through, so its in-process counters are the ones reported
+embedding_cache = rag_system.embedding_cache
+generation_scheduler = GenerationScheduler(rag_system)
+ingestion_queue = JobQueue(db_pool)
+ingestion_workers = IngestionWorkerPool(INGEST_WORKERS, DB_PATH)
+ingestion_indexer = IngestionIndexer(db_pool, rag_system)
+
 # Pydantic models
 class UserRegister(BaseModel):
     username: str
@@ -109,6 +228,9 @@ class UserLogin(BaseModel):
     username: str
     password: str
 
+class RoleUpdate(BaseModel):
+    role: str
+
 class UserResponse(BaseModel):
     id: int
     username: str
@@ -122,6 +244,10 @@ class DocumentUpload(BaseModel):
     filename: str
     content: bytes
 
+class UploadStart(BaseModel):
+    filename: str
+    total_size: int = Field(ge=1)
+
 class DocumentResponse(BaseModel):
     id: str
     filename: str
@@ -130,6 +256,7 @@ class DocumentResponse(BaseModel):
     status: str
     user_id: int
     created_at: str
+    version: int = 1
 
 class ChatRequest(BaseModel):
     message: str
@@ -138,6 +265,8 @@ class ChatResponse(BaseModel):
     response: str
     tools_called: List[str]
     chat_id: str
+    sources: List[Dict[str, Any]] = []
+    retrieval_engine: Optional[str] = None
 
 class TaskCreate(BaseModel):
     title: str
@@ -166,6 +295,20 @@ class TaskResponse(BaseModel):
     created_by_ai: bool
     created_at: str
 
+class TaskBulkCreate(BaseModel):
+    tasks: List[TaskCreate] = Field(min_length=1, max_length=TASK_BULK_MAX)
+
+class TaskStatusUpdate(BaseModel):
+    id: str
+    status: Optional[str] = None
+    priority: Optional[str] = None
+
+class TaskBulkUpdate(BaseModel):
+    updates: List[TaskStatusUpdate] = Field(min_length=1, max_length=TASK_BULK_MAX)
+
+class TaskBulkDelete(BaseModel):
+    ids: List[str] = Field(min_length=1, max_length=TASK_BULK_MAX)
+
 # Simple AI service
 class SimpleAI:
     def chat(self, message: str):
@@ -205,62 +348,124 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Outermost, so the latency covers every other middleware too
+app.add_middleware(metrics.MetricsMiddleware)
+
 security = HTTPBearer()
 
+# Reject oversized uploads from Content-Length before the body is read
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    if request.url.path.startswith("/documents/upload"):
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            return JSONResponse(status_code=413, content={"detail": f"Upload exceeds limit of {MAX_UPLOAD_BYTES} bytes"})
+    return await call_next(request)
+
+def warm_vector_collections():
+    """Load the vector indexes of the workspaces with the most recent documents"""
+    with db_pool.connection() as conn:
+        rows = conn.execute('''
+            SELECT workspace_id FROM documents WHERE status = 'completed'
+            GROUP BY workspace_id ORDER BY MAX(created_at) DESC LIMIT ?
+        ''', (CHROMA_WARM_WORKSPACES,)).fetchall()
+    started = time.perf_counter()
+    warmed = rag_system.collections.warm([row[0] for row in rows])
+    print(f"Warmed {warmed} vector collections in {time.perf_counter() - started:.1f}s")
+
+# Last activity of a chunked upload; sessions from before updated_at fall back to created_at
+UPLOAD_ACTIVITY = "COALESCE(updated_at, CAST(strftime('%s', created_at) AS REAL))"
+
+upload_cleanup_stop = threading.Event()
+
+def expire_uploads():
+    """Drop chunked uploads with no chunk for UPLOAD_SESSION_TTL, and .part files left without a session"""
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    with db_pool.connection() as conn:
+        expired = conn.execute(
+            f"SELECT id, file_path FROM upload_sessions WHERE {UPLOAD_ACTIVITY} < ?", (cutoff,)
+        ).fetchall()
+        known = {row[0] for row in conn.execute("SELECT file_path FROM upload_sessions")}
+
+    def delete_session(conn, upload_id):
+        # Unless a chunk arrived since it was selected
+        cursor = conn.execute(f"DELETE FROM upload_sessions WHERE id = ? AND {UPLOAD_ACTIVITY} < ?",
+                              (upload_id, cutoff))
+        return cursor.rowcount == 1
+
+    removed = 0
+    for upload_id, file_path in expired:
+        # Under the upload's lock, so no chunk PUT or complete is half done
+        try:
+            lock = lock_upload(file_path)
+        except UploadBusy:
+            continue
+        except FileNotFoundError:
+            lock = None
+        try:
+            if db.submit_write(delete_session, upload_id).result():
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(file_path)
+                removed += 1
+        finally:
+            if lock is not None:
+                lock.close()
+
+    for file_path in stale_part_files(cutoff, known):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file_path)
+            removed += 1
+
+    if removed:
+        print(f"Expired {removed} abandoned uploads")
+
+def upload_cleanup_loop():
+    while True:
+        try:
+            expire_uploads()
+        except Exception as e:
+            print(f"Upload cleanup failed: {e}")
+        if upload_cleanup_stop.wait(UPLOAD_CLEANUP_INTERVAL):
+            break
+
+@app.on_event("startup")
+def start_ingestion():
+    ingestion_workers.start()
+    ingestion_indexer.start()
+    # In the background, so startup is not held up by large indexes
+    if CHROMA_WARM_WORKSPACES > 0:
+        threading.Thread(target=warm_vector_collections, name="collection-warmup", daemon=True).start()
+    threading.Thread(target=upload_cleanup_loop, name="upload-cleanup", daemon=True).start()
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    upload_cleanup_stop.set()
+    ingestion_indexer.stop()
+    ingestion_workers.stop()
+    rag_system.vector_indexes.close()
+    response_cache.flush()
+    await rag_system.client.aclose()
+    rag_system.client.close()
+    db.close()
+    db_pool.close()
+
 # Dependency for auth
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Simple token check (in production use JWT)
-    cursor.execute("SELECT * FROM users WHERE password_hash = ?", (token,))
-    user = cursor.fetchone()
-    conn.close()
-    
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Served from the in-process principal cache when warm, otherwise looked up on a reader thread
+    with metrics.span("auth"):
+        user = session_store.cached(credentials.credentials)
+        if user is None:
+            user = await db.read(lambda conn: session_store.resolve(credentials.credentials, conn=conn))
+
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
-    
-    return {
-        "id": user[0],
-        "username": user[1],
-        "email": user[2],
-        "role": user[4],
-        "workspace_id": user[5]
-    }
 
-# ========== AUTH ENDPOINTS ==========
-@app.post("/auth/register", response_model=UserResponse)
-def register(user: UserRegister):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Check if user exists
-    cursor.execute("SELECT * FROM users WHERE username = ? OR email = ?", 
-                  (user.username, user.email))
-    if cursor.fetchone():
-        conn.close()
-        raise HTTPException(status_code=400, detail="User already exists")
-    
-    # Create user
-    password_hash = hash_password(user.password)
-    workspace_id = str(uuid.uuid4())
-    
-    cursor.execute('''
-        INSERT INTO users (username, email, password_hash, workspace_id)
-        VALUES (?, ?, ?, ?)
-    ''', (user.username, user.email, password_hash, workspace_id))
-    
-    user_id = cursor.lastrowid
-    conn.commit()
-    
-    # Get created user
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user_data = cursor.fetchone()
-    conn.close()
-    
+    return user
+
+def user_response(user_data) -> UserResponse:
     return UserResponse(
         id=user_data[0],
         username=user_data[1],
@@ -271,236 +476,701 @@ def register(user: UserRegister):
         created_at=user_data[7]
     )
 
-@app.post("/auth/login")
-def login(user: UserLogin):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+# ========== AUTH ENDPOINTS ==========
+@app.post("/auth/register", response_model=UserResponse)
+async def register(user: UserRegister):
+    password_hash = hash_password(user.password)
+    workspace_id = str(uuid.uuid4())
+
+    def create_user(conn):
+        cursor = conn.cursor()
+    
+        # Check if user exists (on the writer, so no other registration can slip in between)
+        cursor.execute("SELECT * FROM users WHERE username = ? OR email = ?", 
+                      (user.username, user.email))
+        if cursor.fetchone():
+            raise HTTPException(status_code=400, detail="User already exists")
+    
+        cursor.execute('''
+            INSERT INTO users (username, email, password_hash, workspace_id)
+            VALUES (?, ?, ?, ?)
+        ''', (user.username, user.email, password_hash, workspace_id))
     
-    cursor.execute("SELECT * FROM users WHERE username = ?", (user.username,))
-    user_data = cursor.fetchone()
-    conn.close()
+        # Get created user
+        cursor.execute("SELECT * FROM users WHERE id = ?", (cursor.lastrowid,))
+        return cursor.fetchone()
+    
+    return user_response(await db.write(create_user))
+
+@app.post("/auth/login")
+async def login(user: UserLogin):
+    user_data = await db.read(
+        lambda conn: conn.execute("SELECT * FROM users WHERE username = ?", (user.username,)).fetchone()
+    )
     
     if not user_data or not verify_password(user.password, user_data[3]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    # Create simple token (password_hash as token for demo)
     return {
-        "access_token": user_data[3],  # Using password hash as token
+        "access_token": await db.write(lambda conn: session_store.create(user_data[0], conn=conn)),
         "token_type": "bearer",
         "user_id": user_data[0],
         "username": user_data[1],
         "role": user_data[4]
     }
 
+@app.post("/auth/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Also drops the cached principal, so it goes through the store rather than the writer
+    await db.run(session_store.revoke, credentials.credentials)
+    return {"status": "logged_out"}
+
 @app.get("/auth/me", response_model=UserResponse)
-def get_me(current_user: dict = Depends(get_current_user)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE id = ?", (current_user["id"],))
-    user_data = cursor.fetchone()
-    conn.close()
-    
-    return UserResponse(
-        id=user_data[0],
-        username=user_data[1],
-        email=user_data[2],
-        role=user_data[4],
-        workspace_id=user_data[5],
-        is_active=bool(user_data[6]),
-        created_at=user_data[7]
+async def get_me(current_user: dict = Depends(get_current_user)):
+    user_data = await db.read(
+        lambda conn: conn.execute("SELECT * FROM users WHERE id = ?", (current_user["id"],)).fetchone()
     )
+    return user_response(user_data)
 
 # ========== DOCUMENT ENDPOINTS ==========
+def file_type_of(filename: str) -> str:
+    return filename.split('.')[-1] if '.' in filename else 'unknown'
+
+def remove_file(path: Optional[str]):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def save_document(conn, file_id: str, filename: str, file_path: str, file_size: int,
+                  content_hash: str, current_user: dict) -> DocumentResponse:
+    """Insert a document and its ingestion job; runs on the writer, which commits"""
+    conn.execute('''
+        INSERT INTO documents (id, filename, file_path, file_size, file_type, metadata, user_id, workspace_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (file_id, filename, file_path, file_size, file_type_of(filename),
+          json.dumps({"sha256": content_hash}), current_user["id"], current_user["workspace_id"]))
+
+    # Processed in the background; the upload returns immediately
+    ingestion_queue.enqueue(file_id, conn=conn)
+
+    return DocumentResponse(
+        id=file_id,
+        filename=filename,
+        file_size=file_size,
+        file_type=file_type_of(filename),
+        status="pending",
+        user_id=current_user["id"],
+        created_at=datetime.now().isoformat()
+    )
+
 @app.post("/documents/upload", response_model=DocumentResponse)
 async def upload_file(
     file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)
 ):
-    # Read file
-    content = await file.read()
     file_id = str(uuid.uuid4())
-    file_path = f"uploads/{file_id}_{file.filename}"
+    file_path = upload_path(file_id, file.filename)
+
+    # Stream to disk in fixed-size chunks, hashing as we go
+    try:
+        file_size, content_hash = await stream_to_disk(iter_upload_file(file), file_path)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    return await db.write(save_document, file_id, file.filename, file_path, file_size, content_hash, current_user)
+
+# ========== CHUNKED (RESUMABLE) UPLOADS ==========
+def get_upload_session(conn, upload_id: str, current_user: dict):
+    upload = conn.execute(
+        "SELECT id, filename, file_path, total_size, received_bytes FROM upload_sessions WHERE id = ? AND user_id = ?",
+        (upload_id, current_user["id"])
+    ).fetchone()
+
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    return {
+        "upload_id": upload[0],
+        "filename": upload[1],
+        "file_path": upload[2],
+        "total_size": upload[3],
+        "received_bytes": upload[4]
+    }
+
+@app.post("/documents/uploads")
+async def start_upload(upload: UploadStart, current_user: dict = Depends(get_current_user)):
+    if upload.total_size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds limit of {MAX_UPLOAD_BYTES} bytes")
+
+    upload_id = str(uuid.uuid4())
+    file_path = upload_path(upload_id, upload.filename) + ".part"
+    await run_in_threadpool(lambda: open(file_path, "wb").close())
+
+    def create_session(conn):
+        conn.execute('''
+            INSERT INTO upload_sessions (id, filename, file_path, total_size, user_id, workspace_id, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (upload_id, upload.filename, file_path, upload.total_size,
+              current_user["id"], current_user["workspace_id"], time.time()))
+
+    await db.write(create_session)
+
+    return {
+        "upload_id": upload_id,
+        "total_size": upload.total_size,
+        "received_bytes": 0,
+        "chunk_size": UPLOAD_CHUNK_SIZE
+    }
+
+@app.get("/documents/uploads/{upload_id}")
+async def upload_status(upload_id: str, current_user: dict = Depends(get_current_user)):
+    upload = await db.read(get_upload_session, upload_id, current_user)
+    del upload["file_path"]
+    return upload
+
+@app.put("/documents/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    upload = await db.read(get_upload_session, upload_id, current_user)
+
+    # One writer per upload at a time; the session is read again under the lock
+    try:
+        lock = await run_in_threadpool(lock_upload, upload["file_path"])
+    except UploadBusy as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "received_bytes": upload["received_bytes"]})
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    progress = None
+    try:
+        upload = await db.read(get_upload_session, upload_id, current_user)
+
+        # Clients resume from the offset returned by GET /documents/uploads/{upload_id}
+        if offset != upload["received_bytes"]:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Offset mismatch", "received_bytes": upload["received_bytes"]}
+            )
+
+        # Written at the recorded offset, over anything a failed earlier attempt left behind
+        remaining = upload["total_size"] - upload["received_bytes"]
+        try:
+            written, _ = await stream_to_disk(
+                request.stream(), upload["file_path"], max_bytes=remaining, offset=offset, compute_hash=False
+            )
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail="Chunk exceeds declared total_size")
+
+        def record_progress(conn):
+            # Only from the offset the bytes were written at
+            cursor = conn.execute(
+                "UPDATE upload_sessions SET received_bytes = ?, updated_at = ? WHERE id = ? AND received_bytes = ?",
+                (offset + written, time.time(), upload_id, offset)
+            )
+            return cursor.rowcount == 1
+
+        progress = db.submit_write(record_progress)
+        if not await asyncio.wrap_future(progress):
+            raise HTTPException(status_code=409, detail={"message": "Offset mismatch"})
+    finally:
+        # Keep the lock until the progress write has settled, even if the request was cancelled
+        if progress is not None and not progress.done():
+            with contextlib.suppress(Exception, asyncio.CancelledError):
+                await asyncio.wrap_future(progress)
+        await run_in_threadpool(lock.close)
+
+    return {
+        "upload_id": upload_id,
+        "total_size": upload["total_size"],
+        "received_bytes": offset + written
+    }
+
+@app.post("/documents/uploads/{upload_id}/complete", response_model=DocumentResponse)
+async def complete_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    upload = await db.read(get_upload_session, upload_id, current_user)
+
+    # Excludes chunk PUTs and a second complete; the session is read again under the lock
+    try:
+        lock = await run_in_threadpool(lock_upload, upload["file_path"])
+    except UploadBusy as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "received_bytes": upload["received_bytes"]})
+    except FileNotFoundError:
+        # Already moved by a complete that got here first
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    finished = None
+    try:
+        upload = await db.read(get_upload_session, upload_id, current_user)
+
+        if upload["received_bytes"] != upload["total_size"]:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Upload incomplete", "received_bytes": upload["received_bytes"]}
+            )
+
+        file_path = upload_path(upload_id, upload["filename"])
+        await run_in_threadpool(os.replace, upload["file_path"], file_path)
+        content_hash = await run_in_threadpool(hash_file, file_path)
+
+        def finish_upload(conn):
+            document = save_document(conn, upload_id, upload["filename"], file_path, upload["total_size"],
+                                     content_hash, current_user)
+            conn.execute("DELETE FROM upload_sessions WHERE id = ?", (upload_id,))
+            return document
+
+        finished = db.submit_write(finish_upload)
+        return await asyncio.wrap_future(finished)
+    finally:
+        # Keep the lock until the session is gone, even if the request was cancelled
+        if finished is not None and not finished.done():
+            with contextlib.suppress(Exception, asyncio.CancelledError):
+                await asyncio.wrap_future(finished)
+        await run_in_threadpool(lock.close)
+
+def paged_response(rows: list, next_cursor: Optional[str]) -> JSONResponse:
+    """List body as before; the next page's cursor goes in ``X-Next-Cursor``"""
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(content=rows, headers=headers)
+
+@app.get("/documents", response_model=List[DocumentResponse])
+async def list_documents(
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Newest first, ``limit`` per page; pass ``X-Next-Cursor`` back as ``cursor`` for the next page.
     
-    # Save file
-    with open(file_path, "wb") as f:
-        f.write(content)
+    ``fields`` is an optional comma-separated subset of the response fields.
+    """
+    try:
+        columns = parse_fields(fields, list(DocumentResponse.model_fields))
+        docs, next_cursor = await db.read(keyset_page, "documents", columns, "user_id = ?",
+                                          [current_user["id"]], cursor, limit)
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Save to database
-    conn = sqlite3.connect(DB_PATH)
+    return paged_response(docs, next_cursor)
+
+def fetch_document(conn, document_id: str, current_user: dict) -> DocumentResponse:
     cursor = conn.cursor()
+    cursor.execute("SELECT * FROM documents WHERE id = ? AND user_id = ?",
+                  (document_id, current_user["id"]))
+    d = cursor.fetchone()
     
-    cursor.execute('''
-        INSERT INTO documents (id, filename, file_path, file_size, file_type, user_id, workspace_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (file_id, file.filename, file_path, len(content), 
-          file.filename.split('.')[-1] if '.' in file.filename else 'unknown',
-          current_user["id"], current_user["workspace_id"]))
-    
-    conn.commit()
-    conn.close()
+    if not d:
+        raise HTTPException(status_code=404, detail="Document not found")
     
     return DocumentResponse(
-        id=file_id,
-        filename=file.filename,
-        file_size=len(content),
-        file_type=file.filename.split('.')[-1] if '.' in file.filename else 'unknown',
-        status="pending",
-        user_id=current_user["id"],
-        created_at=datetime.now().isoformat()
-    )
-
-@app.get("/documents", response_model=List[DocumentResponse])
-def list_documents(current_user: dict = Depends(get_current_user)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM documents WHERE user_id = ? ORDER BY created_at DESC", 
-                  (current_user["id"],))
-    docs = cursor.fetchall()
-    conn.close()
-    
-    return [DocumentResponse(
         id=d[0],
         filename=d[1],
         file_size=d[3],
         file_type=d[4],
         status=d[5],
         user_id=d[7],
-        created_at=d[9]
-    ) for d in docs]
+        created_at=d[9],
+        version=d[10]
+    )
 
-# ========== CHAT ENDPOINTS ==========
-@app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest, current_user: dict = Depends(get_current_user)):
-    # Get AI response
-    response = ai_service.chat(request.message)
-    chat_id = str(uuid.uuid4())
-    
-    # Save to database
-    conn = sqlite3.connect(DB_PATH)
+@app.get("/documents/{document_id}", response_model=DocumentResponse)
+async def get_document(document_id: str, current_user: dict = Depends(get_current_user)):
+    return await db.read(fetch_document, document_id, current_user)
+
+def replace_document_file(conn, document_id: str, filename: str, file_path: str, file_size: int,
+                          content_hash: str, current_user: dict):
+    """Make an uploaded file the next version of a document and queue it for re-indexing.
+
+    Runs on the writer. Returns the document and the file that is no longer
+    needed: the previous version's, or the upload itself if the content is
+    unchanged.
+    """
+    # The writer's transaction already holds the write lock, so ingestion
+    # workers cannot change the status between this check and the update
     cursor = conn.cursor()
-    
+    cursor.execute("SELECT file_path, status, metadata FROM documents WHERE id = ? AND user_id = ?",
+                   (document_id, current_user["id"]))
+    d = cursor.fetchone()
+    if not d:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    cursor.execute(
+        "SELECT 1 FROM ingestion_jobs WHERE document_id = ? AND status NOT IN (?, ?)",
+        (document_id, JobStatus.DONE.value, JobStatus.FAILED.value)
+    )
+    if cursor.fetchone():
+        raise HTTPException(status_code=409, detail="Document is still being processed")
+
+    metadata = json.loads(d[2]) if d[2] else {}
+    if metadata.get("sha256") == content_hash and d[1] == "completed":
+        # Same content as the indexed version
+        return fetch_document(conn, document_id, current_user), file_path
+
+    # Re-indexing embeds only chunks whose text is new (see IngestionIndexer.index)
     cursor.execute('''
-        INSERT INTO chats (id, user_id, message, response)
-        VALUES (?, ?, ?, ?)
-    ''', (chat_id, current_user["id"], request.message, response))
-    
-    conn.commit()
-    conn.close()
-    
-    # Check if task creation requested
+        UPDATE documents
+        SET filename = ?, file_path = ?, file_size = ?, file_type = ?, status = ?, metadata = ?,
+            version = version + 1
+        WHERE id = ?
+    ''', (filename, file_path, file_size, file_type_of(filename), "pending",
+          json.dumps({"sha256": content_hash}), document_id))
+    ingestion_queue.enqueue(document_id, conn=conn)
+    return fetch_document(conn, document_id, current_user), d[0]
+
+@app.put("/documents/{document_id}", response_model=DocumentResponse)
+async def replace_document(
+    document_id: str,
+    file: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """Upload a new version of a document"""
+    file_path = upload_path(str(uuid.uuid4()), file.filename)
+    try:
+        file_size, content_hash = await stream_to_disk(iter_upload_file(file), file_path)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    try:
+        document, unused_path = await db.write(
+            replace_document_file, document_id, file.filename, file_path, file_size, content_hash, current_user
+        )
+    except HTTPException:
+        await run_in_threadpool(remove_file, file_path)
+        raise
+
+    await run_in_threadpool(remove_file, unused_path)
+    return document
+
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str, current_user: dict = Depends(get_current_user)):
+    def delete_rows(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT file_path, workspace_id FROM documents WHERE id = ? AND user_id = ?",
+                       (document_id, current_user["id"]))
+        d = cursor.fetchone()
+        if not d:
+            raise HTTPException(status_code=404, detail="Document not found")
+
+        # Jobs still in flight find the document gone and stop
+        cursor.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+        cursor.execute("DELETE FROM ingestion_jobs WHERE document_id = ?", (document_id,))
+        cursor.execute("DELETE FROM ingestion_chunks WHERE document_id = ?", (document_id,))
+        cursor.execute("DELETE FROM document_chunks WHERE document_id = ?", (document_id,))
+        return d
+
+    d = await db.write(delete_rows)
+
+    if not await run_in_threadpool(rag_system.delete_document, document_id, d[1]):
+        raise HTTPException(status_code=500, detail="Failed to delete document vectors")
+    await run_in_threadpool(remove_file, d[0])
+
+    return {"id": document_id, "status": "deleted"}
+
+# ========== CHAT ENDPOINTS ==========
+def save_chat(conn, chat_id: str, user_id: int, message: str, response: str, metadata: dict,
+              task_title: Optional[str] = None):
+    """Insert a chat and the task it asked for; the usage counters follow through their triggers"""
+    conn.execute('''
+        INSERT INTO chats (id, user_id, message, response, metadata)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (chat_id, user_id, message, response, json.dumps(metadata)))
+    if task_title is not None:
+        conn.execute('''
+            INSERT INTO tasks (id, title, description, user_id, created_by_ai)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (str(uuid.uuid4()), task_title, f"From chat: {message}", user_id, True))
+
+def chat_tools(message: str):
+    """Tools a message asks for; returns (tools_called, title of the task to create or None)"""
     tools_called = []
-    if "task" in request.message.lower() and "create" in request.message.lower():
+    title = None
+    if "task" in message.lower() and "create" in message.lower():
         tools_called.append("create_task")
         # Extract task title
-        words = request.message.lower().split()
-        try:
+        words = message.lower().split()
+        if "task" in words:
             task_index = words.index("task")
             title = " ".join(words[task_index+1:task_index+4]).title()
-            
-            # Create task
-            task_id = str(uuid.uuid4())
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO tasks (id, title, description, user_id, created_by_ai)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (task_id, title, f"From chat: {request.message}", current_user["id"], True))
-            conn.commit()
-            conn.close()
-            
-            response += f"\n\nTask created: '{title}'"
-        except:
-            pass
+    
+    return tools_called, title
+
+def chat_durability(task_title: Optional[str]) -> Durability:
+    return strongest(CHAT_LOG_DURABILITY, AI_TASK_DURABILITY) if task_title is not None else CHAT_LOG_DURABILITY
+
+def log_chat(chat_id: str, user_id: int, message: str, response: str, metadata: dict,
+             task_title: Optional[str] = None):
+    """Queue a chat and its task as one group-committed write; returns the write's future"""
+    return db.submit_write(save_chat, chat_id, user_id, message, response, metadata, task_title,
+                           durability=chat_durability(task_title))
+
+async def wait_for_chat(save, task_title: Optional[str] = None) -> str:
+    """Wait for a :func:`log_chat` write as long as its durability requires; returns the text to append to the reply.
+    
+    By default a plain chat log is not waited for. The wait is shielded, so a
+    client that disconnects meanwhile does not cancel the write.
+    """
+    if chat_durability(task_title) is not Durability.DEFERRED:
+        await asyncio.shield(asyncio.wrap_future(save))
+    return f"\n\nTask created: '{task_title}'" if task_title is not None else ""
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, current_user: dict = Depends(get_current_user)):
+    started = time.perf_counter()
+    
+    # Get AI response (rule-based fallback when Ollama is unavailable);
+    # Ollama calls await on the shared client instead of holding a threadpool slot
+    workspace_id = current_user["workspace_id"]
+    retrieval = await rag_system.aretrieve(request.message, workspace_id, CONTEXT_CANDIDATES)
+    packed = rag_system.pack_context(request.message, retrieval)
+    context = packed["text"]
+    
+    # Same question over the same chunks: reuse the earlier answer
+    result, cache_version = await run_in_threadpool(
+        response_cache.get, workspace_id, request.message, packed["chunk_ids"], retrieval["embedding"]
+    )
+    cached = result is not None
+    if not cached:
+        generate_started = time.perf_counter()
+        result = await submit_generation(current_user, request.message, context).result()
+        if result:
+            await run_in_threadpool(
+                response_cache.put, workspace_id, request.message, packed["chunk_ids"], result,
+                (time.perf_counter() - generate_started) * 1000, cache_version, retrieval["embedding"]
+            )
+    
+    response = result["response"] if result else ai_service.chat(request.message)
+    chat_id = str(uuid.uuid4())
+    
+    # Check if task creation requested
+    tools_called, task_title = chat_tools(request.message)
+    
+    # Save to database, together with the task
+    save = log_chat(chat_id, current_user["id"], request.message, response, {
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        "prompt_tokens": result["prompt_tokens"] if result else None,
+        "completion_tokens": result["completion_tokens"] if result else None,
+        "fallback": result is None,
+        "cached": cached,
+        "context_tokens": packed["tokens"],
+        "sources": packed["sources"],
+        "retrieval_engine": retrieval["engine"]
+    }, task_title)
+    suffix = await wait_for_chat(save, task_title)
     
     return ChatResponse(
-        response=response,
+        response=response + suffix,
         tools_called=tools_called,
-        chat_id=chat_id
+        chat_id=chat_id,
+        sources=packed["sources"] if result else [],
+        retrieval_engine=retrieval["engine"]
     )
 
-# ========== TASK ENDPOINTS ==========
-@app.post("/tasks", response_model=TaskResponse)
-def create_task(task: TaskCreate, current_user: dict = Depends(get_current_user)):
-    task_id = str(uuid.uuid4())
+def submit_generation(current_user: dict, message: str, context: str):
+    """Queue a generation with the scheduler; 429 with Retry-After when it is full"""
+    try:
+        return generation_scheduler.submit(current_user["id"], message, context)
+    except GenerationQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, current_user: dict = Depends(get_current_user)):
+    """Server-sent events: ``token`` events as the model produces text, then one ``done`` event"""
+    started = time.perf_counter()
+    workspace_id = current_user["workspace_id"]
+    retrieval = await rag_system.aretrieve(request.message, workspace_id, CONTEXT_CANDIDATES)
+    packed = rag_system.pack_context(request.message, retrieval)
+    context = packed["text"]
+    cached, cache_version = await run_in_threadpool(
+        response_cache.get, workspace_id, request.message, packed["chunk_ids"], retrieval["embedding"]
+    )
+    chat_id = str(uuid.uuid4())
+    # Queued before the response starts, so a full queue is still a 429
+    job = None if cached else submit_generation(current_user, request.message, context)
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    async def events():
+        parts = []
+        metadata = {"streamed": True, "ttft_ms": None, "fallback": False, "cached": cached is not None,
+                    "context_tokens": packed["tokens"], "sources": packed["sources"],
+                    "retrieval_engine": retrieval["engine"]}
+        tools_called, task_title = chat_tools(request.message)
+        save = None
+        try:
+            try:
+                if cached:
+                    metadata["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    metadata["prompt_tokens"] = cached["prompt_tokens"]
+                    metadata["completion_tokens"] = cached["completion_tokens"]
+                    parts.append(cached["response"])
+                    yield sse_event("token", {"token": cached["response"]})
+                else:
+                    generate_started = time.perf_counter()
+                    async for event in job.events():
+                        if "token" in event:
+                            if metadata["ttft_ms"] is None:
+                                metadata["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                            parts.append(event["token"])
+                            yield sse_event("token", {"token": event["token"]})
+                        else:
+                            metadata["prompt_tokens"] = event["prompt_tokens"]
+                            metadata["completion_tokens"] = event["completion_tokens"]
+                            # Only complete answers are cached
+                            await run_in_threadpool(
+                                response_cache.put, workspace_id, request.message, packed["chunk_ids"],
+                                {"response": "".join(parts), "prompt_tokens": event["prompt_tokens"],
+                                 "completion_tokens": event["completion_tokens"]},
+                                (time.perf_counter() - generate_started) * 1000, cache_version,
+                                retrieval["embedding"]
+                            )
+            except Exception as e:
+                print(f"AI streaming error: {e}")
+                if parts:
+                    metadata["incomplete"] = True
+                else:
+                    # Nothing streamed yet, so answer from the rule-based assistant
+                    metadata["fallback"] = True
+                    metadata["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    parts.append(ai_service.chat(request.message))
+                    yield sse_event("token", {"token": parts[0]})
+            
+            metadata["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            save = log_chat(chat_id, current_user["id"], request.message, "".join(parts), metadata, task_title)
+            suffix = await wait_for_chat(save, task_title)
+            
+            if suffix:
+                yield sse_event("token", {"token": suffix})
+            
+            yield sse_event("done", {
+                "chat_id": chat_id,
+                "tools_called": tools_called,
+                "cached": metadata["cached"],
+                "sources": [] if metadata["fallback"] else packed["sources"],
+                "ttft_ms": metadata["ttft_ms"],
+                "latency_ms": metadata["latency_ms"],
+                "retrieval_engine": retrieval["engine"]
+            })
+        finally:
+            # Client went away mid-stream: keep what was generated, and the task. A write
+            # already queued is shielded from the cancellation, so it is only queued
+            # again if it never went in (queueing again would hit the chat_id key).
+            # The stream task cannot await here, so the retry is write-behind.
+            if save is None or save.cancelled():
+                metadata = {**metadata, "incomplete": True,
+                            "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+                db.submit_write(save_chat, chat_id, current_user["id"], request.message, "".join(parts), metadata,
+                                task_title, durability=Durability.DEFERRED)
     
-    cursor.execute('''
-        INSERT INTO tasks (id, title, description, due_date, priority, linked_documents, user_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (task_id, task.title, task.description, task.due_date, task.priority,
-          json.dumps(task.linked_documents), current_user["id"]))
-    
-    conn.commit()
-    
-    # Get created task
-    cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-    task_data = cursor.fetchone()
-    conn.close()
-    
-    return TaskResponse(
-        id=task_data[0],
-        title=task_data[1],
-        description=task_data[2],
-        due_date=task_data[3],
-        priority=task_data[4],
-        status=task_data[5],
-        linked_documents=json.loads(task_data[6]) if task_data[6] else [],
-        user_id=task_data[7],
-        created_by_ai=bool(task_data[8]),
-        created_at=task_data[9]
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+# ========== TASK ENDPOINTS ==========
+@app.post("/tasks", response_model=TaskResponse)
+async def create_task(task: TaskCreate, current_user: dict = Depends(get_current_user)):
+    # The stored row is built by insert_tasks, so it is not read back
+    tasks = await db.write(insert_tasks, current_user["id"], [task.model_dump()])
+    return tasks[0]
+
 @app.get("/tasks", response_model=List[TaskResponse])
-def list_tasks(
+async def list_tasks(
     status: Optional[str] = None,
     priority: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    query = "SELECT * FROM tasks WHERE user_id = ?"
+    """Newest first, paged like ``GET /documents``"""
+    where = "user_id = ?"
     params = [current_user["id"]]
-    
+
     if status:
-        query += " AND status = ?"
+        where += " AND status = ?"
         params.append(status)
-    
+
     if priority:
-        query += " AND priority = ?"
+        where += " AND priority = ?"
         params.append(priority)
+
+    try:
+        columns = parse_fields(fields, list(TaskResponse.model_fields))
+        tasks, next_cursor = await db.read(keyset_page, "tasks", columns, where, params, cursor, limit)
+    except InvalidPageRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    for t in tasks:
+        if "linked_documents" in t:
+            t["linked_documents"] = json.loads(t["linked_documents"]) if t["linked_documents"] else []
+        if "created_by_ai" in t:
+            t["created_by_ai"] = bool(t["created_by_ai"])
+
+    return paged_response(tasks, next_cursor)
+
+# Bulk endpoints: one transaction per request on the writer, rows written
+# with executemany and results built without reading each row back
+@app.post("/tasks/bulk", response_model=List[TaskResponse])
+async def create_tasks_bulk(request: TaskBulkCreate, current_user: dict = Depends(get_current_user)):
+    return await db.write(insert_tasks, current_user["id"], [t.model_dump() for t in request.tasks])
+
+@app.patch("/tasks/bulk")
+async def update_tasks_bulk(request: TaskBulkUpdate, current_user: dict = Depends(get_current_user)):
+    """Change status and/or priority of many tasks; ids that are not the user's come back as ``missing``"""
+    return await db.write(update_tasks, current_user["id"], [u.model_dump() for u in request.updates])
+
+@app.post("/tasks/bulk/delete")
+async def delete_tasks_bulk(request: TaskBulkDelete, current_user: dict = Depends(get_current_user)):
+    return await db.write(delete_tasks, current_user["id"], request.ids)
+
+def parse_task_lines(lines: list, errors: list):
+    """Validate one batch of NDJSON lines; returns (valid TaskCreate dicts, number rejected).
     
-    query += " ORDER BY created_at DESC"
-    cursor.execute(query, tuple(params))
-    tasks = cursor.fetchall()
-    conn.close()
-    
-    return [TaskResponse(
-        id=t[0],
-        title=t[1],
-        description=t[2],
-        due_date=t[3],
-        priority=t[4],
-        status=t[5],
-        linked_documents=json.loads(t[6]) if t[6] else [],
-        user_id=t[7],
-        created_by_ai=bool(t[8]),
-        created_at=t[9]
-    ) for t in tasks]
+    The first 100 rejected lines are described in ``errors``.
+    """
+    tasks, rejected = [], 0
+    for line_number, line in lines:
+        try:
+            tasks.append(TaskCreate.model_validate_json(line).model_dump())
+        except ValidationError as e:
+            rejected += 1
+            if len(errors) < 100:
+                errors.append({"line": line_number, "error": e.errors(include_url=False)[0]["msg"]})
+    return tasks, rejected
+
+@app.post("/tasks/import")
+async def import_tasks(request: Request, current_user: dict = Depends(get_current_user)):
+    """Stream ``application/x-ndjson``, one TaskCreate object per line.
+    
+    Each batch of lines is committed as it arrives, so a backlog of any size
+    is imported without holding it in memory; invalid lines are skipped and
+    reported with their line numbers.
+    """
+    imported, rejected, errors = 0, 0, []
+    try:
+        async for lines in iter_ndjson_batches(request.stream()):
+            # Parsing runs off the event loop, each batch is one transaction on the writer
+            tasks, failed = await run_in_threadpool(parse_task_lines, lines, errors)
+            if tasks:
+                await db.write(insert_tasks, current_user["id"], tasks)
+            imported += len(tasks)
+            rejected += failed
+    except InvalidImportLine as e:
+        raise HTTPException(status_code=400, detail=f"{e}; {imported} tasks were imported before it")
+    
+    return {"imported": imported, "error_count": rejected, "errors": errors}
 
 # ========== ADMIN ENDPOINTS ==========
 @app.get("/admin/users")
-def admin_users(current_user: dict = Depends(get_current_user)):
+async def admin_users(current_user: dict = Depends(get_current_user)):
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, email, role, created_at FROM users")
-    users = cursor.fetchall()
-    conn.close()
+    users = await db.read(lambda conn: conn.execute("SELECT id, username, email, role, created_at FROM users").fetchall())
     
     return [{
         "id": u[0],
@@ -510,29 +1180,124 @@ def admin_users(current_user: dict = Depends(get_current_user)):
         "created_at": u[4]
     } for u in users]
 
+@app.put("/admin/users/{user_id}/role")
+async def admin_set_role(user_id: int, update: RoleUpdate, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    if update.role not in ("user", "admin"):
+        raise HTTPException(status_code=400, detail="Invalid role")
+
+    def set_role(conn):
+        cursor = conn.execute("UPDATE users SET role = ? WHERE id = ?", (update.role, user_id))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="User not found")
+
+    await db.write(set_role)
+
+    # Cached principals still carry the old role
+    session_store.cache.invalidate_user(user_id)
+
+    return {"id": user_id, "role": update.role}
+
 @app.get("/admin/ai-usage")
-def admin_ai_usage(current_user: dict = Depends(get_current_user)):
+async def admin_ai_usage(current_user: dict = Depends(get_current_user)):
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Admin only")
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    # Maintained on write, so this sums one counter row per user rather than scanning chats and tasks.
+    # tools_called only covers create_task, counted from the tasks the assistant created
+    totals = await db.run(usage_counters.totals)
     
-    cursor.execute("SELECT COUNT(*) FROM chats")
-    total_chats = cursor.fetchone()[0]
+    return {
+        "total_chats": totals.get("chats", 0),
+        "tasks_created_by_ai": totals.get("ai_tasks", 0),
+        "total_users": totals.get("users", 0),
+        "total_tasks": totals.get("tasks", 0),
+        "total_tokens": totals.get("tokens", 0),
+        "tools_called": await db.run(usage_counters.tools),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/ai-usage/daily")
+async def admin_ai_usage_daily(
+    days: int = Query(30, ge=1, le=USAGE_DAILY_MAX_DAYS),
+    workspace_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Chats, tokens, average latency and tasks per day (UTC), from the daily rollups"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
     
-    cursor.execute("SELECT COUNT(*) FROM tasks WHERE created_by_ai = 1")
-    ai_tasks = cursor.fetchone()[0]
+    return {
+        "days": await db.run(usage_counters.daily, days, workspace_id),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/ai-usage/top")
+async def admin_ai_usage_top(
+    by: str = Query("user", pattern="^(user|workspace|tool)$"),
+    metric: str = Query("chats", pattern="^(chats|tokens|tasks|calls)$"),
+    limit: int = Query(10, ge=1, le=100),
+    current_user: dict = Depends(get_current_user)
+):
+    """Users, workspaces or tools with the highest counter"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
     
-    cursor.execute("SELECT COUNT(*) FROM users")
-    total_users = cursor.fetchone()[0]
+    return {
+        "top": await db.run(usage_counters.top, by, metric, limit),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/response-cache")
+async def admin_response_cache(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
     
-    conn.close()
+    return {
+        **await db.run(response_cache.stats),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/generation-queue")
+def admin_generation_queue(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
     
     return {
-        "total_chats": total_chats,
-        "tasks_created_by_ai": ai_tasks,
-        "total_users": total_users,
+        **generation_scheduler.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/vector-store")
+def admin_vector_store(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    
+    return {
+        **rag_system.collections.stats(),
+        "memory_index": rag_system.vector_indexes.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/embedding-cache")
+async def admin_embedding_cache(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    
+    return {
+        **await db.run(embedding_cache.stats),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/admin/database")
+def admin_database(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    
+    return {
+        **db.stats(),
         "timestamp": datetime.now().isoformat()
     }
 
@@ -546,6 +1311,25 @@ def root():
         "docs": "/docs"
     }
 
+def collect_gauges():
+    """Scrape-time gauges from state the components already keep"""
+    queue = generation_scheduler.stats()
+    yield "generation_queue_depth", "Chat generations waiting for a slot", {(): queue["queued"]}
+    yield "generation_running", "Chat generations running on Ollama", {(): queue["running"]}
+    pool = db_pool.stats()
+    yield "sqlite_pool_connections_open", "Connections opened by the main database pool", {(): pool["open"]}
+    yield "sqlite_pool_connections_idle", "Open connections not currently borrowed", {(): pool["idle"]}
+    yield "sqlite_writes_queued", "Writes waiting for the database writer thread", {(): db.stats()["writes_queued"]}
+
+metrics.REGISTRY.collector((), collect_gauges)
+
+# Unauthenticated like /health, for Prometheus to scrape; METRICS_ENABLED=false turns it off
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 def health():
     db_exists = os.path.exists(DB_PATH)
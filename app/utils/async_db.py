@@ -0,0 +1,244 @@
+import asyncio
+import enum
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from utils.db_pool import ConnectionPool, DB_PATH, PRAGMAS
+from utils.metrics import observe_stage
+
+# Threads (each with its own connection) serving reads; WAL lets them run alongside the writer
+DB_READ_THREADS = int(os.getenv("DB_READ_THREADS", "8"))
+# Group commit: after the first queued write, wait this long for more before committing them together
+DB_GROUP_COMMIT_MS = float(os.getenv("DB_GROUP_COMMIT_MS", "2"))
+# Most writes committed in one transaction
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "256"))
+
+
+class Durability(str, enum.Enum):
+    DEFERRED = "deferred"      # write-behind: the caller continues once the write is queued
+    NORMAL = "normal"          # awaited until committed to the WAL (synced at the next checkpoint)
+    FULL = "full"              # awaited until committed and fsynced
+
+
+_STRENGTH = [Durability.DEFERRED, Durability.NORMAL, Durability.FULL]
+
+
+def _awaited_durability(name: str, default: str) -> Durability:
+    """A durability setting for writes whose result the handler uses, so it cannot be deferred"""
+    level = Durability(os.getenv(name, default))
+    if level is Durability.DEFERRED:
+        raise ValueError(f"{name} cannot be 'deferred': only chat logs (CHAT_LOG_DURABILITY) are write-behind")
+    return level
+
+
+# Per write type (full / normal / deferred): chat logs are write-behind by default,
+# AI-created tasks are awaited because the reply says the task exists; every other
+# write returns something the handler uses, so only chat logs may be deferred
+CHAT_LOG_DURABILITY = Durability(os.getenv("CHAT_LOG_DURABILITY", "deferred"))
+AI_TASK_DURABILITY = _awaited_durability("AI_TASK_DURABILITY", "normal")
+DB_WRITE_DURABILITY = _awaited_durability("DB_WRITE_DURABILITY", "normal")
+
+
+def strongest(*levels: Durability) -> Durability:
+    """The level that satisfies all of ``levels``, for writes that combine several types"""
+    return max(levels, key=_STRENGTH.index)
+
+
+class _Write:
+    __slots__ = ("fn", "args", "future", "durability", "queued_at")
+
+    def __init__(self, fn: Callable, args: tuple, durability: Durability):
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+        self.durability = durability
+        self.queued_at = time.perf_counter()
+
+
+class AsyncDatabase:
+    """Awaitable SQLite access for the request handlers.
+
+    Reads run on ``readers`` dedicated threads, each borrowing a pooled
+    connection; every write runs on one writer thread with its own
+    connection, so writes never wait on each other for SQLite's lock and
+    never take a thread from Starlette's shared threadpool. Handlers await
+    the result and the event loop is free in the meantime.
+
+    Work is passed as a function taking the connection first::
+
+        row = await db.read(lambda conn: conn.execute(...).fetchone())
+        await db.write(insert_chat, chat_id, user_id, ...)
+
+    The writer group-commits: it takes every write queued within
+    ``group_commit_ms`` of the first (up to ``batch_size``), runs each in
+    its own savepoint and commits them in one transaction, so concurrent
+    requests share one commit instead of queueing for one each. A write
+    that raises is rolled back alone; the rest of the batch still commits.
+    Write functions must not commit themselves.
+
+    ``durability`` decides what a write waits for (see :class:`Durability`);
+    a batch containing a FULL write is committed with ``synchronous=FULL``.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, readers: int = DB_READ_THREADS,
+                 batch_size: int = DB_WRITE_BATCH, group_commit_ms: float = DB_GROUP_COMMIT_MS):
+        self.db_path = db_path
+        self.readers = max(1, readers)
+        self.batch_size = max(1, batch_size)
+        self.group_commit = group_commit_ms / 1000
+        self.read_pool = ConnectionPool(db_path, size=self.readers)
+        self._read_executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-read")
+        self._writes: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        self._stats = {"reads": 0, "writes": 0, "write_errors": 0, "commits": 0, "largest_batch": 0}
+
+    # ----- reads -----
+
+    def _read(self, fn: Callable, args: tuple):
+        with self.read_pool.connection() as conn:
+            return fn(conn, *args)
+
+    async def read(self, fn: Callable, *args) -> Any:
+        """``fn(conn, *args)`` on a reader thread"""
+        self._stats["reads"] += 1
+        return await asyncio.wrap_future(self._read_executor.submit(self._read, fn, args))
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """``fn(*args)`` on a reader thread, for components that manage their own connections"""
+        return await asyncio.wrap_future(self._read_executor.submit(fn, *args))
+
+    # ----- writes -----
+
+    def submit_write(self, fn: Callable, *args, durability: Durability = DB_WRITE_DURABILITY) -> Future:
+        """Queue ``fn(conn, *args)`` for the writer without waiting for it.
+
+        The returned future resolves once the write's batch is committed.
+        Failures of DEFERRED writes are logged, as nobody awaits them.
+        """
+        self._start_writer()
+        write = _Write(fn, args, durability)
+        if durability is Durability.DEFERRED:
+            write.future.add_done_callback(self._log_failure)
+        self._writes.put(write)
+        return write.future
+
+    async def write(self, fn: Callable, *args, durability: Durability = DB_WRITE_DURABILITY) -> Any:
+        """``fn(conn, *args)`` on the writer thread; returns its result once committed.
+
+        Errors raised by ``fn`` reach the caller. Write-behind (DEFERRED)
+        writes have no result to wait for: queue them with :meth:`submit_write`.
+        """
+        if durability is Durability.DEFERRED:
+            raise ValueError("write() waits for the result; queue deferred writes with submit_write()")
+        return await asyncio.wrap_future(self.submit_write(fn, *args, durability=durability))
+
+    @staticmethod
+    def _log_failure(future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Deferred database write failed: {future.exception()}")
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+                self._writer.start()
+
+    def _next_batch(self):
+        """Block for a write, then gather more until the window closes; returns (batch, stop)"""
+        first = self._writes.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.group_commit
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.perf_counter()
+                item = self._writes.get(timeout=remaining) if remaining > 0 else self._writes.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write_loop(self):
+        # The connection is only ever used from this thread
+        conn = self.read_pool.dedicated()
+        try:
+            while True:
+                batch, stop = self._next_batch()
+                batch = [write for write in batch if write.future.set_running_or_notify_cancel()]
+                if batch:
+                    started = time.perf_counter()
+                    for write in batch:
+                        observe_stage("sqlite_write_wait", started - write.queued_at)
+                    self._commit_batch(conn, batch)
+                    observe_stage("sqlite_write", time.perf_counter() - started)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch: List[_Write]):
+        full = any(write.durability is Durability.FULL for write in batch)
+        results = []
+        try:
+            if full:
+                conn.execute("PRAGMA synchronous = FULL")
+            # Takes the write lock up front, so reads inside a write cannot go stale
+            conn.execute("BEGIN IMMEDIATE")
+            for write in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    result = write.fn(conn, *write.args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    results.append((write, None, e))
+                    continue
+                conn.execute("RELEASE write")
+                results.append((write, result, None))
+            conn.commit()
+        except BaseException as e:
+            # The transaction itself failed: nothing in the batch was written
+            if conn.in_transaction:
+                conn.rollback()
+            self._stats["write_errors"] += len(batch)
+            for write in batch:
+                write.future.set_exception(e)
+            return
+        finally:
+            if full:
+                conn.execute(f"PRAGMA synchronous = {PRAGMAS['synchronous']}")
+
+        self._stats["commits"] += 1
+        self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+        for write, result, error in results:
+            if error is None:
+                self._stats["writes"] += 1
+                write.future.set_result(result)
+            else:
+                self._stats["write_errors"] += 1
+                write.future.set_exception(error)
+
+    def stats(self):
+        commits = self._stats["commits"]
+        return {**self._stats, "readers": self.readers, "writes_queued": self._writes.qsize(),
+                "writes_per_commit": round(self._stats["writes"] / commits, 2) if commits else 0.0,
+                "read_pool": self.read_pool.stats()}
+
+    def close(self):
+        """Finish queued writes, then stop the writer and close every connection"""
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        self._read_executor.shutdown(wait=True)
+        self.read_pool.close()
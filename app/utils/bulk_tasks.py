@@ -0,0 +1,116 @@
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Set, Tuple
+
+# Tasks per JSON bulk request; bigger backlogs go through the NDJSON import
+TASK_BULK_MAX = int(os.getenv("TASK_BULK_MAX", "10000"))
+# NDJSON lines validated and committed together during an import
+TASK_IMPORT_BATCH = int(os.getenv("TASK_IMPORT_BATCH", "5000"))
+# Longest NDJSON line accepted, so one runaway line cannot exhaust memory
+TASK_IMPORT_MAX_LINE = int(os.getenv("TASK_IMPORT_MAX_LINE", str(64 * 1024)))
+
+SQLITE_MAX_PARAMS = 500
+
+
+class InvalidImportLine(ValueError):
+    """An NDJSON import body that cannot be split into lines"""
+
+
+def utc_timestamp() -> str:
+    """Now, formatted like SQLite's CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def insert_tasks(conn, user_id: int, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert ``tasks`` (TaskCreate fields) with one ``executemany``; returns the stored rows.
+
+    ids and ``created_at`` are assigned here rather than by SQLite, so the
+    result is built without reading the rows back. The caller commits.
+    """
+    created_at = utc_timestamp()
+    rows = [{
+        "id": str(uuid.uuid4()),
+        "title": task["title"],
+        "description": task.get("description"),
+        "due_date": task.get("due_date"),
+        "priority": task.get("priority") or "medium",
+        "status": "todo",
+        "linked_documents": task.get("linked_documents") or [],
+        "user_id": user_id,
+        "created_by_ai": False,
+        "created_at": created_at
+    } for task in tasks]
+    conn.executemany('''
+        INSERT INTO tasks (id, title, description, due_date, priority, status, linked_documents, user_id,
+                           created_by_ai, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(r["id"], r["title"], r["description"], r["due_date"], r["priority"], r["status"],
+           json.dumps(r["linked_documents"]), user_id, False, created_at) for r in rows])
+    return rows
+
+
+def owned_ids(conn, user_id: int, ids: List[str]) -> Set[str]:
+    """The subset of ``ids`` that are tasks of ``user_id``"""
+    found = set()
+    distinct = list(dict.fromkeys(ids))
+    for start in range(0, len(distinct), SQLITE_MAX_PARAMS):
+        batch = distinct[start:start + SQLITE_MAX_PARAMS]
+        marks = ",".join("?" * len(batch))
+        # Filtered on user_id here: in SQL the planner prefers the user_id index
+        # and walks every task of the user for each batch
+        found.update(row[0] for row in conn.execute(f"SELECT id, user_id FROM tasks WHERE id IN ({marks})", batch)
+                     if row[1] == user_id)
+    return found
+
+
+def update_tasks(conn, user_id: int, updates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Set ``status`` and/or ``priority`` per ``{"id", "status", "priority"}`` item.
+
+    Fields left out (None) keep their value. Ids that are not the user's
+    tasks are reported as missing rather than failing the batch. The
+    caller commits.
+    """
+    found = owned_ids(conn, user_id, [u["id"] for u in updates])
+    rows = [(u.get("status"), u.get("priority"), u["id"], user_id) for u in updates if u["id"] in found]
+    conn.executemany('''
+        UPDATE tasks SET status = COALESCE(?, status), priority = COALESCE(?, priority)
+        WHERE id = ? AND user_id = ?
+    ''', rows)
+    return {"updated": len(found), "missing": [u["id"] for u in updates if u["id"] not in found]}
+
+
+def delete_tasks(conn, user_id: int, ids: List[str]) -> Dict[str, Any]:
+    """Delete the user's tasks among ``ids``; the caller commits"""
+    found = owned_ids(conn, user_id, ids)
+    conn.executemany("DELETE FROM tasks WHERE id = ? AND user_id = ?", [(task_id, user_id) for task_id in found])
+    return {"deleted": len(found), "missing": [task_id for task_id in dict.fromkeys(ids) if task_id not in found]}
+
+
+async def iter_ndjson_batches(chunks: AsyncIterator[bytes], batch_size: int = TASK_IMPORT_BATCH,
+                              max_line: int = TASK_IMPORT_MAX_LINE) -> AsyncIterator[List[Tuple[int, bytes]]]:
+    """Group a streamed NDJSON body into batches of ``(line number, line)``; blank lines are skipped.
+
+    Lines are not parsed here, so the caller can decode a whole batch off
+    the event loop.
+    """
+    batch, pending, line_number = [], b"", 0
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        if len(pending) > max_line:
+            raise InvalidImportLine(f"Line {line_number + len(lines) + 1} is longer than {max_line} bytes")
+        for line in lines:
+            line_number += 1
+            if len(line) > max_line:
+                raise InvalidImportLine(f"Line {line_number} is longer than {max_line} bytes")
+            if line.strip():
+                batch.append((line_number, line))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if pending.strip():
+        batch.append((line_number + 1, pending))
+    if batch:
+        yield batch
@@ -0,0 +1,239 @@
+import codecs
+import os
+import re
+from typing import Callable, Iterable, Iterator, Dict, Any, List, Optional
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+TEXT_READ_BLOCK = 1024 * 1024
+
+# Text without a newline is cut into pieces of this many characters
+MAX_LINE_CHARS = 64 * 1024
+
+_TOKEN = re.compile(r"\w{1,6}|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+_HEADING = re.compile(r"#{1,6}[ \t]")
+_PIECE = re.compile(r"\s*\S+\s*")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate subword token count: one per punctuation mark, one per 6 word characters"""
+    return len(_TOKEN.findall(text))
+
+
+def iter_text_file(file_path: str, block_size: int = TEXT_READ_BLOCK) -> Iterator[str]:
+    """Decoded blocks of a text file; UTF-8, or Latin-1 if the file is not valid UTF-8"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    encoding = "utf-8"
+    try:
+        with open(file_path, "rb") as f:
+            for raw in iter(lambda: f.read(block_size), b""):
+                decoder.decode(raw)
+            decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        encoding = "latin-1"
+
+    with open(file_path, "r", encoding=encoding, newline="") as f:
+        for block in iter(lambda: f.read(block_size), ""):
+            yield block
+
+
+class _Unit:
+    """A sentence (or heading line) plus its trailing whitespace"""
+    __slots__ = ("text", "start", "tokens", "heading", "paragraph_end")
+
+    def __init__(self, text: str, start: int, tokens: int, heading: bool = False, paragraph_end: bool = False):
+        self.text = text
+        self.start = start
+        self.tokens = tokens
+        self.heading = heading
+        self.paragraph_end = paragraph_end
+
+
+class Chunker:
+    """Streaming, token-sized chunking that respects document structure.
+
+    Text arrives as an iterable of blocks of any size and chunks are yielded
+    as soon as they are complete, so memory stays bounded by one chunk plus
+    one line. Chunks end at sentence ends, and at a paragraph end once they
+    are three quarters full; a markdown heading always starts a new chunk.
+    Consecutive chunks share up to ``overlap_tokens`` of whole sentences.
+    Each chunk is ``{"text", "char_start", "char_end", "tokens", "heading"}``
+    with offsets into the concatenated input.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        self.max_tokens = max(1, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+        self.count_tokens = count_tokens
+
+    def chunks(self, blocks: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        state = {"units": [], "tokens": 0, "heading": None, "chunk_heading": None}
+        for unit in self._units(blocks):
+            yield from self._add(state, unit)
+        if state["units"]:
+            chunk = self._emit(state)
+            if chunk:
+                yield chunk
+
+    # ---------- structure ----------
+    def _lines(self, blocks: Iterable[str]) -> Iterator[tuple]:
+        """``(text, offset, at_line_start)``; long lines come out in several pieces"""
+        carry, carry_start, at_line_start = "", 0, True
+        for block in blocks:
+            carry += block
+            lines = carry.split("\n")
+            carry = lines.pop()
+            for line in lines:
+                yield line + "\n", carry_start, at_line_start
+                carry_start += len(line) + 1
+                at_line_start = True
+            while len(carry) > MAX_LINE_CHARS:
+                yield carry[:MAX_LINE_CHARS], carry_start, at_line_start
+                carry, carry_start, at_line_start = carry[MAX_LINE_CHARS:], carry_start + MAX_LINE_CHARS, False
+        if carry:
+            yield carry, carry_start, at_line_start
+
+    def _units(self, blocks: Iterable[str]) -> Iterator[_Unit]:
+        pending, pending_start = "", 0
+        for line, offset, at_line_start in self._lines(blocks):
+            if at_line_start and not line.strip():
+                # Blank line: the paragraph (and its last sentence) ends here
+                pending += line
+                if pending.strip():
+                    yield from self._sentences(pending, pending_start, paragraph_end=True)
+                elif pending:
+                    yield _Unit(pending, pending_start, 0, paragraph_end=True)
+                pending, pending_start = "", offset + len(line)
+                continue
+
+            if at_line_start and _HEADING.match(line):
+                if pending:
+                    yield from self._sentences(pending, pending_start, paragraph_end=True)
+                yield _Unit(line, offset, self.count_tokens(line), heading=True)
+                pending, pending_start = "", offset + len(line)
+                continue
+
+            if not pending:
+                pending_start = offset
+            scanned = len(pending)
+            pending += line
+            # Hand complete sentences on; keep the unfinished one. Only the new
+            # line is scanned: earlier text in ``pending`` has no sentence end.
+            last = None
+            for last in _SENTENCE_END.finditer(pending, scanned):
+                pass
+            if last is not None:
+                yield from self._sentences(pending[:last.end()], pending_start)
+                pending_start += last.end()
+                pending = pending[last.end():]
+            elif len(pending) > MAX_LINE_CHARS:
+                yield from self._sentences(pending, pending_start)
+                pending_start += len(pending)
+                pending = ""
+
+        if pending:
+            yield from self._sentences(pending, pending_start, paragraph_end=True)
+
+    def _sentences(self, text: str, start: int, paragraph_end: bool = False) -> Iterator[_Unit]:
+        position = 0
+        pieces = []
+        for match in _SENTENCE_END.finditer(text):
+            pieces.append(text[position:match.end()])
+            position = match.end()
+        if position < len(text):
+            pieces.append(text[position:])
+
+        for i, piece in enumerate(pieces):
+            last = paragraph_end and i == len(pieces) - 1
+            tokens = self.count_tokens(piece)
+            if tokens <= self.max_tokens:
+                yield _Unit(piece, start, tokens, paragraph_end=last)
+            else:
+                yield from self._split_long(piece, start, last)
+            start += len(piece)
+
+    def _split_long(self, text: str, start: int, paragraph_end: bool) -> Iterator[_Unit]:
+        """A sentence over the token budget, cut between words"""
+        part, part_start, tokens = "", start, 0
+        for match in _PIECE.finditer(text):
+            piece = match.group()
+            piece_tokens = self.count_tokens(piece)
+            if part and tokens + piece_tokens > self.max_tokens:
+                yield _Unit(part, part_start, tokens)
+                part_start += len(part)
+                part, tokens = "", 0
+            part += piece
+            tokens += piece_tokens
+        if part:
+            yield _Unit(part, part_start, tokens, paragraph_end=paragraph_end)
+
+    # ---------- assembly ----------
+    def _add(self, state: Dict[str, Any], unit: _Unit) -> Iterator[Dict[str, Any]]:
+        if unit.heading:
+            if state["units"]:
+                chunk = self._emit(state)
+                if chunk:
+                    yield chunk
+            state["units"], state["tokens"] = [], 0
+            state["heading"] = unit.text.strip().lstrip("#").strip()
+            state["chunk_heading"] = state["heading"]
+            state["units"].append(unit)
+            state["tokens"] = unit.tokens
+            return
+
+        if state["tokens"] + unit.tokens > self.max_tokens and self._has_body(state):
+            chunk = self._emit(state)
+            if chunk:
+                yield chunk
+            self._carry_overlap(state, unit.tokens)
+
+        if not state["units"]:
+            state["chunk_heading"] = state["heading"]
+        state["units"].append(unit)
+        state["tokens"] += unit.tokens
+
+        if unit.paragraph_end and state["tokens"] >= self.max_tokens * 0.75:
+            chunk = self._emit(state)
+            if chunk:
+                yield chunk
+            self._carry_overlap(state, 0)
+
+    @staticmethod
+    def _has_body(state: Dict[str, Any]) -> bool:
+        return any(not u.heading and u.tokens for u in state["units"])
+
+    def _carry_overlap(self, state: Dict[str, Any], incoming: int):
+        """Start the next chunk with the trailing sentences that fit in the overlap"""
+        kept, tokens = [], 0
+        for unit in reversed(state["units"]):
+            if unit.heading or tokens + unit.tokens > self.overlap_tokens:
+                break
+            kept.append(unit)
+            tokens += unit.tokens
+        if tokens + incoming > self.max_tokens:
+            kept, tokens = [], 0
+        state["units"], state["tokens"] = kept[::-1], tokens
+        state["chunk_heading"] = state["heading"]
+
+    def _emit(self, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        units: List[_Unit] = state["units"]
+        text = "".join(u.text for u in units)
+        stripped = text.strip()
+        if not stripped:
+            return None
+        char_start = units[0].start + (len(text) - len(text.lstrip()))
+        return {
+            "text": stripped,
+            "char_start": char_start,
+            "char_end": char_start + len(stripped),
+            "tokens": state["tokens"],
+            "heading": state["chunk_heading"],
+        }
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """Chunk an in-memory string; see :class:`Chunker`"""
+    return [c["text"] for c in Chunker(max_tokens, overlap_tokens).chunks([text])]
@@ -0,0 +1,176 @@
+import os
+import re
+from typing import List, Dict, Any, Optional, Callable
+
+from utils.chunker import estimate_tokens
+
+# Ollama's default context window; set OLLAMA_NUM_CTX if the server is configured larger
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+# Upper bound on document context per prompt, whatever the window allows
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1200"))
+# Chunks retrieved per chat turn; the packer keeps as many as fit the budget
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+
+# Context windows the models were trained with; OLLAMA_NUM_CTX is capped to these
+MODEL_CONTEXT_WINDOWS = {
+    "mistral": 32768, "mixtral": 32768, "llama2": 4096, "llama3": 8192, "llama3.1": 131072,
+    "llama3.2": 131072, "phi": 2048, "phi3": 4096, "gemma": 8192, "gemma2": 8192,
+    "qwen2": 32768, "tinyllama": 2048, "orca-mini": 2048,
+}
+
+# Below this many free tokens the packer stops looking for a chunk that fits
+MIN_PASSAGE_TOKENS = 32
+# Characters of whitespace allowed between two chunks that still count as adjacent
+ADJACENT_GAP = 2
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+
+def context_window(model: str) -> int:
+    """Tokens Ollama will evaluate for ``model``: OLLAMA_NUM_CTX, capped to the model's window"""
+    family = model.split(":")[0].lower()
+    return min(OLLAMA_NUM_CTX, MODEL_CONTEXT_WINDOWS.get(family, OLLAMA_NUM_CTX))
+
+
+def context_budget(model: str, reserved_tokens: int) -> int:
+    """Tokens left for document context after the prompt template, query and answer"""
+    return max(0, min(CONTEXT_MAX_TOKENS, context_window(model) - reserved_tokens))
+
+
+def truncate_to_tokens(text: str, budget: int, count_tokens: Callable[[str], int] = estimate_tokens) -> str:
+    """Longest prefix of whole sentences within ``budget`` tokens (whole words if no sentence fits)"""
+    if count_tokens(text) <= budget:
+        return text
+    kept, used = [], 0
+    position = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentence = text[position:match.end()]
+        tokens = count_tokens(sentence)
+        if used + tokens > budget:
+            break
+        kept.append(sentence)
+        used += tokens
+        position = match.end()
+    if kept:
+        return "".join(kept).rstrip()
+
+    words, used = [], 0
+    for word in text.split():
+        used += count_tokens(word)
+        if used > budget:
+            break
+        words.append(word)
+    return " ".join(words)
+
+
+def source_label(meta: Dict[str, Any]) -> str:
+    """``report.pdf, pp. 3-4 - Heading`` for a passage header"""
+    label = meta.get("filename") or meta.get("document_id") or "document"
+    page_start, page_end = meta.get("page_start"), meta.get("page_end")
+    if page_start is not None and label.lower().endswith(".pdf"):
+        label += f", p. {page_start}" if page_start == page_end else f", pp. {page_start}-{page_end}"
+    if meta.get("heading"):
+        label += f" - {meta['heading'].lstrip('#').strip()}"
+    return label
+
+
+def _adjacent(previous: Dict[str, Any], chunk: Dict[str, Any]) -> bool:
+    before, after = previous["metadata"], chunk["metadata"]
+    if before.get("char_end") is not None and after.get("char_start") is not None:
+        return after["char_start"] <= before["char_end"] + ADJACENT_GAP
+    if before.get("chunk_index") is not None and after.get("chunk_index") is not None:
+        return after["chunk_index"] == before["chunk_index"] + 1
+    return False
+
+
+def _merge(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Join runs of adjacent chunks of the same document into one passage each.
+
+    Chunks are ``{"id", "text", "metadata", "rank"}``; a passage keeps the
+    best rank of its chunks. Text the two chunks share is included once.
+    """
+    by_document: Dict[str, List[Dict[str, Any]]] = {}
+    for chunk in chunks:
+        key = chunk["metadata"].get("document_id") or chunk["id"]
+        by_document.setdefault(key, []).append(chunk)
+
+    passages = []
+    for group in by_document.values():
+        group.sort(key=lambda c: (c["metadata"].get("char_start", c["metadata"].get("chunk_index", 0))))
+        current = None
+        for chunk in group:
+            if current is not None and _adjacent(current["last"], chunk):
+                text = chunk["text"]
+                overlap = current["last"]["metadata"].get("char_end", 0) - chunk["metadata"].get("char_start", 0)
+                if overlap > 0:
+                    text = text[overlap:].lstrip()
+                if text:
+                    current["text"] += " " + text
+                current["chunks"].append(chunk)
+                current["rank"] = min(current["rank"], chunk["rank"])
+                current["last"] = chunk
+                continue
+            current = {"text": chunk["text"], "chunks": [chunk], "rank": chunk["rank"], "last": chunk}
+            passages.append(current)
+    return sorted(passages, key=lambda p: p["rank"])
+
+
+def pack_context(chunks: List[Dict[str, Any]], budget: int,
+                 count_tokens: Callable[[str], int] = estimate_tokens) -> Dict[str, Any]:
+    """Fit ranked chunks into ``budget`` tokens of numbered, cited passages.
+
+    ``chunks`` are ``{"id", "text", "metadata"}``, most relevant first. They
+    are taken greedily in rank order, skipping any that no longer fit (a
+    later, shorter chunk may still); the best chunk is cut at a sentence
+    end rather than dropped if it alone is over budget. Adjacent chunks of
+    one document are then merged, so each passage gets one ``[n] source``
+    header. Returns ``{"text", "sources", "tokens", "chunk_ids"}``; sources
+    are ``{"ref", "document_id", "filename", "label", "chunk_ids"}``.
+    """
+    selected, remaining = [], budget
+    for rank, chunk in enumerate(chunks):
+        if remaining < MIN_PASSAGE_TOKENS:
+            break
+        meta = chunk.get("metadata") or {}
+        # Header cost is charged per chunk; merging only makes the result smaller
+        header = count_tokens(f"[{len(selected) + 1}] {source_label(meta)}\n\n")
+        text = chunk["text"].strip()
+        tokens = count_tokens(text) + header
+        if tokens > remaining:
+            if selected:
+                continue
+            text = truncate_to_tokens(text, remaining - header, count_tokens)
+            if not text:
+                continue
+            tokens = count_tokens(text) + header
+        selected.append({"id": chunk["id"], "text": text, "metadata": meta, "rank": rank})
+        remaining -= tokens
+
+    parts, sources = [], []
+    for ref, passage in enumerate(_merge(selected), start=1):
+        meta = dict(passage["chunks"][0]["metadata"])
+        meta["page_end"] = passage["last"]["metadata"].get("page_end", meta.get("page_end"))
+        label = source_label(meta)
+        parts.append(f"[{ref}] {label}\n{passage['text']}")
+        sources.append({
+            "ref": ref,
+            "document_id": meta.get("document_id"),
+            "filename": meta.get("filename"),
+            "label": label,
+            "chunk_ids": [c["id"] for c in passage["chunks"]]
+        })
+
+    text = "\n\n".join(parts)
+    return {
+        "text": text,
+        "sources": sources,
+        "tokens": count_tokens(text),
+        "chunk_ids": [c["id"] for c in selected]
+    }
+
+
+def chunks_from_retrieval(retrieval: Dict[str, Any], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """``RAGSystem.retrieve`` output as the ranked chunk list :func:`pack_context` takes"""
+    chunks = [{"id": chunk_id, "text": text, "metadata": meta or {}}
+              for chunk_id, text, meta in zip(retrieval["ids"], retrieval["documents"], retrieval["metadatas"])]
+    return chunks[:limit] if limit else chunks
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import queue
+import os
+import time
+from contextlib import contextmanager
+
+from utils.metrics import observe_stage
+
+DB_PATH = os.getenv("DB_PATH", "database/ai_workspace.db")
+
+# Pool / pragma tuning (override through the environment)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("DB_CACHE_SIZE", "-64000")),      # negative = KiB (64 MB)
+    "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT", "5000")),    # ms
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived SQLite connections.
+
+    Connections are opened lazily up to ``size`` and handed out with
+    :meth:`connection`. Each one keeps its own prepared-statement cache
+    (``cached_statements``), so the same SQL text executed repeatedly is
+    only compiled once per connection.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=PRAGMAS["busy_timeout"] / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def dedicated(self) -> sqlite3.Connection:
+        """A new connection with the pool's settings that the caller owns and closes"""
+        return self._connect()
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        # Every connection is busy: this wait is what an undersized pool costs
+        started = time.perf_counter()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection available after {self.timeout}s")
+        finally:
+            observe_stage("sqlite_pool_wait", time.perf_counter() - started)
+
+    def _release(self, conn: sqlite3.Connection):
+        # Never hand a connection with an open transaction to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a ``with`` block.
+
+        The time it is held (the queries and the commit) is recorded as the
+        ``sqlite`` stage.
+        """
+        conn = self._acquire()
+        acquired = time.perf_counter()
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+            observe_stage("sqlite", time.perf_counter() - acquired)
+
+    def stats(self):
+        return {"size": self.size, "open": self._created, "idle": self._idle.qsize()}
+
+    def close(self):
+        """Close every idle connection; busy ones are closed on release"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def ensure_column(cursor, table: str, column: str, definition: str):
+    """Add ``column`` to an existing ``table`` (CREATE TABLE IF NOT EXISTS never alters)"""
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any
+
+from utils.db_pool import ConnectionPool
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "database/embedding_cache.db")
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "5000"))
+
+# Counters and last-used times are flushed to SQLite in batches, so lookups stay read-only
+# while every process still sees the totals and eviction order
+STATS_FLUSH_LOOKUPS = 100
+STATS_FLUSH_SECONDS = 10.0
+SQLITE_MAX_PARAMS = 500
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode()).hexdigest()
+
+
+def pack_vector(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model, normalized text hash).
+
+    Vectors are stored as float32 blobs in a dedicated SQLite file, with an
+    in-memory LRU in front. When the stored vectors exceed ``max_bytes`` the
+    least recently used rows are evicted; hits record their last-used time
+    in memory and it reaches SQLite with the next stats flush.
+    """
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, max_bytes: int = EMBED_CACHE_MAX_BYTES,
+                 memory_items: int = EMBED_CACHE_MEMORY_ITEMS):
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.pool = ConnectionPool(path, size=4)
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = {"hits": 0, "misses": 0, "memory_hits": 0,
+                         "embedded_texts": 0, "embed_ms": 0}
+        self._pending_lookups = 0
+        self._touched: Dict[tuple, float] = {}
+        self._last_flush = time.monotonic()
+
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.executemany("INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)",
+                             [(name,) for name in list(self._pending) + ["bytes"]])
+            conn.commit()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors aligned with ``texts``; None where missing"""
+        keys = [(model, text_hash(t)) for t in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        lookup = {}
+        now = time.time()
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    # Buffered like disk hits, so the hottest vectors are not evicted first
+                    self._touched[key] = now
+                    results[i] = vector
+                    self._pending["memory_hits"] += 1
+                else:
+                    lookup.setdefault(key[1], []).append(i)
+
+        if lookup:
+            found = {}
+            hashes = list(lookup)
+            with self.pool.connection() as conn:
+                for start in range(0, len(hashes), SQLITE_MAX_PARAMS):
+                    part = hashes[start:start + SQLITE_MAX_PARAMS]
+                    rows = conn.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                        [model, *part]
+                    ).fetchall()
+                    found.update((h, unpack_vector(blob)) for h, blob in rows)
+
+            with self._lock:
+                for h, vector in found.items():
+                    self._touched[(model, h)] = now
+                    self._remember((model, h), vector)
+                    for i in lookup[h]:
+                        results[i] = vector
+
+        hits = sum(1 for r in results if r is not None)
+        self._count(hits=hits, misses=len(texts) - hits)
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        now = time.time()
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            rows[text_hash(text)] = (model, text_hash(text), len(vector), pack_vector(vector), now)
+
+        with self.pool.connection() as conn:
+            added = 0
+            for row in rows.values():
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (model, text_hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                    row
+                )
+                if cursor.rowcount:
+                    added += len(row[3])
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'bytes'", (added,))
+            conn.commit()
+            total = conn.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()[0]
+
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                self._remember((model, text_hash(text)), vector)
+
+        if total > self.max_bytes:
+            self.evict(int(self.max_bytes * 0.9))
+
+    def evict(self, target_bytes: int):
+        """Drop least recently used vectors until the store is under ``target_bytes``"""
+        self.flush()
+        with self.pool.connection() as conn:
+            total = conn.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()[0]
+            victims = []
+            for model, key, size in conn.execute(
+                "SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used"
+            ):
+                if total <= target_bytes:
+                    break
+                victims.append((model, key))
+                total -= size
+            conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", victims)
+            conn.execute("UPDATE stats SET value = ? WHERE name = 'bytes'", (max(total, 0),))
+            conn.commit()
+
+    def record_embedding_time(self, count: int, seconds: float):
+        """Track time spent on cache misses so savings can be estimated"""
+        self._count(embedded_texts=count, embed_ms=int(seconds * 1000))
+
+    def stats(self) -> Dict[str, Any]:
+        self.flush()
+        with self.pool.connection() as conn:
+            values = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+        lookups = values["hits"] + values["misses"]
+        ms_per_text = values["embed_ms"] / values["embedded_texts"] if values["embedded_texts"] else 0
+        return {
+            "hits": values["hits"],
+            "misses": values["misses"],
+            "memory_hits": values["memory_hits"],
+            "hit_ratio": round(values["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "bytes": values["bytes"],
+            "max_bytes": self.max_bytes,
+            "avg_embed_ms": round(ms_per_text, 2),
+            "estimated_ms_saved": int(values["hits"] * ms_per_text)
+        }
+
+    def flush(self):
+        """Write the buffered counters and last-used times in one transaction"""
+        with self._lock:
+            pending, touched = self._pending, self._touched
+            self._pending = dict.fromkeys(pending, 0)
+            self._touched = {}
+            self._pending_lookups = 0
+            self._last_flush = time.monotonic()
+
+        with self.pool.connection() as conn:
+            conn.executemany("UPDATE stats SET value = value + ? WHERE name = ?",
+                             [(v, k) for k, v in pending.items() if v])
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                             [(used, model, h) for (model, h), used in touched.items()])
+            conn.commit()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, value in deltas.items():
+                self._pending[name] += value
+            self._pending_lookups += 1
+            due = (self._pending_lookups >= STATS_FLUSH_LOOKUPS
+                   or time.monotonic() - self._last_flush >= STATS_FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+    def _remember(self, key, vector: List[float]):
+        # Caller holds self._lock
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
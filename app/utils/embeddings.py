@@ -0,0 +1,315 @@
+import asyncio
+import hashlib
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Dict, Callable, Sequence
+
+import numpy as np
+
+from utils.ollama_client import OllamaClient, OllamaError, OllamaUnavailable
+
+# "ollama" (default), "hashing" or "onnx"; see EMBEDDING_BACKENDS
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "ollama")
+# Expected vector size; 0 takes it from the first batch embedded
+EMBED_DIMENSIONS = int(os.getenv("EMBED_DIMENSIONS", "0"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+EMBED_BACKOFF = float(os.getenv("EMBED_BACKOFF", "0.5"))      # seconds, doubled per retry
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "60"))
+EMBED_HASHING_DIMENSIONS = int(os.getenv("EMBED_HASHING_DIMENSIONS", "384"))
+# Directory holding model.onnx and tokenizer.json (a sentence-transformers export)
+EMBED_ONNX_PATH = os.getenv("EMBED_ONNX_PATH", "models/embedding")
+EMBED_ONNX_MAX_TOKENS = int(os.getenv("EMBED_ONNX_MAX_TOKENS", "256"))
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", "0"))      # 0: onnxruntime default
+
+_WORD = re.compile(r"\w+")
+
+
+class EmbeddingError(Exception):
+    """Raised when a batch cannot be embedded after all retries"""
+
+
+class EmbeddingBackend:
+    """Turns texts into fixed-size vectors.
+
+    Subclasses implement :meth:`_encode` for a batch; :meth:`embed` checks
+    the result is a finite ``len(texts) x dimensions`` matrix and raises
+    :class:`EmbeddingError` otherwise, so a misbehaving backend can never
+    write a wrong-sized or placeholder vector into the index. ``model`` names
+    the vector space and keys the embedding cache: backends with different
+    models must never share cached vectors.
+    """
+
+    name = ""
+
+    def __init__(self, model: str, dimensions: int = EMBED_DIMENSIONS, batch_size: int = EMBED_BATCH_SIZE):
+        self.model = model
+        self.dimensions: Optional[int] = dimensions or None
+        self.batch_size = max(1, batch_size)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed ``texts`` preserving order"""
+        if not texts:
+            return []
+        return self.validate(np.concatenate([self._encode(b) for b in self._batches(texts)]), len(texts)).tolist()
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Async variant of :meth:`embed`; in-process backends run in a thread"""
+        return await asyncio.to_thread(self.embed, texts)
+
+    def _encode(self, batch: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    def validate(self, vectors: Sequence, count: int) -> np.ndarray:
+        """``vectors`` as a float32 matrix, or EmbeddingError if it is not ``count`` finite vectors of the same size"""
+        try:
+            matrix = np.asarray(vectors, dtype=np.float32)
+        except (ValueError, TypeError) as e:
+            raise EmbeddingError(f"{self.name} returned malformed vectors: {e}") from e
+        if matrix.ndim != 2 or matrix.shape[0] != count:
+            raise EmbeddingError(f"{self.name} returned {matrix.shape} for {count} texts")
+        if self.dimensions is None:
+            self.dimensions = matrix.shape[1]
+        elif matrix.shape[1] != self.dimensions:
+            raise EmbeddingError(f"{self.name} returned {matrix.shape[1]}-dimensional vectors, "
+                                 f"expected {self.dimensions}")
+        if not np.isfinite(matrix).all():
+            raise EmbeddingError(f"{self.name} returned non-finite values")
+        return matrix
+
+    def close(self):
+        pass
+
+
+class BatchEmbedder(EmbeddingBackend):
+    """Embeds many texts against Ollama with batching, bounded concurrency and retries.
+
+    Texts are grouped into ``batch_size`` requests to ``/api/embed``; up to
+    ``concurrency`` batches are in flight at once over the shared
+    :class:`OllamaClient` pool. Servers without the batch endpoint fall back
+    to ``/api/embeddings`` one text at a time. Retries stop as soon as the
+    client's circuit breaker opens.
+    """
+
+    name = "ollama"
+
+    def __init__(self, client: OllamaClient, model: str, batch_size: int = EMBED_BATCH_SIZE,
+                 concurrency: int = EMBED_CONCURRENCY, max_retries: int = EMBED_MAX_RETRIES,
+                 backoff: float = EMBED_BACKOFF, timeout: float = EMBED_TIMEOUT,
+                 dimensions: int = EMBED_DIMENSIONS):
+        super().__init__(model, dimensions, batch_size)
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed")
+        self._batch_supported: Optional[bool] = None
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed ``texts`` preserving order"""
+        if not texts:
+            return []
+
+        batches = self._batches(texts)
+        if len(batches) == 1:
+            return self.validate(self._embed_batch(batches[0]), len(texts)).tolist()
+
+        embeddings = []
+        for result in self._executor.map(self._embed_batch, batches):
+            embeddings.extend(result)
+        return self.validate(embeddings, len(texts)).tolist()
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Async variant of :meth:`embed` for use from the event loop"""
+        if not texts:
+            return []
+
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def run(batch):
+            async with slots:
+                return await self._aembed_batch(batch)
+
+        embeddings = []
+        for result in await asyncio.gather(*(run(b) for b in self._batches(texts))):
+            embeddings.extend(result)
+        return self.validate(embeddings, len(texts)).tolist()
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        if self._batch_supported is not False:
+            response = self._post("/api/embed", {"model": self.model, "input": batch})
+            if response is not None:
+                self._batch_supported = True
+                return response["embeddings"]
+            self._batch_supported = False
+
+        return [self._post("/api/embeddings", {"model": self.model, "prompt": text})["embedding"]
+                for text in batch]
+
+    async def _aembed_batch(self, batch: List[str]) -> List[List[float]]:
+        if self._batch_supported is not False:
+            response = await self._apost("/api/embed", {"model": self.model, "input": batch})
+            if response is not None:
+                self._batch_supported = True
+                return response["embeddings"]
+            self._batch_supported = False
+
+        results = []
+        for text in batch:
+            results.append((await self._apost("/api/embeddings", {"model": self.model, "prompt": text}))["embedding"])
+        return results
+
+    def _post(self, path: str, payload: dict) -> Optional[dict]:
+        """POST with exponential backoff; returns None if the endpoint does not exist"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.post("embed", path, payload, timeout=self.timeout)
+            except OllamaError as e:
+                if e.status_code == 404 and path == "/api/embed":
+                    return None
+                raise EmbeddingError(str(e)) from e
+            except OllamaUnavailable as e:
+                error = e
+            if not self._should_retry(attempt):
+                break
+            time.sleep(self._delay(attempt))
+
+        raise EmbeddingError(f"{path} failed after {attempt + 1} attempts: {error}")
+
+    async def _apost(self, path: str, payload: dict) -> Optional[dict]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.client.apost("embed", path, payload, timeout=self.timeout)
+            except OllamaError as e:
+                if e.status_code == 404 and path == "/api/embed":
+                    return None
+                raise EmbeddingError(str(e)) from e
+            except OllamaUnavailable as e:
+                error = e
+            if not self._should_retry(attempt):
+                break
+            await asyncio.sleep(self._delay(attempt))
+
+        raise EmbeddingError(f"{path} failed after {attempt + 1} attempts: {error}")
+
+    def _should_retry(self, attempt: int) -> bool:
+        return attempt < self.max_retries and self.client.breaker.state != "open"
+
+    def _delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt) * (1 + random.random() * 0.1)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+@lru_cache(maxsize=65536)
+def _token_slot(token: str, dimensions: int):
+    # blake2b rather than hash(): slots must agree across processes and restarts
+    value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    return value % dimensions, 1.0 if value >> 63 else -1.0
+
+
+class HashingEmbedder(EmbeddingBackend):
+    """In-process hashing-trick vectorizer: no model, no network.
+
+    Words and adjacent word pairs are hashed into ``dimensions`` signed
+    buckets and each row is L2-normalized, so cosine similarity tracks
+    shared vocabulary. Far weaker than a neural model at paraphrase, but
+    deterministic and fast, which suits tests, benchmarks and tiny deployments.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int = EMBED_HASHING_DIMENSIONS, batch_size: int = 1024):
+        super().__init__(f"hashing-{dimensions}", dimensions, batch_size)
+
+    def _encode(self, batch: List[str]) -> np.ndarray:
+        rows, slots, signs = [], [], []
+        for row, text in enumerate(batch):
+            words = _WORD.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                slot, sign = _token_slot(feature, self.dimensions)
+                rows.append(row)
+                slots.append(slot)
+                signs.append(sign)
+
+        matrix = np.zeros((len(batch), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(slots, dtype=np.intp)),
+                  np.array(signs, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class OnnxEmbedder(EmbeddingBackend):
+    """Sentence-transformer exported to ONNX, run on the CPU in-process.
+
+    Needs the optional ``onnxruntime`` and ``tokenizers`` packages and a
+    directory with ``model.onnx`` and ``tokenizer.json``. Token embeddings
+    are mean-pooled over the attention mask and L2-normalized, matching
+    sentence-transformers' default pooling.
+    """
+
+    name = "onnx"
+
+    def __init__(self, path: str = EMBED_ONNX_PATH, max_tokens: int = EMBED_ONNX_MAX_TOKENS,
+                 threads: int = EMBED_ONNX_THREADS, batch_size: int = EMBED_BATCH_SIZE,
+                 dimensions: int = EMBED_DIMENSIONS):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise EmbeddingError("The onnx embedding backend needs: pip install onnxruntime tokenizers") from e
+
+        super().__init__(f"onnx:{os.path.basename(os.path.normpath(path))}", dimensions, batch_size)
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(os.path.join(path, "model.onnx"), options,
+                                                    providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def _encode(self, batch: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(batch)
+        ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feed = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feed["token_type_ids"] = np.zeros_like(ids)
+
+        tokens = self.session.run(None, feed)[0]          # (batch, sequence, dimensions)
+        weights = mask[:, :, None].astype(np.float32)
+        pooled = (tokens * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+
+# name -> factory(client, model); the client and model are only used by remote backends
+EMBEDDING_BACKENDS: Dict[str, Callable[[OllamaClient, str], EmbeddingBackend]] = {
+    "ollama": lambda client, model: BatchEmbedder(client, model),
+    "hashing": lambda client, model: HashingEmbedder(),
+    "onnx": lambda client, model: OnnxEmbedder(),
+}
+
+
+def register_backend(name: str, factory: Callable[[OllamaClient, str], EmbeddingBackend]):
+    EMBEDDING_BACKENDS[name] = factory
+
+
+def create_embedder(client: OllamaClient, model: str, backend: str = EMBED_BACKEND) -> EmbeddingBackend:
+    """The configured embedding backend"""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBED_BACKEND {backend!r}; choose from {', '.join(EMBEDDING_BACKENDS)}")
+    return EMBEDDING_BACKENDS[backend](client, model)
@@ -1,26 +1,108 @@
 import pypdf
-from typing import List
+import bisect
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Callable, Optional, Iterator, Dict, Any, Set
 import os
 import sys
 
 sys.path.append('/app')
 
-from database import SessionLocal
-from models import Document
-import uuid
+from models import DocumentStatus
+from utils.chunker import Chunker, iter_text_file, chunk_text  # chunk_text kept importable from here
 
-def extract_text_from_pdf(file_path: str) -> str:
-    """Extract text from PDF file"""
-    text = ""
+# Chunks embedded and staged together while a document is processed
+CHUNK_BATCH_SIZE = int(os.getenv("CHUNK_BATCH_SIZE", "256"))
+
+# Large PDFs are extracted by a process pool; pages come back in order, with
+# at most PDF_WORKERS * 2 batches of PDF_PAGES_PER_TASK pages in flight
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+_pdf_reader = None  # per extraction process
+
+class PDFExtractionError(Exception):
+    """The PDF could not be read at all; raised so the ingestion job fails and is retried"""
+
+def _page_text(reader: pypdf.PdfReader, index: int) -> Optional[str]:
+    """Text of one page, or None if it could not be extracted"""
+    try:
+        return reader.pages[index].extract_text() or ""
+    except Exception as e:
+        # One bad page should not lose the rest of the document
+        print(f"PDF extraction error on page {index + 1}: {e}")
+        return None
+
+def _open_pdf(file_path: str):
+    global _pdf_reader
+    _pdf_reader = pypdf.PdfReader(file_path)
+
+def _extract_page_range(start: int, end: int) -> List[Optional[str]]:
+    return [_page_text(_pdf_reader, i) for i in range(start, end)]
+
+def iter_pdf_pages(file_path: str, workers: int = PDF_WORKERS) -> Iterator[Tuple[int, str]]:
+    """Yield ``(page_number, text)`` for each page, in order, without building the whole text.
+    
+    Raises :class:`PDFExtractionError` if the file cannot be opened, has no
+    pages, or no page could be extracted; pages that fail among readable
+    ones come back empty.
+    """
     try:
-        with open(file_path, 'rb') as file:
-            pdf_reader = pypdf.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+        reader = pypdf.PdfReader(file_path)
+        page_count = len(reader.pages)
     except Exception as e:
-        print(f"PDF extraction error: {e}")
+        raise PDFExtractionError(f"Cannot read PDF: {e}") from e
+    if page_count == 0:
+        raise PDFExtractionError("PDF has no pages")
+    
+    if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES or multiprocessing.current_process().daemon:
+        pages = _serial_page_texts(reader, page_count)
+    else:
+        pages = _parallel_page_texts(file_path, page_count, workers)
+    del reader
     
-    return text.strip()
+    failed = 0
+    for page_number, text in pages:
+        if text is None:
+            failed += 1
+            if failed == page_count:
+                raise PDFExtractionError(f"No text could be extracted from any of the {page_count} pages")
+            text = ""
+        yield page_number, text
+
+def _serial_page_texts(reader: pypdf.PdfReader, page_count: int) -> Iterator[Tuple[int, Optional[str]]]:
+    for i in range(page_count):
+        yield i + 1, _page_text(reader, i)
+
+def _parallel_page_texts(file_path: str, page_count: int, workers: int) -> Iterator[Tuple[int, Optional[str]]]:
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+    ranges = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_open_pdf,
+                             initargs=(file_path,)) as executor:
+        pending = deque()
+        
+        def submit():
+            start = next(ranges, None)
+            if start is not None:
+                end = min(start + PDF_PAGES_PER_TASK, page_count)
+                pending.append((start, executor.submit(_extract_page_range, start, end)))
+        
+        for _ in range(workers * 2):
+            submit()
+        while pending:
+            start, future = pending.popleft()
+            texts = future.result()
+            submit()
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
+
+def extract_text_from_pdf(file_path: str) -> str:
+    """Extract text from PDF file"""
+    return "\n".join(text for _, text in iter_pdf_pages(file_path)).strip()
 
 def extract_text_from_txt(file_path: str) -> str:
     """Extract text from TXT file"""
@@ -31,51 +113,94 @@ def extract_text_from_txt(file_path: str) -> str:
         with open(file_path, 'r', encoding='latin-1') as file:
             return file.read()
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    """Chunk text intelligently"""
-    if not text:
-        return []
-    
-    words = text.split()
-    chunks = []
-    
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = " ".join(words[i:i + chunk_size])
-        chunks.append(chunk)
-        
-        if i + chunk_size >= len(words):
-            break
-    
-    return chunks
+def iter_blocks(file_path: str) -> Iterator[Tuple[int, str]]:
+    """Document text as ``(page_number, text block)``; non-PDF files are all page 1"""
+    if file_path.lower().endswith('.pdf'):
+        yield from iter_pdf_pages(file_path)
+    elif file_path.lower().endswith(('.txt', '.md')):
+        for block in iter_text_file(file_path):
+            yield 1, block
+    else:
+        yield 1, f"File: {os.path.basename(file_path)}"
 
-def process_document_async(document_id: str, file_path: str, user_id: int, workspace_id: str):
-    """Process document in background"""
-    try:
-        db = SessionLocal()
-        
-        print(f"Processing document: {document_id}")
-        
-        # Extract text based on file type
-        text = ""
-        if file_path.lower().endswith('.pdf'):
-            text = extract_text_from_pdf(file_path)
-        elif file_path.lower().endswith('.txt'):
-            text = extract_text_from_txt(file_path)
-        elif file_path.lower().endswith('.md'):
-            text = extract_text_from_txt(file_path)
-        else:
-            text = f"File: {os.path.basename(file_path)}"
-        
-        # Chunk text
-        chunks = chunk_text(text)
-        
-        print(f"Document {document_id} processed: {len(chunks)} chunks")
-        
-        db.close()
-        return True
-        
-    except Exception as e:
-        print(f"Document processing error: {e}")
+def extract_text(file_path: str) -> str:
+    """Extract text based on file type"""
+    if file_path.lower().endswith('.pdf'):
+        return extract_text_from_pdf(file_path)
+    elif file_path.lower().endswith(('.txt', '.md')):
+        return extract_text_from_txt(file_path)
+    return f"File: {os.path.basename(file_path)}"
 
-        return False
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
+def process_document(document_id: str, file_path: str, rag,
+                     on_batch: Callable[[int, List[str], List[Optional[List[float]]], List[Dict[str, Any]]], None],
+                     on_status: Optional[Callable[[DocumentStatus], None]] = None,
+                     batch_size: int = CHUNK_BATCH_SIZE,
+                     known_hashes: Optional[Set[str]] = None) -> Dict[str, Any]:
+    """Extract, chunk and embed a document batch by batch; indexing is left to the caller.
+    
+    Chunks are embedded ``batch_size`` at a time and handed to
+    ``on_batch(first_index, chunks, embeddings, chunk_metadata)`` as soon
+    as they are ready, so the document is never held in memory whole.
+    Chunk metadata carries character offsets into the document text (pages
+    joined by newlines), the page range, the enclosing heading and the
+    ``content_hash`` of the chunk text. Chunks whose hash is in
+    ``known_hashes`` (already indexed from an earlier version) are not
+    embedded again; their embedding is None. Returns the chunk count, how
+    many were embedded and ``page_offsets``: ``[page, start, end]`` per page.
+    """
+    if on_status:
+        on_status(DocumentStatus.PROCESSING)
+    
+    page_offsets, page_starts = [], []
+    
+    def text_blocks():
+        position, current = 0, None
+        for page_number, block in iter_blocks(file_path):
+            if page_number != current:
+                if current is not None:
+                    yield "\n"
+                    position += 1
+                page_offsets.append([page_number, position, position])
+                page_starts.append(position)
+                current = page_number
+            yield block
+            position += len(block)
+            page_offsets[-1][2] = position
+    
+    def page_at(offset: int) -> int:
+        return page_offsets[bisect.bisect_right(page_starts, offset) - 1][0]
+    
+    known_hashes = known_hashes or set()
+    count, embedded, batch = 0, 0, []
+    
+    def flush():
+        nonlocal count, embedded
+        if count == 0 and on_status:
+            on_status(DocumentStatus.EMBEDDING)
+        texts = [chunk.pop("text") for chunk in batch]
+        changed = [text for text, chunk in zip(texts, batch) if chunk["content_hash"] not in known_hashes]
+        # A failed embedding raises, failing (and retrying) the job
+        vectors = iter(rag.embed_texts(changed) if changed else [])
+        embeddings = [None if chunk["content_hash"] in known_hashes else next(vectors) for chunk in batch]
+        on_batch(count, texts, embeddings, list(batch))
+        count += len(batch)
+        embedded += len(changed)
+        batch.clear()
+    
+    for chunk in Chunker().chunks(text_blocks()):
+        chunk["page_start"] = page_at(chunk["char_start"])
+        chunk["page_end"] = page_at(chunk["char_end"] - 1)
+        if chunk["heading"] is None:
+            del chunk["heading"]   # vector metadata values cannot be null
+        chunk["content_hash"] = content_hash(chunk["text"])
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    
+    print(f"Document {document_id} processed: {count} chunks ({embedded} embedded) from {len(page_offsets)} pages")
+    return {"chunks": count, "embedded": embedded, "page_offsets": page_offsets}
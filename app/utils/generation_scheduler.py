@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from utils.chunker import estimate_tokens
+from utils.metrics import observe_stage
+from utils.ollama_client import ENDPOINT_LIMITS, OllamaUnavailable
+
+# Generations sent to Ollama at once; further requests wait in the scheduler's queue
+GENERATE_SLOTS = int(os.getenv("GENERATE_SLOTS", str(ENDPOINT_LIMITS["generate"])))
+# Waiting generations across all users; beyond this requests get 429
+GENERATE_QUEUE_MAX = int(os.getenv("GENERATE_QUEUE_MAX", "32"))
+# Waiting or running generations per user
+GENERATE_QUEUE_PER_USER = int(os.getenv("GENERATE_QUEUE_PER_USER", "3"))
+
+# Recent waits kept for the percentiles in stats()
+WAIT_SAMPLES = 1000
+# Seconds per generation assumed for Retry-After until one has been measured
+DEFAULT_GENERATION_SECONDS = 5.0
+
+
+class GenerationQueueFull(Exception):
+    """The scheduler cannot take another generation; retry after ``retry_after`` seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class GenerationJob:
+    """One Ollama generation, shared by every request that asked for the same prompt.
+
+    Events from :meth:`RAGSystem.astream_generate` are kept, so a request
+    that joins late still sees the whole answer. When every subscriber has
+    gone the job is dropped from the queue, or cancelled if it is running.
+    """
+
+    def __init__(self, scheduler: "GenerationScheduler", key: str, user_id: Any, query: str, context: str,
+                 cost: int):
+        self.scheduler = scheduler
+        self.key = key
+        self.user_id = user_id
+        self.query = query
+        self.context = context
+        self.cost = cost
+        self.subscribers = 1
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.done = False
+        self.cancelled = False
+        self.error: Optional[BaseException] = None
+        self._events: List[Dict[str, Any]] = []
+        self._changed = asyncio.Event()
+
+    def publish(self, event: Dict[str, Any]):
+        self._events.append(event)
+        self._wake()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def events(self) -> AsyncIterator[Dict[str, Any]]:
+        """``{"token": ...}`` events, then ``{"done": True, ...}``; Ollama errors propagate"""
+        position = 0
+        try:
+            while True:
+                while position < len(self._events):
+                    position += 1
+                    yield self._events[position - 1]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.scheduler.abandon(self)
+
+    async def result(self) -> Optional[Dict[str, Any]]:
+        """The complete answer like :meth:`RAGSystem.agenerate`; None if generation failed for any reason"""
+        parts, usage = [], {}
+        events = self.events()
+        try:
+            async for event in events:
+                if "token" in event:
+                    parts.append(event["token"])
+                else:
+                    usage = event
+        except Exception as e:
+            # Also malformed stream lines and unexpected payloads: /chat falls back to the rule-based assistant
+            print(f"AI generation error: {e}")
+            return None
+        finally:
+            await events.aclose()
+        return {
+            "response": "".join(parts),
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens")
+        }
+
+
+class GenerationScheduler:
+    """Queues chat generations in front of Ollama.
+
+    At most ``slots`` generations run at once. Waiting jobs are ordered by
+    start-time fair queuing: each user's jobs get virtual finish tags that
+    advance by the job's estimated token cost, so every user gets a fair
+    share of the model and, within that, shorter prompts go first. A prompt
+    identical to one already queued or running joins that job instead of
+    generating again. Submissions beyond ``queue_max`` waiting jobs, or
+    ``per_user`` jobs of one user, raise :class:`GenerationQueueFull` with a
+    Retry-After estimate rather than waiting for a timeout.
+
+    All methods run on the event loop; none of them block.
+    """
+
+    def __init__(self, rag, slots: int = GENERATE_SLOTS, queue_max: int = GENERATE_QUEUE_MAX,
+                 per_user: int = GENERATE_QUEUE_PER_USER):
+        self.rag = rag
+        self.slots = max(1, slots)
+        self.queue_max = queue_max
+        self.per_user = per_user
+        self._heap: List = []
+        self._order = itertools.count()
+        self._inflight: Dict[str, GenerationJob] = {}
+        self._per_user: Dict[Any, int] = {}
+        self._last_finish: Dict[Any, float] = {}
+        self._virtual_time = 0.0
+        self._queued = 0
+        self._running = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._generation_seconds = DEFAULT_GENERATION_SECONDS
+        self._stats = {"submitted": 0, "coalesced": 0, "rejected": 0, "completed": 0,
+                       "failed": 0, "abandoned": 0}
+
+    def submit(self, user_id: Any, query: str, context: str = "") -> GenerationJob:
+        """Queue a generation (or join an identical one); raises GenerationQueueFull"""
+        payload = self.rag.generate_payload(query, context, stream=True)
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        self._stats["submitted"] += 1
+
+        job = self._inflight.get(key)
+        if job is not None and not job.cancelled:
+            job.subscribers += 1
+            self._stats["coalesced"] += 1
+            return job
+
+        if self._per_user.get(user_id, 0) >= self.per_user:
+            self._reject("Too many chat requests in progress for this user")
+        if self._queued >= self.queue_max and self._running >= self.slots:
+            self._reject("Chat generation queue is full")
+
+        cost = estimate_tokens(payload["prompt"]) + payload["options"].get("num_predict", 0)
+        job = GenerationJob(self, key, user_id, query, context, cost)
+        start = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+        finish = start + cost
+        self._last_finish[user_id] = finish
+        heapq.heappush(self._heap, (finish, next(self._order), start, job))
+        self._inflight[key] = job
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        self._queued += 1
+        self._dispatch()
+        return job
+
+    def _reject(self, reason: str):
+        self._stats["rejected"] += 1
+        raise GenerationQueueFull(reason, self.retry_after())
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up for a new request"""
+        rounds = (self._queued + 1) / self.slots
+        return max(1, math.ceil(rounds * self._generation_seconds))
+
+    def _dispatch(self):
+        while self._running < self.slots and self._heap:
+            finish, _, start, job = heapq.heappop(self._heap)
+            if job.cancelled:
+                continue
+            self._queued -= 1
+            self._running += 1
+            self._virtual_time = start
+            job.started_at = time.monotonic()
+            self._waits.append(job.started_at - job.enqueued_at)
+            observe_stage("generate_queue", job.started_at - job.enqueued_at)
+            job.task = asyncio.create_task(self._run(job))
+        if not self._heap:
+            # Nobody waiting: forget finish tags so idle users start level
+            self._last_finish = {u: f for u, f in self._last_finish.items() if u in self._per_user}
+
+    async def _run(self, job: GenerationJob):
+        error = None
+        try:
+            async for event in self.rag.astream_generate(job.query, job.context):
+                job.publish(event)
+        except asyncio.CancelledError:
+            error = OllamaUnavailable("Generation cancelled: no request is waiting for it")
+        except Exception as e:
+            error = e
+        finally:
+            elapsed = time.monotonic() - job.started_at
+            observe_stage("generate", elapsed)
+            self._running -= 1
+            self._release(job)
+            if error is None:
+                self._stats["completed"] += 1
+                # Moving average of generation time for Retry-After
+                self._generation_seconds = 0.8 * self._generation_seconds + 0.2 * elapsed
+            elif not job.cancelled:
+                self._stats["failed"] += 1
+            job.finish(error)
+            self._dispatch()
+
+    def _release(self, job: GenerationJob):
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        remaining = self._per_user.get(job.user_id, 1) - 1
+        if remaining:
+            self._per_user[job.user_id] = remaining
+        else:
+            self._per_user.pop(job.user_id, None)
+
+    def abandon(self, job: GenerationJob):
+        """Every request waiting for ``job`` has gone: drop it from the queue or stop it"""
+        if job.done or job.cancelled:
+            return
+        job.cancelled = True
+        self._stats["abandoned"] += 1
+        if job.task is not None:
+            job.task.cancel()
+            return
+        self._queued -= 1
+        self._release(job)
+        job.finish(OllamaUnavailable("Generation abandoned"))
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> Optional[float]:
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 1) if waits else None
+
+        return {
+            **self._stats,
+            "slots": self.slots,
+            "running": self._running,
+            "queued": self._queued,
+            "queue_max": self.queue_max,
+            "users_waiting": len(self._per_user),
+            "wait_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+            "avg_generation_s": round(self._generation_seconds, 2)
+        }
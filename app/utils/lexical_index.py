@@ -0,0 +1,108 @@
+import os
+import re
+from typing import List, Tuple
+
+from utils.db_pool import ConnectionPool
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "database/lexical_index.db")
+
+# Query terms looked up per search; longer queries keep their first terms
+MAX_QUERY_TERMS = 32
+
+_WORD = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from how i in is it me my of on or our so
+that the their there this to was what when where which who why will with you your
+""".split())
+
+
+def query_terms(text: str) -> List[str]:
+    """Distinct lower-cased words of a query, without stopwords, in order"""
+    words = [w for w in _WORD.findall(text.lower()) if w not in STOPWORDS]
+    return list(dict.fromkeys(words))[:MAX_QUERY_TERMS]
+
+
+class LexicalIndex:
+    """SQLite FTS5 keyword index over the same chunks as the vector collections.
+
+    ``chunks`` maps a chunk ID to its document and workspace; the FTS table
+    holds the chunk text plus the workspace as a searchable token, so a
+    search only walks postings inside one workspace.
+    """
+
+    def __init__(self, path: str = LEXICAL_INDEX_PATH):
+        self.pool = ConnectionPool(path, size=4)
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    chunk_id TEXT UNIQUE NOT NULL,
+                    document_id TEXT NOT NULL,
+                    workspace_id TEXT NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks(document_id)")
+            conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts
+                USING fts5(text, workspace, tokenize = 'unicode61 remove_diacritics 2')
+            ''')
+            conn.commit()
+
+    @staticmethod
+    def _workspace_token(workspace_id: str) -> str:
+        # One token, whatever punctuation the ID contains
+        return "w" + "".join(_WORD.findall(workspace_id.lower()))
+
+    def is_empty(self) -> bool:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is None
+
+    def add(self, workspace_id: str, ids: List[str], texts: List[str], document_ids: List[str]):
+        """Index chunks, replacing any already indexed under the same IDs"""
+        token = self._workspace_token(workspace_id)
+        with self.pool.connection() as conn:
+            self._delete(conn, ids)
+            for chunk_id, text, document_id in zip(ids, texts, document_ids):
+                cursor = conn.execute("INSERT INTO chunks (chunk_id, document_id, workspace_id) VALUES (?, ?, ?)",
+                                      (chunk_id, document_id, workspace_id))
+                conn.execute("INSERT INTO chunks_fts (rowid, text, workspace) VALUES (?, ?, ?)",
+                             (cursor.lastrowid, text, token))
+            conn.commit()
+
+    def delete_chunks(self, ids: List[str]):
+        with self.pool.connection() as conn:
+            self._delete(conn, ids)
+            conn.commit()
+
+    @staticmethod
+    def _delete(conn, ids: List[str]):
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            marks = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM chunks_fts WHERE rowid IN (SELECT id FROM chunks WHERE chunk_id IN ({marks}))",
+                         batch)
+            conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({marks})", batch)
+
+    def delete_document(self, document_id: str):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM chunks_fts WHERE rowid IN (SELECT id FROM chunks WHERE document_id = ?)",
+                         (document_id,))
+            conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            conn.commit()
+
+    def search(self, workspace_id: str, query: str, limit: int) -> List[Tuple[str, float]]:
+        """Best ``(chunk_id, bm25)`` matches for any of the query's terms, best first"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        match = "text : ({}) AND workspace : {}".format(
+            " OR ".join(f'"{t}"' for t in terms), self._workspace_token(workspace_id))
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT chunks.chunk_id, bm25(chunks_fts, 1.0, 0.0) AS score
+                FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid
+                WHERE chunks_fts MATCH ?
+                ORDER BY score LIMIT ?
+            ''', (match, limit)).fetchall()
+        # FTS5 bm25() is lower-is-better; flip it so higher is better
+        return [(chunk_id, -score) for chunk_id, score in rows]
@@ -0,0 +1,289 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Label combinations kept per metric; later ones are folded into "other"
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "500"))
+
+# Seconds; spans everything from a cached principal lookup to a long generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+HTTP_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of series, one per combination of label values.
+
+    At most ``max_series`` combinations are tracked; further ones are
+    recorded under every label set to "other", so a bad label (a raw URL,
+    a user id) cannot grow memory or the scrape without bound.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), max_series: int = METRICS_MAX_SERIES):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.max_series = max_series
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        self._overflow = tuple("other" for _ in self.labels)
+
+    def _new(self):
+        raise NotImplementedError
+
+    def _get(self, values: Tuple[str, ...]):
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.get(values)
+                if series is None:
+                    if len(self._series) >= self.max_series:
+                        values = self._overflow
+                        series = self._series.get(values)
+                    if series is None:
+                        series = self._series[values] = self._new()
+        return series
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new(self):
+        return [0]
+
+    def inc(self, *values: str, amount: float = 1):
+        series = self._get(values)
+        with self._lock:
+            series[0] += amount
+
+    def samples(self):
+        with self._lock:
+            items = [(values, series[0]) for values, series in self._series.items()]
+        return [f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+                for values, value in sorted(items)]
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 max_series: int = METRICS_MAX_SERIES):
+        super().__init__(name, help, labels, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        # Per-bucket counts (last one is +Inf), then the running sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value: float, *values: str):
+        series = self._get(values)
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series[position] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(values, list(series)) for values, series in self._series.items()]
+        lines = []
+        for values, series in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics exported together on ``/metrics``.
+
+    ``collectors`` are called at scrape time and return ``(name, help,
+    {label values: value})`` gauges, for state other components already
+    keep (queue depths, pool sizes) so nothing has to be mirrored.
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Tuple[Tuple[str, ...], Callable]] = []
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, labels: Iterable[str], collect: Callable):
+        self.collectors.append((tuple(labels), collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for labels, collect in self.collectors:
+            try:
+                gauges = list(collect())
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, help, values in gauges:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+                lines += [f"{name}{_format_labels(labels, key)} {_format_value(value)}"
+                          for key, value in sorted(values.items()) if value is not None]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time from request start until the response body is sent",
+    ("method", "route", "status")
+)
+STAGE_LATENCY = REGISTRY.histogram(
+    "app_stage_duration_seconds", "Time spent in one stage of request handling",
+    ("stage",)
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "app_stage_errors_total", "Stages that ended with an exception",
+    ("stage",)
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    if METRICS_ENABLED:
+        STAGE_LATENCY.observe(seconds, stage)
+
+
+class span:
+    """Time a ``with`` block as ``stage``; exceptions are counted and re-raised.
+
+    A plain class rather than ``@contextmanager``: it is entered on every
+    request, and the generator machinery would double its cost.
+    """
+
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        if METRICS_ENABLED:
+            STAGE_LATENCY.observe(time.perf_counter() - self.started, self.stage)
+            if kind is not None:
+                STAGE_ERRORS.inc(self.stage)
+        return False
+
+
+def timed(stage: str):
+    """Decorator form of :func:`span` for plain and ``async`` functions"""
+
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording :data:`REQUEST_LATENCY` for every HTTP request.
+
+    Requests are labelled with the route template (``/documents/{document_id}``,
+    never the raw path), the method and the status class (``2xx``), which
+    keeps the number of series bounded. Streaming responses are timed until
+    their last chunk is sent. Plain ASGI rather than ``@app.middleware``, so
+    it does not buffer or re-wrap the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Optional[Dict[Any, str]] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "other"
+            REQUEST_LATENCY.observe(time.perf_counter() - started, method, self.route_of(scope),
+                                    f"{status[0] // 100}xx")
+
+    def route_of(self, scope) -> str:
+        """Path template of the route that handled ``scope``; "unmatched" for 404s"""
+        route = scope.get("route")
+        if route is not None:
+            return getattr(route, "path", "unmatched")
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None:
+            # The router records the endpoint in the request scope; map it back to its template
+            routes = getattr(scope.get("app"), "routes", [])
+            self._routes = {getattr(r, "endpoint", None): getattr(r, "path", "unmatched") for r in routes}
+        return self._routes.get(endpoint, "unmatched")
+
+
+def render() -> str:
+    return REGISTRY.render()
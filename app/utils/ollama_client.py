@@ -0,0 +1,207 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import httpx
+
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "60"))
+
+# Requests allowed in flight per endpoint kind (per process)
+ENDPOINT_LIMITS = {
+    "embed": int(os.getenv("OLLAMA_EMBED_CONCURRENCY", "8")),
+    "generate": int(os.getenv("OLLAMA_GENERATE_CONCURRENCY", "4")),
+    "health": 2,
+}
+
+BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("OLLAMA_BREAKER_RESET", "30"))
+
+
+class OllamaError(Exception):
+    """Ollama answered with a non-retryable error (e.g. unknown model)"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"Ollama returned {status_code}: {detail[:200]}")
+        self.status_code = status_code
+
+
+class OllamaUnavailable(Exception):
+    """Ollama could not be reached, timed out, is overloaded, or the breaker is open"""
+
+
+class CircuitBreaker:
+    """Fails fast after repeated connection failures.
+
+    After ``failures`` consecutive failures the breaker opens and every call
+    is rejected for ``reset_seconds``; then a single trial call is let through
+    (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+
+
+class OllamaClient:
+    """Shared keep-alive HTTP client for Ollama with sync and async entry points.
+
+    Both sides share one circuit breaker. ``kind`` ("embed", "generate",
+    "health") selects the concurrency limit a call is counted against.
+    """
+
+    def __init__(self, base_url: str, max_connections: int = OLLAMA_MAX_CONNECTIONS,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.base_url = base_url
+        self.breaker = breaker or CircuitBreaker()
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+
+        self._sync = httpx.Client(base_url=base_url, limits=self._limits, timeout=self._timeout)
+        self._sync_slots = {kind: threading.BoundedSemaphore(n) for kind, n in ENDPOINT_LIMITS.items()}
+
+        # The async client and semaphores are bound to the loop that first uses them
+        self._async: Optional[httpx.AsyncClient] = None
+        self._async_slots: Dict[str, asyncio.Semaphore] = {}
+        self._loop = None
+
+    # ---------- sync ----------
+    def get(self, kind: str, path: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        with self._guard(), self._sync_slots[kind]:
+            response = self._sync.get(path, timeout=timeout or self._timeout)
+            return self._json(response)
+
+    def post(self, kind: str, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        with self._guard(), self._sync_slots[kind]:
+            response = self._sync.post(path, json=payload, timeout=timeout or self._timeout)
+            return self._json(response)
+
+    def stream(self, kind: str, path: str, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Yield NDJSON objects; the read timeout applies between lines"""
+        with self._guard(), self._sync_slots[kind]:
+            with self._sync.stream("POST", path, json=payload) as response:
+                if response.status_code != 200:
+                    response.read()
+                    self._json(response)
+                for line in response.iter_lines():
+                    if line:
+                        yield json.loads(line)
+
+    # ---------- async ----------
+    async def aget(self, kind: str, path: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        client, slot = self._async_for(kind)
+        async with self._aguard(), slot:
+            response = await client.get(path, timeout=timeout or self._timeout)
+            return self._json(response)
+
+    async def apost(self, kind: str, path: str, payload: Dict[str, Any],
+                    timeout: Optional[float] = None) -> Dict[str, Any]:
+        client, slot = self._async_for(kind)
+        async with self._aguard(), slot:
+            response = await client.post(path, json=payload, timeout=timeout or self._timeout)
+            return self._json(response)
+
+    async def astream(self, kind: str, path: str, payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        client, slot = self._async_for(kind)
+        async with self._aguard(), slot:
+            async with client.stream("POST", path, json=payload) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    self._json(response)
+                async for line in response.aiter_lines():
+                    if line:
+                        yield json.loads(line)
+
+    async def aclose(self):
+        if self._async is not None:
+            await self._async.aclose()
+            self._async = None
+
+    def close(self):
+        self._sync.close()
+
+    # ---------- internals ----------
+    def _async_for(self, kind: str):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._async = httpx.AsyncClient(base_url=self.base_url, limits=self._limits, timeout=self._timeout)
+            self._async_slots = {k: asyncio.Semaphore(n) for k, n in ENDPOINT_LIMITS.items()}
+        return self._async, self._async_slots[kind]
+
+    @staticmethod
+    def _json(response: httpx.Response) -> Dict[str, Any]:
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code in (429, 500, 502, 503, 504):
+            raise OllamaUnavailable(f"Ollama returned {response.status_code}")
+        raise OllamaError(response.status_code, response.text)
+
+    @contextmanager
+    def _guard(self):
+        if not self.breaker.allow():
+            raise OllamaUnavailable("Circuit breaker open")
+        try:
+            yield
+        except (httpx.TransportError, OllamaUnavailable) as e:
+            self.breaker.record_failure()
+            raise e if isinstance(e, OllamaUnavailable) else OllamaUnavailable(str(e)) from e
+        except BaseException:
+            # Answered, or the caller stopped early: the server is up
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+
+    @asynccontextmanager
+    async def _aguard(self):
+        if not self.breaker.allow():
+            raise OllamaUnavailable("Circuit breaker open")
+        try:
+            yield
+        except (httpx.TransportError, OllamaUnavailable) as e:
+            self.breaker.record_failure()
+            raise e if isinstance(e, OllamaUnavailable) else OllamaUnavailable(str(e)) from e
+        except BaseException:
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
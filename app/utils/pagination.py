@@ -0,0 +1,65 @@
+import base64
+import json
+import os
+from typing import List, Optional, Dict, Any, Tuple, Sequence
+
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+
+
+class InvalidPageRequest(ValueError):
+    """Malformed cursor or unknown field name"""
+
+
+def encode_cursor(created_at: str, row_id: str) -> str:
+    raw = json.dumps([created_at, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidPageRequest("Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(row_id, str):
+        raise InvalidPageRequest("Invalid cursor")
+    return created_at, row_id
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """Comma-separated field names, validated and in ``allowed`` order; all fields when empty"""
+    if not fields:
+        return list(allowed)
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise InvalidPageRequest(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [f for f in allowed if f in requested]
+
+
+def keyset_page(conn, table: str, columns: List[str], where: str, params: list,
+                cursor: Optional[str], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of ``table`` newest first, continuing after ``cursor``.
+
+    Rows are ordered by ``(created_at, id)`` so the walk is stable even when
+    many rows share a timestamp; with an index ending in ``(created_at, id)``
+    each page costs the same however deep it is. Returns the rows as dicts
+    (only ``columns``) and the cursor for the next page, or None at the end.
+    """
+    select = list(dict.fromkeys(columns + ["created_at", "id"]))
+    sql = f"SELECT {', '.join(select)} FROM {table} WHERE {where}"
+    params = list(params)
+    if cursor:
+        sql += " AND (created_at, id) < (?, ?)"
+        params.extend(decode_cursor(cursor))
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = [dict(zip(select, row)) for row in conn.execute(sql, params).fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+    return [{c: row[c] for c in columns} for row in rows], next_cursor
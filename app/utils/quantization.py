@@ -0,0 +1,265 @@
+import os
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+# Subvectors per product-quantized vector (one byte each); 0 picks dimensions / 8
+PQ_SUBVECTORS = int(os.getenv("VECTOR_INDEX_PQ_SUBVECTORS", "0"))
+PQ_CENTROIDS = 256
+# Values decoded at a time: keeps the temporary float32 copy a query makes in cache
+SCORE_BLOCK_VALUES = 1 << 18
+KMEANS_ITERATIONS = 8
+# float16 -> float32 by moving bits: the 5-bit exponent lands in the low bits of the
+# 8-bit one, so values come out 2^-112 too small (exact, subnormals included);
+# the 2^112 is folded into the query instead of multiplied into every value
+HALF_EXPONENT_REBIAS = np.float32(2.0 ** 112)
+HALF_BITS_MASK = np.int32(-0x70000001)    # 0x8FFFFFFF: sign plus the shifted exponent and mantissa
+# k-means is trained on at most this many rows per centroid
+TRAIN_ROWS_PER_CENTROID = 64
+
+Rows = Union[slice, np.ndarray]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.maximum(norms, 1e-12)).astype(np.float32, copy=False)
+
+
+def training_sample(rows: int, centroids: int, rng: np.random.Generator) -> np.ndarray:
+    """Sorted row positions to train ``centroids`` k-means centroids on"""
+    size = min(rows, centroids * TRAIN_ROWS_PER_CENTROID)
+    return np.sort(rng.choice(rows, size, replace=False))
+
+
+def kmeans(sample: np.ndarray, centroids: int, rng: np.random.Generator, spherical: bool) -> np.ndarray:
+    """Lloyd's k-means; ``spherical`` clusters unit vectors by cosine, otherwise by L2 distance"""
+    centres = sample[rng.choice(len(sample), centroids, replace=False)].astype(np.float32)
+    for _ in range(KMEANS_ITERATIONS):
+        if spherical:
+            assignment = np.argmax(sample @ centres.T, axis=1)
+        else:
+            # argmin |x - c|^2 == argmax x.c - |c|^2 / 2
+            assignment = np.argmax(sample @ centres.T - 0.5 * (centres * centres).sum(axis=1), axis=1)
+        sums = np.zeros_like(centres)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=centroids)
+        # Empty clusters keep their previous centre
+        filled = counts > 0
+        centres[filled] = sums[filled] / counts[filled, None]
+        if spherical:
+            centres[filled] = normalize_rows(centres[filled])
+    return centres
+
+
+def widen_half(codes: np.ndarray) -> np.ndarray:
+    """float16 ``codes`` as float32 values scaled by 2^-112, with integer shifts.
+
+    numpy's own float16 conversion runs one value at a time; this is three
+    vectorized integer passes. Not valid for inf / NaN, which unit vectors
+    never hold.
+    """
+    bits = codes.view(np.int16).astype(np.int32)
+    # The sign is extended into bits 28-31; the mask keeps bit 31 only
+    bits <<= 13
+    bits &= HALF_BITS_MASK
+    return bits.view(np.float32)
+
+
+def row_blocks(rows: Optional[Rows], count: int, width: int):
+    """``rows`` (all of ``count`` when None) split into blocks of about ``SCORE_BLOCK_VALUES`` values"""
+    size = max(1, SCORE_BLOCK_VALUES // max(1, width))
+    if rows is None:
+        for start in range(0, count, size):
+            yield slice(start, min(start + size, count))
+    else:
+        for start in range(0, len(rows), size):
+            yield rows[start:start + size]
+
+
+class Codec:
+    """How an index stores its unit vectors: full-precision float32.
+
+    :meth:`encode` turns vectors into *row arrays* (``{"codes": ...}``, first
+    axis = rows), which the index filters, stacks and memory-maps without
+    knowing their layout. Trained state (PQ codebooks) lives on the codec and
+    is saved with :meth:`params`. ``lossy`` codecs return approximate scores,
+    which the index re-scores at full precision.
+    """
+
+    name = "float32"
+    lossy = False
+
+    def __init__(self):
+        self.dimensions: Optional[int] = None
+        self.trained_rows = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.dimensions is not None
+
+    def fit(self, vectors: np.ndarray):
+        self.dimensions = vectors.shape[1]
+        self.trained_rows = len(vectors)
+
+    def encode(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        return {"codes": np.ascontiguousarray(vectors, dtype=np.float32)}
+
+    def decode(self, arrays: Dict[str, np.ndarray], rows: Rows) -> np.ndarray:
+        return np.asarray(arrays["codes"][rows], dtype=np.float32)
+
+    def score(self, arrays: Dict[str, np.ndarray], query: np.ndarray, rows: Optional[Rows] = None) -> np.ndarray:
+        """Cosine of unit ``query`` against ``rows`` (all rows when None)"""
+        codes = arrays["codes"]
+        return codes @ query if rows is None else codes[rows] @ query
+
+    def params(self) -> Dict[str, np.ndarray]:
+        return {"dimensions": np.array(self.dimensions or 0), "trained_rows": np.array(self.trained_rows)}
+
+    def load_params(self, params: Dict[str, np.ndarray]):
+        self.dimensions = int(params["dimensions"]) or None
+        self.trained_rows = int(params["trained_rows"])
+
+    def needs_retraining(self, rows: int) -> bool:
+        return False
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by trained state"""
+        return 0
+
+    def _blocked_score(self, arrays: Dict[str, np.ndarray], query: np.ndarray, rows: Optional[Rows]) -> np.ndarray:
+        codes = arrays["codes"]
+        return np.concatenate([self.decode(arrays, block) @ query
+                               for block in row_blocks(rows, len(codes), codes.shape[1])] or
+                              [np.zeros(0, dtype=np.float32)])
+
+
+class Float16Codec(Codec):
+    """Half-precision vectors: half the bytes, cosines accurate to about 1e-3.
+
+    Costs CPU on every query: each block is widened to float32 before the
+    dot product, since numpy has no fast float16 arithmetic. With
+    :func:`widen_half` an exact scan takes about as long as int8's, two to
+    five times float32's; int8 stores half as much again for the same scan
+    cost, so prefer it when memory is the reason to quantize.
+    """
+
+    name = "float16"
+    lossy = True
+
+    def encode(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        return {"codes": vectors.astype(np.float16)}
+
+    def decode(self, arrays, rows):
+        return widen_half(arrays["codes"][rows]) * HALF_EXPONENT_REBIAS
+
+    def score(self, arrays, query, rows=None):
+        codes = arrays["codes"]
+        query = query * HALF_EXPONENT_REBIAS
+        return np.concatenate([widen_half(codes[block]) @ query
+                               for block in row_blocks(rows, len(codes), codes.shape[1])] or
+                              [np.zeros(0, dtype=np.float32)])
+
+
+class Int8Codec(Codec):
+    """Symmetric scalar quantization: one signed byte per dimension plus a float32 scale per row"""
+
+    name = "int8"
+    lossy = True
+
+    def encode(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return {"codes": codes, "scales": scales.astype(np.float32)}
+
+    def decode(self, arrays, rows):
+        return arrays["codes"][rows].astype(np.float32) * arrays["scales"][rows][:, None]
+
+    def score(self, arrays, query, rows=None):
+        return self._blocked_score(arrays, query, rows)
+
+
+class PQCodec(Codec):
+    """Product quantization: each of ``subvectors`` slices is replaced by one byte,
+    the nearest of 256 k-means centroids trained for that slice.
+
+    Queries are scored by asymmetric distance computation: a table of the
+    query slice against every centroid, summed over each row's codes.
+    Centroids are trained on the vectors present when the index is built,
+    so the index asks to be rebuilt once it has doubled in size.
+    """
+
+    name = "pq"
+    lossy = True
+
+    def __init__(self, subvectors: int = PQ_SUBVECTORS, seed: int = 0):
+        super().__init__()
+        self.subvectors = subvectors
+        self.seed = seed
+        self.codebooks: Optional[np.ndarray] = None      # (subvectors, centroids, slice width)
+
+    def fit(self, vectors: np.ndarray):
+        dimensions = vectors.shape[1]
+        wanted = self.subvectors or max(1, dimensions // 8)
+        subvectors = max(m for m in range(1, min(wanted, dimensions) + 1) if dimensions % m == 0)
+        width = dimensions // subvectors
+        centroids = min(PQ_CENTROIDS, len(vectors))
+
+        rng = np.random.default_rng(self.seed)
+        sample = vectors[training_sample(len(vectors), centroids, rng)]
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(sample[:, m * width:(m + 1) * width]), centroids, rng, spherical=False)
+            for m in range(subvectors)
+        ])
+        super().fit(vectors)
+
+    def encode(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        subvectors, _, width = self.codebooks.shape
+        codes = np.empty((len(vectors), subvectors), dtype=np.uint8)
+        for m, codebook in enumerate(self.codebooks):
+            part = vectors[:, m * width:(m + 1) * width]
+            codes[:, m] = np.argmax(part @ codebook.T - 0.5 * (codebook * codebook).sum(axis=1), axis=1)
+        return {"codes": codes}
+
+    def decode(self, arrays, rows):
+        codes = arrays["codes"][rows]
+        return np.concatenate([self.codebooks[m][codes[:, m]] for m in range(codes.shape[1])], axis=1)
+
+    def score(self, arrays, query, rows=None):
+        subvectors, _, width = self.codebooks.shape
+        tables = np.einsum("mcw,mw->mc", self.codebooks, query.reshape(subvectors, width))
+        positions = np.arange(subvectors)
+        return np.concatenate([tables[positions, arrays["codes"][block]].sum(axis=1)
+                               for block in row_blocks(rows, len(arrays["codes"]), subvectors)] or
+                              [np.zeros(0, dtype=np.float32)])
+
+    def params(self):
+        params = super().params()
+        if self.codebooks is not None:
+            params["codebooks"] = self.codebooks
+        return params
+
+    def load_params(self, params):
+        super().load_params(params)
+        self.codebooks = params["codebooks"] if "codebooks" in params else None
+
+    def needs_retraining(self, rows: int) -> bool:
+        return rows > 2 * self.trained_rows
+
+    @property
+    def nbytes(self) -> int:
+        return self.codebooks.nbytes if self.codebooks is not None else 0
+
+
+CODECS = {
+    "float32": Codec,
+    "float16": Float16Codec,
+    "int8": Int8Codec,
+    "pq": PQCodec,
+}
+
+
+def make_codec(name: str) -> Codec:
+    if name not in CODECS:
+        raise ValueError(f"Unknown vector quantization {name!r}; choose from {', '.join(CODECS)}")
+    return CODECS[name]()
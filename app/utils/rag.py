@@ -1,57 +1,123 @@
-import chromadb
-from chromadb.config import Settings
-import requests
+import asyncio
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple
 import os
 from datetime import datetime
 import uuid
+import time
+
+from utils.embeddings import create_embedder, EmbeddingError
+from utils.embedding_cache import EmbeddingCache
+from utils.ollama_client import OllamaClient, OllamaError, OllamaUnavailable
+from utils.response_cache import ResponseCache
+from utils.lexical_index import LexicalIndex
+from utils.vector_store import CollectionManager
+from utils.vector_index import WorkspaceIndexes
+from utils.retrieval import (
+    RETRIEVAL_MODE, RETRIEVAL_CANDIDATES, RETRIEVAL_RERANK, LEXICAL_MIN_SCORE_RATIO,
+    reciprocal_rank_fusion, rerank, dedupe
+)
+from utils.chunker import estimate_tokens
+from utils.metrics import timed
+from utils.context_packer import (
+    context_window, context_budget, truncate_to_tokens, pack_context, chunks_from_retrieval
+)
+
+# Chunks written to Chroma per add() call
+CHROMA_WRITE_BATCH = int(os.getenv("CHROMA_WRITE_BATCH", "256"))
+
+GENERATE_OPTIONS = {"temperature": 0.7, "num_predict": 500}
+GENERATE_TIMEOUT = float(os.getenv("OLLAMA_GENERATE_TIMEOUT", "30"))
 
 class RAGSystem:
     def __init__(self):
         self.ollama_url = os.getenv("OLLAMA_URL", "http://ollama:11434")
         self.model = os.getenv("OLLAMA_MODEL", "mistral")
         
-        # Initialize ChromaDB
-        chromadb_dir = "vector_db"
-        os.makedirs(chromadb_dir, exist_ok=True)
+        # Workspace collections, opened on first use: a PersistentClient only sees
+        # vectors written by its own process, so ingestion workers never open one
+        self.collections = CollectionManager()
+        # Small workspaces are searched in memory instead of through Chroma
+        self.vector_indexes = WorkspaceIndexes(self.collections)
         
-        self.chroma_client = chromadb.PersistentClient(
-            path=chromadb_dir,
-            settings=Settings(anonymized_telemetry=False)
-        )
+        # One keep-alive pool (and circuit breaker) for embeddings, generation and health checks
+        self.client = OllamaClient(self.ollama_url)
+        self.embedder = create_embedder(self.client, self.model)
+        self.embedding_cache = EmbeddingCache()
+        self.response_cache = ResponseCache(self.model)
+        self.lexical_index = LexicalIndex()
         
-        print(f"RAG System initialized with Ollama ({self.model})")
+        print(f"RAG System initialized with Ollama ({self.model}), {self.embedder.name} embeddings")
     
     def check_ai_status(self):
         """Check if Ollama is running"""
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except:
+            self.client.get("health", "/api/tags", timeout=5)
+            return True
+        except (OllamaUnavailable, OllamaError):
             return False
     
-    def embed_text(self, text: str) -> List[float]:
-        """Get embeddings from Ollama"""
+    async def acheck_ai_status(self):
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/embeddings",
-                json={"model": self.model, "prompt": text},
-                timeout=30
-            )
-            if response.status_code == 200:
-                return response.json()["embedding"]
-        except Exception as e:
-            print(f"Embedding error: {e}")
+            await self.client.aget("health", "/api/tags", timeout=5)
+            return True
+        except (OllamaUnavailable, OllamaError):
+            return False
+    
+    def embed_text(self, text: str) -> List[float]:
+        """Embed one text with the configured backend; raises EmbeddingError"""
+        return self.embed_texts([text])[0]
+    
+    @timed("embed")
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed many texts, serving repeats from the embedding cache.
         
-        # Fallback: simple dummy embedding
-        return [0.1] * 384
+        Raises EmbeddingError rather than returning placeholder vectors,
+        which would all match each other in the index.
+        """
+        embeddings = self.embedding_cache.get_many(self.embedder.model, texts)
+        
+        # Each distinct missing text is embedded once, in batched requests
+        missing = list(dict.fromkeys(t for t, e in zip(texts, embeddings) if e is None))
+        if missing:
+            start = time.perf_counter()
+            fresh = self.embedder.embed(missing)
+            self.embedding_cache.record_embedding_time(len(missing), time.perf_counter() - start)
+            self.embedding_cache.put_many(self.embedder.model, missing, fresh)
+            
+            by_text = dict(zip(missing, fresh))
+            embeddings = [e if e is not None else by_text[t] for t, e in zip(texts, embeddings)]
+        
+        return embeddings
     
-    def generate_response(self, query: str, context: str = "", user_id: int = None) -> Dict[str, Any]:
-        """Generate AI response using Ollama with tool calling"""
-        try:
-            # Prepare prompt with context
-            prompt = f"""You are an AI assistant for a workspace system. You have access to tools.
+    @timed("embed")
+    async def aembed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Async :meth:`embed_texts`; raises EmbeddingError"""
+        embeddings = await asyncio.to_thread(self.embedding_cache.get_many, self.embedder.model, texts)
+        
+        missing = list(dict.fromkeys(t for t, e in zip(texts, embeddings) if e is None))
+        if missing:
+            start = time.perf_counter()
+            fresh = await self.embedder.aembed(missing)
+            self.embedding_cache.record_embedding_time(len(missing), time.perf_counter() - start)
+            await asyncio.to_thread(self.embedding_cache.put_many, self.embedder.model, missing, fresh)
+            
+            by_text = dict(zip(missing, fresh))
+            embeddings = [e if e is not None else by_text[t] for t, e in zip(texts, embeddings)]
+        
+        return embeddings
+    
+    def build_prompt(self, query: str, context: str = "") -> str:
+        """Prompt with the tool instructions and document context.
+        
+        ``context`` is normally already packed by :meth:`pack_context`; any
+        other string is cut at a sentence end to the same token budget.
+        """
+        return self._prompt(query, truncate_to_tokens(context, self.context_budget(query)))
+    
+    @staticmethod
+    def _prompt(query: str, context: str) -> str:
+        return f"""You are an AI assistant for a workspace system. You have access to tools.
 
 Available tools:
 1. create_task - Create a new task for the user
@@ -61,60 +127,129 @@ Available tools:
 5. summarize_documents - Summarize selected documents
 
 Context from user's documents:
-{context[:2000]}
+{context}
 
 User query: {query}
 
 If the query requires information not in the context, say: "This information is not available in your uploaded documents."
+When you use a passage from the context, cite it by its [n] number.
 
 If the user asks to create a task, call create_task tool.
 If the user asks about their tasks, call list_tasks tool.
 If the user asks about documents, use search_documents or list_recent_documents.
 
 Respond naturally and helpfully."""
-
-            # Call Ollama
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {"temperature": 0.7, "num_predict": 500}
-                },
-                timeout=30
-            )
+    
+    def context_budget(self, query: str) -> int:
+        """Tokens of document context that fit this model's window alongside ``query`` and the answer"""
+        reserved = estimate_tokens(self._prompt(query, "")) + GENERATE_OPTIONS["num_predict"]
+        return context_budget(self.model, reserved)
+    
+    def pack_context(self, query: str, retrieval: Dict[str, Any]) -> Dict[str, Any]:
+        """Ranked retrieval results packed into the prompt budget with ``[n]`` citations"""
+        return pack_context(chunks_from_retrieval(retrieval), self.context_budget(query))
+    
+    def generate_payload(self, query: str, context: str = "", stream: bool = False) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "prompt": self.build_prompt(query, context),
+            "stream": stream,
+            "options": {**GENERATE_OPTIONS, "num_ctx": context_window(self.model)}
+        }
+    
+    @timed("generate")
+    def generate(self, query: str, context: str = "") -> Optional[Dict[str, Any]]:
+        """Plain (non-streaming) completion; None if Ollama is unavailable"""
+        try:
+            data = self.client.post("generate", "/api/generate", self.generate_payload(query, context),
+                                    timeout=GENERATE_TIMEOUT)
+            return self._completion(data)
+        except (OllamaUnavailable, OllamaError) as e:
+            print(f"AI generation error: {e}")
+        
+        return None
+    
+    @timed("generate")
+    async def agenerate(self, query: str, context: str = "") -> Optional[Dict[str, Any]]:
+        try:
+            data = await self.client.apost("generate", "/api/generate", self.generate_payload(query, context),
+                                           timeout=GENERATE_TIMEOUT)
+            return self._completion(data)
+        except (OllamaUnavailable, OllamaError) as e:
+            print(f"AI generation error: {e}")
+        
+        return None
+    
+    def stream_generate(self, query: str, context: str = "") -> Iterator[Dict[str, Any]]:
+        """Yield ``{"token": ...}`` as Ollama produces text, then ``{"done": True, ...}``.
+        
+        OllamaUnavailable / OllamaError propagate so the caller can fall back.
+        """
+        for data in self.client.stream("generate", "/api/generate", self.generate_payload(query, context, True)):
+            yield from self._stream_events(data)
+            if data.get("done"):
+                return
+    
+    async def astream_generate(self, query: str, context: str = "") -> AsyncIterator[Dict[str, Any]]:
+        async for data in self.client.astream("generate", "/api/generate",
+                                              self.generate_payload(query, context, True)):
+            for event in self._stream_events(data):
+                yield event
+            if data.get("done"):
+                return
+    
+    @staticmethod
+    def _completion(data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "response": data["response"],
+            "prompt_tokens": data.get("prompt_eval_count"),
+            "completion_tokens": data.get("eval_count")
+        }
+    
+    @staticmethod
+    def _stream_events(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        events = []
+        if data.get("response"):
+            events.append({"token": data["response"]})
+        if data.get("done"):
+            events.append({
+                "done": True,
+                "prompt_tokens": data.get("prompt_eval_count"),
+                "completion_tokens": data.get("eval_count")
+            })
+        return events
+    
+    def generate_response(self, query: str, context: str = "", user_id: int = None) -> Dict[str, Any]:
+        """Generate AI response using Ollama with tool calling"""
+        result = self.generate(query, context)
+        
+        if result:
+            ai_response = result["response"]
+            tools_called = []
             
-            if response.status_code == 200:
-                ai_response = response.json()["response"]
-                tools_called = []
-                
-                # Simple tool detection
-                if "create task" in query.lower() or "task for" in query.lower():
-                    tools_called.append("create_task")
-                    # Extract task title
-                    task_title = query.replace("create task", "").replace("Create task", "").strip()
-                    if not task_title:
-                        task_title = "Task from AI"
-                    ai_response = f"{ai_response}\n\nTask created: '{task_title}'"
-                
-                elif "list tasks" in query.lower() or "my tasks" in query.lower():
-                    tools_called.append("list_tasks")
-                    ai_response = f"{ai_response}\n\nHere are your tasks..."
-                
-                elif "document" in query.lower() and "search" in query.lower():
-                    tools_called.append("search_documents")
-                
-                elif "recent documents" in query.lower():
-                    tools_called.append("list_recent_documents")
-                
-                return {
-                    "response": ai_response,
-                    "tools_called": tools_called
-                }
+            # Simple tool detection
+            if "create task" in query.lower() or "task for" in query.lower():
+                tools_called.append("create_task")
+                # Extract task title
+                task_title = query.replace("create task", "").replace("Create task", "").strip()
+                if not task_title:
+                    task_title = "Task from AI"
+                ai_response = f"{ai_response}\n\nTask created: '{task_title}'"
             
-        except Exception as e:
-            print(f"AI generation error: {e}")
+            elif "list tasks" in query.lower() or "my tasks" in query.lower():
+                tools_called.append("list_tasks")
+                ai_response = f"{ai_response}\n\nHere are your tasks..."
+            
+            elif "document" in query.lower() and "search" in query.lower():
+                tools_called.append("search_documents")
+            
+            elif "recent documents" in query.lower():
+                tools_called.append("list_recent_documents")
+            
+            return {
+                "response": ai_response,
+                "tools_called": tools_called
+            }
         
         # Fallback response
         return {
@@ -122,56 +257,219 @@ Respond naturally and helpfully."""
             "tools_called": []
         }
     
-    def add_document_to_vector_db(self, document_id: str, text_chunks: List[str], metadata: Dict, workspace_id: str):
-        """Add document chunks to vector database"""
+    def add_document_to_vector_db(self, document_id: str, text_chunks: List[str], metadata: Dict, workspace_id: str,
+                                  embeddings: Optional[List[List[float]]] = None,
+                                  chunk_metadata: Optional[List[Dict]] = None, first_index: int = 0):
+        """Add document chunks to vector database (pass ``embeddings`` if already computed).
+        
+        ``chunk_metadata`` adds per-chunk fields such as the page range;
+        ``first_index`` numbers the chunks when a document is written in batches.
+        """
         try:
-            # Get or create collection for workspace
-            collection_name = f"workspace_{workspace_id}"
-            collection = self.chroma_client.get_or_create_collection(name=collection_name)
-            
-            # Generate embeddings and add to collection
-            embeddings = [self.embed_text(chunk) for chunk in text_chunks]
-            ids = [f"{document_id}_{i}" for i in range(len(text_chunks))]
-            metadatas = [{**metadata, "chunk_index": i, "document_id": document_id} 
+            # Generate embeddings in batches, then write to the collection in batches
+            if embeddings is None:
+                embeddings = self.embed_texts(text_chunks)
+            ids = [f"{document_id}_{first_index + i}" for i in range(len(text_chunks))]
+            chunk_metadata = chunk_metadata or [{}] * len(text_chunks)
+            metadatas = [{**metadata, **chunk_metadata[i], "chunk_index": first_index + i, "document_id": document_id} 
                         for i in range(len(text_chunks))]
             
-            collection.add(
-                embeddings=embeddings,
-                documents=text_chunks,
-                metadatas=metadatas,
-                ids=ids
-            )
-            
+            self.upsert_chunks(workspace_id, ids, text_chunks, embeddings, metadatas)
             return True
         except Exception as e:
             print(f"Vector DB error: {e}")
             return False
     
-    def search_documents(self, query: str, workspace_id: str, limit: int = 3) -> str:
-        """Search for relevant documents"""
+    def upsert_chunks(self, workspace_id: str, ids: List[str], texts: List[str],
+                      embeddings: List[List[float]], metadatas: List[Dict]):
+        """Write chunks to the workspace collection, ``CHROMA_WRITE_BATCH`` at a time"""
+        collection = self.collections.get_or_create(workspace_id)
+        for start in range(0, len(ids), CHROMA_WRITE_BATCH):
+            end = start + CHROMA_WRITE_BATCH
+            # upsert keeps retried ingestion jobs idempotent
+            collection.upsert(
+                embeddings=embeddings[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
+            )
+        self.lexical_index.add(workspace_id, ids, texts, [m.get("document_id", "") for m in metadatas])
+        self.vector_indexes.upsert(workspace_id, ids, texts, embeddings, metadatas)
+        
+        # Cached answers may have been built from the old chunks
+        self.response_cache.invalidate_workspace(workspace_id)
+    
+    def update_chunk_metadata(self, workspace_id: str, ids: List[str], metadatas: List[Dict]):
+        """Rewrite the metadata of stored chunks (offsets, pages) without touching their vectors"""
+        collection = self.collections.get(workspace_id)
+        if collection is None:
+            return
+        for start in range(0, len(ids), CHROMA_WRITE_BATCH):
+            end = start + CHROMA_WRITE_BATCH
+            collection.update(ids=ids[start:end], metadatas=metadatas[start:end])
+        self.vector_indexes.update_metadata(workspace_id, ids, metadatas)
+    
+    def document_chunk_ids(self, workspace_id: str, document_id: str) -> List[str]:
+        """IDs of every chunk stored for a document"""
+        collection = self.collections.get(workspace_id)
+        if collection is None:
+            return []
+        return collection.get(where={"document_id": document_id}, include=[])["ids"]
+    
+    def delete_chunks(self, workspace_id: str, ids: List[str]):
+        if not ids:
+            return
+        collection = self.collections.get(workspace_id)
+        if collection is not None:
+            for start in range(0, len(ids), CHROMA_WRITE_BATCH):
+                collection.delete(ids=ids[start:start + CHROMA_WRITE_BATCH])
+        self.lexical_index.delete_chunks(ids)
+        self.vector_indexes.delete(workspace_id, ids)
+        self.response_cache.invalidate_workspace(workspace_id)
+    
+    def backfill_lexical_index(self):
+        """Fill a new keyword index from the chunks already in the vector DB"""
+        if not self.lexical_index.is_empty():
+            return
+        for workspace_id, collection in self.collections.workspaces():
+            offset = 0
+            while True:
+                page = collection.get(include=["documents", "metadatas"], limit=CHROMA_WRITE_BATCH, offset=offset)
+                if not page["ids"]:
+                    break
+                self.lexical_index.add(workspace_id, page["ids"], page["documents"],
+                                       [(m or {}).get("document_id", "") for m in page["metadatas"]])
+                offset += len(page["ids"])
+    
+    def retrieve(self, query: str, workspace_id: str, limit: int = 3, mode: str = RETRIEVAL_MODE,
+                 rerank_results: bool = RETRIEVAL_RERANK) -> Dict[str, Any]:
+        """Top chunks for ``query``: ``{"ids", "documents", "metadatas", "embedding", "engine"}`` (empty on error).
+        
+        ``mode`` is "hybrid" (vector and keyword hits fused), "vector" or "lexical";
+        ``engine`` is what served the vector search: "exact", "ann", "chroma" or None.
+        """
+        retrieval = {"ids": [], "documents": [], "metadatas": [], "embedding": None, "engine": None}
         try:
-            collection_name = f"workspace_{workspace_id}"
-            collection = self.chroma_client.get_collection(name=collection_name)
+            collection = self.collections.get(workspace_id)
+            if collection is None:
+                return retrieval   # nothing indexed in this workspace yet
             
-            # Generate query embedding
-            query_embedding = self.embed_text(query)
+            # No dummy vector on failure: it would match arbitrary chunks
+            if mode != "lexical":
+                try:
+                    retrieval["embedding"] = self.embed_texts([query])[0]
+                except EmbeddingError as e:
+                    if mode == "vector":
+                        raise
+                    print(f"Search error: {e}; using keyword matches only")
             
-            # Search
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=limit
-            )
+            chunks, retrieval["engine"] = self._search(collection, query, workspace_id, retrieval["embedding"],
+                                                       limit, mode, rerank_results)
+            self._fill(retrieval, chunks)
+        except Exception as e:
+            print(f"Search error: {e}")
+        
+        return retrieval
+    
+    async def aretrieve(self, query: str, workspace_id: str, limit: int = 3, mode: str = RETRIEVAL_MODE,
+                        rerank_results: bool = RETRIEVAL_RERANK) -> Dict[str, Any]:
+        """Async :meth:`retrieve`: embeds on the event loop, searches in a thread"""
+        retrieval = {"ids": [], "documents": [], "metadatas": [], "embedding": None, "engine": None}
+        try:
+            collection = await asyncio.to_thread(self.collections.get, workspace_id)
+            if collection is None:
+                return retrieval
             
-            if results and results["documents"]:
-                # Combine results
-                context = "\n".join(results["documents"][0])
-                return context
+            if mode != "lexical":
+                try:
+                    retrieval["embedding"] = (await self.aembed_texts([query]))[0]
+                except EmbeddingError as e:
+                    if mode == "vector":
+                        raise
+                    print(f"Search error: {e}; using keyword matches only")
             
+            chunks, retrieval["engine"] = await asyncio.to_thread(self._search, collection, query, workspace_id,
+                                                                  retrieval["embedding"], limit, mode, rerank_results)
+            self._fill(retrieval, chunks)
         except Exception as e:
             print(f"Search error: {e}")
         
-        return ""
+        return retrieval
+    
+    @timed("search")
+    def _search(self, collection, query: str, workspace_id: str, embedding: Optional[List[float]],
+                limit: int, mode: str, rerank_results: bool) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Vector and keyword candidates, fused by reciprocal rank, reranked and deduplicated.
+        
+        Also returns the engine that served the vector search (None if there was none).
+        """
+        candidates = max(limit, RETRIEVAL_CANDIDATES)
+        rankings, found, engine = [], {}, None
+        index = self.vector_indexes.get(workspace_id, collection)
+        
+        if embedding is not None and mode != "lexical":
+            started = time.perf_counter()
+            hits = index.search(embedding, candidates) if index is not None else None
+            if hits is not None:
+                engine, hits = hits
+                ranking = [chunk_id for chunk_id, score in hits]
+                for chunk in index.get(ranking):
+                    found[chunk["id"]] = chunk
+            else:
+                engine = "chroma"
+                results = collection.query(query_embeddings=[embedding], n_results=candidates,
+                                           include=["documents", "metadatas"])
+                ranking = results["ids"][0]
+                for chunk_id, text, meta in zip(results["ids"][0], results["documents"][0], results["metadatas"][0]):
+                    found[chunk_id] = {"id": chunk_id, "text": text, "metadata": meta}
+            self.vector_indexes.record(engine, time.perf_counter() - started)
+            rankings.append([chunk_id for chunk_id in ranking if chunk_id in found])
+        
+        if mode != "vector":
+            hits = self.lexical_index.search(workspace_id, query, candidates)
+            lexical = [chunk_id for chunk_id, score in hits if score >= hits[0][1] * LEXICAL_MIN_SCORE_RATIO]
+            missing = [chunk_id for chunk_id in lexical if chunk_id not in found]
+            if missing and index is not None:
+                for chunk in index.get(missing):
+                    found[chunk["id"]] = chunk
+            elif missing:
+                results = collection.get(ids=missing, include=["documents", "metadatas"])
+                for chunk_id, text, meta in zip(results["ids"], results["documents"], results["metadatas"]):
+                    found[chunk_id] = {"id": chunk_id, "text": text, "metadata": meta}
+            rankings.append([chunk_id for chunk_id in lexical if chunk_id in found])
+        
+        fused = sorted(({**found[chunk_id], "score": score}
+                        for chunk_id, score in reciprocal_rank_fusion(rankings).items()),
+                       key=lambda c: c["score"], reverse=True)
+        if rerank_results:
+            fused = rerank(query, fused)
+        return dedupe(fused, limit), engine
     
-    def delete_document(self, document_id: str):
-        """Delete document from vector DB"""
-        pass
+    @staticmethod
+    def _fill(retrieval: Dict[str, Any], chunks: List[Dict[str, Any]]):
+        retrieval["ids"] = [c["id"] for c in chunks]
+        retrieval["documents"] = [c["text"] for c in chunks]
+        retrieval["metadatas"] = [c["metadata"] or {} for c in chunks]
+    
+    def search_documents(self, query: str, workspace_id: str, limit: int = 3) -> str:
+        """Search for relevant documents"""
+        return "\n".join(self.retrieve(query, workspace_id, limit)["documents"])
+    
+    async def asearch_documents(self, query: str, workspace_id: str, limit: int = 3) -> str:
+        return "\n".join((await self.aretrieve(query, workspace_id, limit))["documents"])
+    
+    def delete_document(self, document_id: str, workspace_id: str) -> bool:
+        """Delete all of a document's chunks from its workspace collection"""
+        collection = self.collections.get(workspace_id)
+        if collection is None:
+            return True   # nothing was ever indexed in this workspace
+        
+        try:
+            collection.delete(where={"document_id": document_id})
+            self.lexical_index.delete_document(document_id)
+            self.vector_indexes.delete_document(workspace_id, document_id)
+            self.response_cache.invalidate_workspace(workspace_id)
+            return True
+        except Exception as e:
+            print(f"Vector DB error: {e}")
+            return False
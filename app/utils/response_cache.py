@@ -0,0 +1,217 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Tuple
+
+from utils.db_pool import ConnectionPool
+from utils.embedding_cache import (normalize_text, pack_vector, unpack_vector,
+                                   STATS_FLUSH_LOOKUPS, STATS_FLUSH_SECONDS)
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "database/response_cache.db")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Cosine similarity for near-duplicate queries over the same chunks (1 = exact matches only)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+
+# Near-duplicate candidates compared per lookup
+SIMILAR_CANDIDATES = 50
+
+
+def normalize_query(query: str) -> str:
+    return normalize_text(query).lower().rstrip("?!. ")
+
+
+def chunk_key(chunk_ids: List[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(chunk_ids)).encode()).hexdigest()
+
+
+def unit_vector(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class ResponseCache:
+    """Generated chat answers keyed by workspace, normalized query and retrieved chunks.
+
+    A lookup hits on the exact key, or on a cached query over the same chunk
+    set whose embedding is at least ``similarity`` cosine-close. Entries expire
+    after ``ttl`` seconds and a workspace's entries are dropped whenever its
+    vector collection changes; the per-workspace version stops an answer
+    generated before that change from being stored after it.
+    Per-entry hit counts are buffered in memory and written in batches, so
+    a hit never takes SQLite's write lock.
+    """
+
+    def __init__(self, model: str, path: str = RESPONSE_CACHE_PATH, ttl: float = RESPONSE_CACHE_TTL,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY):
+        self.model = model
+        self.ttl = ttl
+        self.similarity = similarity
+        self.pool = ConnectionPool(path, size=4)
+
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "ms_saved": 0}
+        self._since = datetime.now().isoformat()
+        self._hits: Dict[str, int] = {}
+        self._pending_lookups = 0
+        self._last_flush = time.monotonic()
+
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    workspace_id TEXT NOT NULL,
+                    chunk_key TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    embedding BLOB,
+                    response TEXT NOT NULL,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    generate_ms REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_chunks ON responses(workspace_id, chunk_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses(expires_at)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS workspace_versions (
+                    workspace_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, workspace_id: str, query: str, chunk_ids: List[str],
+            embedding: Optional[List[float]] = None) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Cached answer (or None) and the workspace version to pass to :meth:`put`"""
+        if not self.enabled:
+            return None, 0
+
+        chunks = chunk_key(chunk_ids)
+        now = time.time()
+        columns = "key, response, prompt_tokens, completion_tokens, generate_ms"
+        with self.pool.connection() as conn:
+            version = self._version(conn, workspace_id)
+            row = conn.execute(f"SELECT {columns} FROM responses WHERE key = ? AND expires_at > ?",
+                               (self._key(workspace_id, query, chunks), now)).fetchone()
+            similar = False
+
+            if row is None and embedding is not None and self.similarity < 1:
+                query_vector = unit_vector(embedding)
+                best = 0.0
+                for candidate in conn.execute(f'''
+                    SELECT {columns}, embedding FROM responses
+                    WHERE workspace_id = ? AND chunk_key = ? AND expires_at > ? AND embedding IS NOT NULL
+                    ORDER BY expires_at DESC LIMIT ?
+                ''', (workspace_id, chunks, now, SIMILAR_CANDIDATES)):
+                    vector = unpack_vector(candidate[5])
+                    if len(vector) != len(query_vector):
+                        continue
+                    score = sum(a * b for a, b in zip(query_vector, vector))
+                    if score >= self.similarity and score > best:
+                        best, row, similar = score, candidate[:5], True
+
+        with self._lock:
+            if row is None:
+                self._stats["misses"] += 1
+                return None, version
+            self._stats["similar_hits" if similar else "hits"] += 1
+            self._stats["ms_saved"] += row[4]
+            self._hits[row[0]] = self._hits.get(row[0], 0) + 1
+            self._pending_lookups += 1
+            due = (self._pending_lookups >= STATS_FLUSH_LOOKUPS
+                   or time.monotonic() - self._last_flush >= STATS_FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+        return {"response": row[1], "prompt_tokens": row[2], "completion_tokens": row[3],
+                "similar": similar}, version
+
+    def put(self, workspace_id: str, query: str, chunk_ids: List[str], result: Dict[str, Any],
+            generate_ms: float, version: int, embedding: Optional[List[float]] = None):
+        """Store a generated answer unless the workspace changed since ``version`` was read"""
+        if not self.enabled:
+            return
+
+        chunks = chunk_key(chunk_ids)
+        now = time.time()
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if self._version(conn, workspace_id) != version:
+                conn.rollback()
+                return
+            conn.execute('''
+                INSERT OR REPLACE INTO responses
+                (key, workspace_id, chunk_key, query, embedding, response, prompt_tokens,
+                 completion_tokens, generate_ms, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (self._key(workspace_id, query, chunks), workspace_id, chunks, normalize_query(query),
+                  pack_vector(unit_vector(embedding)) if embedding is not None else None,
+                  result["response"], result.get("prompt_tokens"), result.get("completion_tokens"),
+                  generate_ms, now + self.ttl))
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            conn.commit()
+
+    def invalidate_workspace(self, workspace_id: str):
+        """Drop a workspace's answers after its documents changed"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO workspace_versions (workspace_id, version) VALUES (?, 1)
+                ON CONFLICT(workspace_id) DO UPDATE SET version = version + 1
+            ''', (workspace_id,))
+            conn.execute("DELETE FROM responses WHERE workspace_id = ?", (workspace_id,))
+            conn.commit()
+
+    def flush(self):
+        """Write the buffered per-entry hit counts in one transaction"""
+        with self._lock:
+            hits, self._hits = self._hits, {}
+            self._pending_lookups = 0
+            self._last_flush = time.monotonic()
+        if not hits:
+            return
+        with self.pool.connection() as conn:
+            conn.executemany("UPDATE responses SET hits = hits + ? WHERE key = ?",
+                             [(count, key) for key, count in hits.items()])
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        self.flush()
+        with self.pool.connection() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM responses WHERE expires_at > ?",
+                                   (time.time(),)).fetchone()[0]
+        with self._lock:
+            stats = dict(self._stats)
+
+        hits = stats["hits"] + stats["similar_hits"]
+        lookups = hits + stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "hits": stats["hits"],
+            "similar_hits": stats["similar_hits"],
+            "misses": stats["misses"],
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "ms_saved": round(stats["ms_saved"], 1),
+            "avg_ms_saved_per_hit": round(stats["ms_saved"] / hits, 1) if hits else 0.0,
+            "ttl_seconds": self.ttl,
+            "similarity_threshold": self.similarity,
+            "since": self._since
+        }
+
+    def _key(self, workspace_id: str, query: str, chunks: str) -> str:
+        raw = "\n".join([self.model, workspace_id, normalize_query(query), chunks])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @staticmethod
+    def _version(conn, workspace_id: str) -> int:
+        row = conn.execute("SELECT version FROM workspace_versions WHERE workspace_id = ?",
+                           (workspace_id,)).fetchone()
+        return row[0] if row else 0
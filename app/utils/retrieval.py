@@ -0,0 +1,104 @@
+import os
+import re
+from typing import List, Dict, Any, Sequence
+
+from utils.lexical_index import query_terms
+
+# "hybrid" (vector + keyword), "vector" or "lexical"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Candidates taken from each retriever before fusion
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RETRIEVAL_RERANK = os.getenv("RETRIEVAL_RERANK", "1") == "1"
+# A chunk this much covered by a better-ranked chunk of the same document is dropped
+RETRIEVAL_DEDUP_OVERLAP = float(os.getenv("RETRIEVAL_DEDUP_OVERLAP", "0.5"))
+RRF_K = 60
+# Keyword hits scoring below this share of the best one only matched common words
+LEXICAL_MIN_SCORE_RATIO = 0.2
+
+# Rerank score = fused rank + query-term coverage + exact identifier match
+RERANK_WEIGHTS = (0.5, 0.3, 0.2)
+
+_WORD = re.compile(r"\w+")
+# Query tokens such as ERR-4012, INV_2023_01 or v1.2.3 that should match verbatim
+_IDENTIFIER = re.compile(r"\b(?=[\w.-]*\d)[A-Za-z0-9][\w.-]*[A-Za-z0-9]\b")
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[str]], k: int = RRF_K) -> Dict[str, float]:
+    """``{id: sum(1 / (k + rank))}`` over every ranking the id appears in"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def rerank(query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reorder fused candidates by how much of the query each chunk contains.
+
+    Each candidate has ``text`` and a fused ``score``; scores are replaced by
+    a blend of the normalized fused score, the share of query terms present
+    and whether an identifier-like query token (``ERR-4012``) appears verbatim.
+    """
+    if not candidates:
+        return candidates
+    terms = set(query_terms(query))
+    identifiers = [i.lower() for i in _IDENTIFIER.findall(query)]
+    top = max(c["score"] for c in candidates) or 1.0
+    fused_weight, coverage_weight, exact_weight = RERANK_WEIGHTS
+
+    for candidate in candidates:
+        text = candidate["text"].lower()
+        coverage = len(terms & set(_WORD.findall(text))) / len(terms) if terms else 0.0
+        exact = 1.0 if identifiers and any(i in text for i in identifiers) else 0.0
+        candidate["score"] = (fused_weight * candidate["score"] / top + coverage_weight * coverage
+                              + exact_weight * exact)
+    return sorted(candidates, key=lambda c: c["score"], reverse=True)
+
+
+def dedupe(candidates: List[Dict[str, Any]], limit: int,
+           max_overlap: float = RETRIEVAL_DEDUP_OVERLAP) -> List[Dict[str, Any]]:
+    """Take the best ``limit`` candidates, skipping repeats of text already taken.
+
+    A chunk is skipped if its text was already taken (from any document) or
+    if at least ``max_overlap`` of it lies inside a better chunk of the same
+    document. A smaller overlap (neighbouring chunks share a few sentences)
+    is cut from the chunk's text instead, so no passage is sent twice.
+    """
+    taken: List[Dict[str, Any]] = []
+    seen_text = set()
+    for candidate in candidates:
+        text = candidate["text"]
+        if text.strip() in seen_text:
+            continue
+        meta = candidate.get("metadata") or {}
+        start, end = meta.get("char_start"), meta.get("char_end")
+
+        if start is not None and end is not None and end > start:
+            covered = []
+            for other in taken:
+                other_meta = other.get("metadata") or {}
+                if (other_meta.get("document_id") != meta.get("document_id")
+                        or other_meta.get("char_start") is None):
+                    continue
+                low, high = max(start, other_meta["char_start"]), min(end, other_meta["char_end"])
+                if high > low:
+                    covered.append((low, high))
+            if sum(high - low for low, high in covered) >= max_overlap * (end - start):
+                continue
+            # Offsets index the chunk text exactly, so trim a shared head or tail
+            for low, high in covered:
+                if low <= start < high:
+                    text, start = text[high - start:], high
+                elif low < end <= high:
+                    text, end = text[:low - start], low
+            # Keep the offsets in step with the trimmed text
+            start += len(text) - len(text.lstrip())
+            end -= len(text) - len(text.rstrip())
+            candidate = {**candidate, "text": text.strip(),
+                         "metadata": {**meta, "char_start": start, "char_end": end}}
+
+        seen_text.add(candidate["text"])
+        taken.append(candidate)
+        if len(taken) >= limit:
+            break
+    return taken
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from utils.db_pool import ConnectionPool
+
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))          # seconds
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+
+def hash_token(token: str) -> str:
+    """Only token digests are stored, so a leaked DB does not leak sessions"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class PrincipalCache:
+    """Thread-safe LRU cache of resolved users with a per-entry TTL"""
+
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # token digest -> (expires_at, principal)
+        self._by_user = {}              # user id -> set of token digests
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, principal: Dict[str, Any], max_age: Optional[float] = None):
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, principal)
+            self._entries.move_to_end(key)
+            self._by_user.setdefault(principal["id"], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._drop(key)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_user.get(entry[1]["id"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[entry[1]["id"]]
+
+
+class SessionStore:
+    """Bearer-token sessions backed by the indexed ``sessions`` table"""
+
+    def __init__(self, pool: ConnectionPool, ttl_hours: float = SESSION_TTL_HOURS,
+                 cache: Optional[PrincipalCache] = None):
+        self.pool = pool
+        self.ttl_seconds = ttl_hours * 3600
+        self.cache = cache or PrincipalCache()
+
+    def create(self, user_id: int, conn=None) -> str:
+        """New session token; pass ``conn`` to insert inside the caller's transaction"""
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        sql = "INSERT INTO sessions (token_hash, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)"
+        params = (hash_token(token), user_id, now, now + self.ttl_seconds)
+        if conn is not None:
+            conn.execute(sql, params)
+            return token
+        with self.pool.connection() as conn:
+            conn.execute(sql, params)
+            conn.commit()
+        return token
+
+    def cached(self, token: str) -> Optional[Dict[str, Any]]:
+        """The principal if it is in the in-process cache; no database access"""
+        return self.cache.get(hash_token(token))
+
+    def resolve(self, token: str, conn=None) -> Optional[Dict[str, Any]]:
+        """Return the principal for a token, or None if unknown/expired"""
+        key = hash_token(token)
+        principal = self.cache.get(key)
+        if principal is not None:
+            return principal
+
+        sql = '''
+            SELECT u.id, u.username, u.email, u.role, u.workspace_id, s.expires_at
+            FROM sessions s JOIN users u ON u.id = s.user_id
+            WHERE s.token_hash = ? AND u.is_active = 1
+        '''
+        if conn is not None:
+            row = conn.execute(sql, (key,)).fetchone()
+        else:
+            with self.pool.connection() as conn:
+                row = conn.execute(sql, (key,)).fetchone()
+
+        if not row:
+            return None
+        remaining = row[5] - time.time()
+        if remaining <= 0:
+            return None
+
+        principal = {
+            "id": row[0],
+            "username": row[1],
+            "email": row[2],
+            "role": row[3],
+            "workspace_id": row[4]
+        }
+        self.cache.put(key, principal, max_age=remaining)
+        return principal
+
+    def revoke(self, token: str):
+        key = hash_token(token)
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE token_hash = ?", (key,))
+            conn.commit()
+        self.cache.invalidate(key)
+
+    def revoke_user(self, user_id: int):
+        """Log a user out everywhere"""
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            conn.commit()
+        self.cache.invalidate_user(user_id)
+
+    def purge_expired(self) -> int:
+        with self.pool.connection() as conn:
+            cursor = conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+            return cursor.rowcount
@@ -0,0 +1,134 @@
+import hashlib
+import os
+from typing import AsyncIterator, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): concurrent chunk PUTs are then caught only by the conditional progress update
+    fcntl = None
+
+UPLOAD_DIR = "uploads"
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))          # 1 MiB
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(1024 * 1024 * 1024)))     # 1 GiB
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))          # seconds without a chunk
+UPLOAD_CLEANUP_INTERVAL = int(os.getenv("UPLOAD_CLEANUP_INTERVAL", "3600"))
+
+
+class UploadTooLarge(Exception):
+    """Raised as soon as a stream grows past its size limit"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds limit of {limit} bytes")
+        self.limit = limit
+
+
+class UploadBusy(Exception):
+    """Another request is writing or completing the same upload"""
+
+
+def upload_path(file_id: str, filename: str) -> str:
+    # basename() keeps client supplied names from escaping the upload dir
+    return os.path.join(UPLOAD_DIR, f"{file_id}_{os.path.basename(filename)}")
+
+
+async def iter_upload_file(file, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield an ``UploadFile`` in fixed-size chunks"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _write_chunk(f, hasher, chunk: bytes):
+    f.write(chunk)
+    if hasher is not None:
+        hasher.update(chunk)
+
+
+def _open_at(path: str, offset: int):
+    f = open(path, "r+b")
+    f.truncate(offset)
+    f.seek(offset)
+    return f
+
+
+async def stream_to_disk(chunks: AsyncIterator[bytes], dest_path: str, max_bytes: int = MAX_UPLOAD_BYTES,
+                         offset: Optional[int] = None, compute_hash: bool = True) -> Tuple[int, str]:
+    """Copy an async byte stream to ``dest_path`` without buffering it in memory.
+
+    Disk writes and hashing run in the threadpool so the event loop stays free.
+    Returns ``(bytes_written, sha256_hex)``; the hash is empty when disabled.
+    With ``offset`` the existing file is cut back to ``offset`` and written
+    from there, so bytes left by an earlier attempt whose progress was never
+    recorded are overwritten rather than kept. On failure (limit exceeded,
+    client disconnect) a new file is removed and an existing one truncated
+    back to ``offset``.
+    """
+    hasher = hashlib.sha256() if compute_hash else None
+    written = 0
+    if offset is None:
+        f = await run_in_threadpool(open, dest_path, "wb")
+    else:
+        f = await run_in_threadpool(_open_at, dest_path, offset)
+    try:
+        async for chunk in chunks:
+            written += len(chunk)
+            if written > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            await run_in_threadpool(_write_chunk, f, hasher, chunk)
+    except BaseException:
+        if offset is not None:
+            await run_in_threadpool(f.truncate, offset)
+        await run_in_threadpool(f.close)
+        if offset is None:
+            await run_in_threadpool(_remove_quietly, dest_path)
+        raise
+    await run_in_threadpool(f.close)
+    return written, hasher.hexdigest() if hasher else ""
+
+
+def lock_upload(path: str):
+    """Exclusive lock on a chunked upload's file, held until the returned handle is closed.
+
+    ``flock`` also excludes the other API worker processes; raises
+    :class:`UploadBusy` instead of waiting when the lock is taken.
+    """
+    f = open(path, "rb")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise UploadBusy("Another request is writing this upload")
+    return f
+
+
+def stale_part_files(cutoff: float, known: set):
+    """Chunked upload files not in ``known`` and last written before ``cutoff``"""
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.name.endswith(".part") and entry.path not in known:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    yield entry.path
+            except FileNotFoundError:
+                pass
+
+
+def hash_file(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """SHA-256 of a file on disk, read in fixed-size chunks"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
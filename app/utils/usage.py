@@ -0,0 +1,292 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from utils.db_pool import ConnectionPool
+
+USAGE_DAILY_MAX_DAYS = int(os.getenv("USAGE_DAILY_MAX_DAYS", "366"))
+
+# Bump when the counters change meaning; init recomputes them from the base tables
+USAGE_SCHEMA_VERSION = 2
+
+SCOPES = ("user", "workspace", "tool")
+COUNTER_NAMES = ("chats", "tokens", "tasks", "ai_tasks", "calls")
+# The only tool call recorded is create_task, counted as the tasks the assistant created
+COUNTER_COLUMNS = {"chats": "chats", "tokens": "tokens", "tasks": "tasks", "ai_tasks": "ai_tasks", "calls": "ai_tasks"}
+
+# The workspace of the row's user; chats and tasks only store the user
+WORKSPACE_OF = "COALESCE((SELECT workspace_id FROM users WHERE id = {row}.user_id), '')"
+# 0 collects rows without a user instead of letting NULL allocate a new rowid
+USER_OF = "COALESCE({row}.user_id, 0)"
+TOKENS_OF = ("COALESCE(json_extract({row}.metadata, '$.prompt_tokens'), 0)"
+             " + COALESCE(json_extract({row}.metadata, '$.completion_tokens'), 0)")
+AI_TASK_OF = "(COALESCE({row}.created_by_ai, 0) != 0)"
+DAY_OF = "substr(COALESCE({row}.created_at, CURRENT_TIMESTAMP), 1, 10)"
+UPSERT_COUNTERS = '''ON CONFLICT (user_id) DO UPDATE SET
+            chats = chats + excluded.chats,
+            tokens = tokens + excluded.tokens,
+            tasks = tasks + excluded.tasks,
+            ai_tasks = ai_tasks + excluded.ai_tasks'''
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS usage_meta (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    ''',
+    # One row per user; overall and per-workspace totals are summed from these
+    # when read, so a write touches a single counter row
+    '''
+    CREATE TABLE IF NOT EXISTS usage_user_counters (
+        user_id INTEGER PRIMARY KEY,
+        chats INTEGER NOT NULL DEFAULT 0,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        tasks INTEGER NOT NULL DEFAULT 0,
+        ai_tasks INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS usage_daily (
+        day TEXT NOT NULL,
+        workspace_id TEXT NOT NULL,
+        chats INTEGER NOT NULL DEFAULT 0,
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        latency_ms REAL NOT NULL DEFAULT 0,
+        latency_count INTEGER NOT NULL DEFAULT 0,
+        fallback_chats INTEGER NOT NULL DEFAULT 0,
+        cached_chats INTEGER NOT NULL DEFAULT 0,
+        tasks INTEGER NOT NULL DEFAULT 0,
+        ai_tasks INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, workspace_id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+TRIGGER_NAMES = ("usage_chats_insert", "usage_chats_delete", "usage_tasks_insert", "usage_tasks_delete")
+
+TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS usage_chats_insert AFTER INSERT ON chats BEGIN
+        INSERT INTO usage_user_counters (user_id, chats, tokens)
+        VALUES ({USER_OF.format(row="NEW")}, 1, {TOKENS_OF.format(row="NEW")})
+        {UPSERT_COUNTERS};
+        INSERT INTO usage_daily (day, workspace_id, chats, prompt_tokens, completion_tokens,
+                                 latency_ms, latency_count, fallback_chats, cached_chats)
+        VALUES ({DAY_OF.format(row="NEW")}, {WORKSPACE_OF.format(row="NEW")}, 1,
+                COALESCE(json_extract(NEW.metadata, '$.prompt_tokens'), 0),
+                COALESCE(json_extract(NEW.metadata, '$.completion_tokens'), 0),
+                COALESCE(json_extract(NEW.metadata, '$.latency_ms'), 0),
+                json_extract(NEW.metadata, '$.latency_ms') IS NOT NULL,
+                COALESCE(json_extract(NEW.metadata, '$.fallback'), 0),
+                COALESCE(json_extract(NEW.metadata, '$.cached'), 0))
+        ON CONFLICT (day, workspace_id) DO UPDATE SET
+            chats = chats + excluded.chats,
+            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+            completion_tokens = completion_tokens + excluded.completion_tokens,
+            latency_ms = latency_ms + excluded.latency_ms,
+            latency_count = latency_count + excluded.latency_count,
+            fallback_chats = fallback_chats + excluded.fallback_chats,
+            cached_chats = cached_chats + excluded.cached_chats;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS usage_chats_delete AFTER DELETE ON chats BEGIN
+        INSERT INTO usage_user_counters (user_id, chats, tokens)
+        VALUES ({USER_OF.format(row="OLD")}, -1, -({TOKENS_OF.format(row="OLD")}))
+        {UPSERT_COUNTERS};
+    END
+    ''',
+    # Tasks created by the chat assistant are its create_task tool calls
+    f'''
+    CREATE TRIGGER IF NOT EXISTS usage_tasks_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO usage_user_counters (user_id, tasks, ai_tasks)
+        VALUES ({USER_OF.format(row="NEW")}, 1, {AI_TASK_OF.format(row="NEW")})
+        {UPSERT_COUNTERS};
+        INSERT INTO usage_daily (day, workspace_id, tasks, ai_tasks)
+        VALUES ({DAY_OF.format(row="NEW")}, {WORKSPACE_OF.format(row="NEW")}, 1, {AI_TASK_OF.format(row="NEW")})
+        ON CONFLICT (day, workspace_id) DO UPDATE SET
+            tasks = tasks + excluded.tasks,
+            ai_tasks = ai_tasks + excluded.ai_tasks;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS usage_tasks_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO usage_user_counters (user_id, tasks, ai_tasks)
+        VALUES ({USER_OF.format(row="OLD")}, -1, -{AI_TASK_OF.format(row="OLD")})
+        {UPSERT_COUNTERS};
+    END
+    ''',
+]
+
+# Earlier layouts, dropped before a rebuild
+LEGACY = [
+    "DROP TRIGGER IF EXISTS usage_users_insert",
+    "DROP TRIGGER IF EXISTS usage_users_delete",
+    "DROP TABLE IF EXISTS usage_counters",
+]
+
+# Recompute everything from the base tables: one grouped scan of chats and of
+# tasks into per-user, per-day temp tables, from which every counter is summed.
+# "WHERE true" lets SQLite parse an upsert that follows a SELECT.
+REBUILD = [
+    "DELETE FROM usage_user_counters",
+    "DELETE FROM usage_daily",
+    "DROP TABLE IF EXISTS temp.usage_chat_days",
+    "DROP TABLE IF EXISTS temp.usage_task_days",
+    f'''
+    CREATE TEMP TABLE usage_chat_days AS
+    SELECT {USER_OF.format(row="chats")} AS user_id, {DAY_OF.format(row="chats")} AS day, COUNT(*) AS chats,
+           SUM(COALESCE(json_extract(metadata, '$.prompt_tokens'), 0)) AS prompt_tokens,
+           SUM(COALESCE(json_extract(metadata, '$.completion_tokens'), 0)) AS completion_tokens,
+           SUM(COALESCE(json_extract(metadata, '$.latency_ms'), 0)) AS latency_ms,
+           COUNT(json_extract(metadata, '$.latency_ms')) AS latency_count,
+           SUM(COALESCE(json_extract(metadata, '$.fallback'), 0)) AS fallback_chats,
+           SUM(COALESCE(json_extract(metadata, '$.cached'), 0)) AS cached_chats
+    FROM chats GROUP BY 1, 2
+    ''',
+    f'''
+    CREATE TEMP TABLE usage_task_days AS
+    SELECT {USER_OF.format(row="tasks")} AS user_id, {DAY_OF.format(row="tasks")} AS day, COUNT(*) AS tasks,
+           SUM({AI_TASK_OF.format(row="tasks")}) AS ai_tasks
+    FROM tasks GROUP BY 1, 2
+    ''',
+    '''
+    INSERT INTO usage_user_counters (user_id, chats, tokens)
+    SELECT user_id, SUM(chats), SUM(prompt_tokens + completion_tokens) FROM usage_chat_days GROUP BY user_id
+    ''',
+    '''
+    INSERT INTO usage_user_counters (user_id, tasks, ai_tasks)
+    SELECT user_id, SUM(tasks), SUM(ai_tasks) FROM usage_task_days
+    WHERE true
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET tasks = excluded.tasks, ai_tasks = excluded.ai_tasks
+    ''',
+    '''
+    INSERT INTO usage_daily (day, workspace_id, chats, prompt_tokens, completion_tokens,
+                             latency_ms, latency_count, fallback_chats, cached_chats)
+    SELECT d.day, COALESCE(u.workspace_id, ''), SUM(d.chats), SUM(d.prompt_tokens), SUM(d.completion_tokens),
+           SUM(d.latency_ms), SUM(d.latency_count), SUM(d.fallback_chats), SUM(d.cached_chats)
+    FROM usage_chat_days d LEFT JOIN users u ON u.id = d.user_id
+    GROUP BY 1, 2
+    ''',
+    '''
+    INSERT INTO usage_daily (day, workspace_id, tasks, ai_tasks)
+    SELECT d.day, COALESCE(u.workspace_id, ''), SUM(d.tasks), SUM(d.ai_tasks)
+    FROM usage_task_days d LEFT JOIN users u ON u.id = d.user_id
+    WHERE true
+    GROUP BY 1, 2
+    ON CONFLICT (day, workspace_id) DO UPDATE SET tasks = excluded.tasks, ai_tasks = excluded.ai_tasks
+    ''',
+    "DROP TABLE temp.usage_chat_days",
+    "DROP TABLE temp.usage_task_days",
+]
+
+
+def install(cursor):
+    """Create the usage tables and triggers; counters are backfilled on first install.
+
+    Runs inside the caller's transaction, so no chat or task written
+    concurrently is counted twice or missed. When the schema version
+    changed, the old triggers and tables are replaced first.
+    """
+    for statement in TABLES:
+        cursor.execute(statement)
+    row = cursor.execute("SELECT value FROM usage_meta WHERE name = 'version'").fetchone()
+    current = row is not None and row[0] == USAGE_SCHEMA_VERSION
+    if not current:
+        for statement in LEGACY + [f"DROP TRIGGER IF EXISTS {name}" for name in TRIGGER_NAMES]:
+            cursor.execute(statement)
+    for statement in TRIGGERS:
+        cursor.execute(statement)
+    if not current:
+        rebuild(cursor)
+
+
+def rebuild(cursor):
+    for statement in REBUILD:
+        cursor.execute(statement)
+    cursor.execute("INSERT OR REPLACE INTO usage_meta (name, value) VALUES ('version', ?)", (USAGE_SCHEMA_VERSION,))
+
+
+class UsageCounters:
+    """Read side of the usage counters and daily rollups.
+
+    The tables are maintained by triggers on ``chats`` and ``tasks``, in
+    the same transaction as the write, so every endpoint and worker that
+    inserts rows is counted without calling into this class. Each write
+    updates its user's counter row and one daily rollup; overall and
+    per-workspace figures are summed from the per-user rows, which costs
+    one row per user instead of ``COUNT(*)`` scans over the history.
+    A user's counts follow them to another workspace, while the daily
+    rollups keep the workspace at the time of the write.
+    Deleting a chat or task lowers the totals; the daily rollups record
+    activity and are left as they were.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+
+    def totals(self) -> Dict[str, int]:
+        with self.pool.connection() as conn:
+            row = conn.execute('''
+                SELECT COALESCE(SUM(chats), 0), COALESCE(SUM(tokens), 0), COALESCE(SUM(tasks), 0),
+                       COALESCE(SUM(ai_tasks), 0), (SELECT COUNT(*) FROM users)
+                FROM usage_user_counters
+            ''').fetchone()
+        return dict(zip(("chats", "tokens", "tasks", "ai_tasks", "users"), row))
+
+    def tools(self) -> Dict[str, int]:
+        """Calls per tool. Only ``create_task`` is recorded, as the tasks the assistant created"""
+        return {"create_task": self.totals()["ai_tasks"]}
+
+    def top(self, scope: str, name: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Largest ``name`` counters within ``scope`` ("user", "workspace" or "tool")
+
+        ``calls`` counts ``create_task`` calls, the only tool recorded, so
+        the "tool" scope has that one entry.
+        """
+        if scope not in SCOPES or name not in COUNTER_NAMES:
+            raise ValueError(f"Unknown usage counter {scope}/{name}")
+        if scope == "tool":
+            return [{"tool": "create_task", name: self.totals()[COUNTER_COLUMNS[name]]}][:limit]
+        column = COUNTER_COLUMNS[name]
+        if scope == "user":
+            query = f"SELECT user_id, {column} FROM usage_user_counters ORDER BY {column} DESC LIMIT ?"
+        else:
+            query = f'''
+                SELECT COALESCE(u.workspace_id, ''), SUM(c.{column}) AS value
+                FROM usage_user_counters c LEFT JOIN users u ON u.id = c.user_id
+                GROUP BY 1 ORDER BY value DESC LIMIT ?
+            '''
+        with self.pool.connection() as conn:
+            rows = conn.execute(query, (limit,)).fetchall()
+        return [{scope: str(key), name: value} for key, value in rows]
+
+    def daily(self, days: int = 30, workspace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Per-day chats, tokens, average latency and tasks for the last ``days`` days (UTC)"""
+        days = max(1, min(days, USAGE_DAILY_MAX_DAYS))
+        since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        where, params = "day >= ?", [since]
+        if workspace_id is not None:
+            where += " AND workspace_id = ?"
+            params.append(workspace_id)
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT day, SUM(chats), SUM(prompt_tokens), SUM(completion_tokens), SUM(latency_ms),
+                       SUM(latency_count), SUM(fallback_chats), SUM(cached_chats), SUM(tasks), SUM(ai_tasks)
+                FROM usage_daily WHERE {where}
+                GROUP BY day ORDER BY day
+            ''', params).fetchall()
+        return [{
+            "day": row[0],
+            "chats": row[1],
+            "prompt_tokens": row[2],
+            "completion_tokens": row[3],
+            "avg_latency_ms": round(row[4] / row[5], 1) if row[5] else None,
+            "fallback_chats": row[6],
+            "cached_chats": row[7],
+            "tasks": row[8],
+            "ai_tasks": row[9]
+        } for row in rows]
@@ -0,0 +1,497 @@
+import copy
+import glob
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple, Any, Callable
+
+import numpy as np
+
+from utils.quantization import Codec, make_codec, normalize_rows, kmeans, training_sample, row_blocks
+
+# In-memory indexes for small workspaces; "0" sends every vector search to Chroma
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "1") == "1"
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "vector_db/memory_index")
+# Workspaces with more chunks than this are searched in Chroma
+VECTOR_INDEX_MAX_CHUNKS = int(os.getenv("VECTOR_INDEX_MAX_CHUNKS", "20000"))
+# Up to this many chunks every vector is scored; above it an IVF index narrows the scan
+VECTOR_INDEX_EXACT_MAX = int(os.getenv("VECTOR_INDEX_EXACT_MAX", "4000"))
+# IVF lists scanned per query
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+# Workspace indexes kept loaded per process, and the vector bytes they may hold
+# (least recently used are dropped, keeping at least one)
+VECTOR_INDEX_CACHE = int(os.getenv("VECTOR_INDEX_CACHE", "256"))
+VECTOR_INDEX_CACHE_MB = int(os.getenv("VECTOR_INDEX_CACHE_MB", "1024"))
+# Changed indexes are written back to disk at most this often (and on eviction / shutdown)
+VECTOR_INDEX_SAVE_SECONDS = float(os.getenv("VECTOR_INDEX_SAVE_SECONDS", "30"))
+# How vectors are stored: "float32", "float16", "int8" or "pq" (see utils.quantization).
+# float16 widens every block to float32 per query (exact scans ~3-4x float32's CPU);
+# int8 costs about the same and is half its size, so prefer it to save memory
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "float32")
+# Candidates of a quantized search re-scored with full-precision vectors from Chroma (0: none)
+VECTOR_INDEX_RESCORE = int(os.getenv("VECTOR_INDEX_RESCORE", "50"))
+
+# Chunks read from Chroma per page when an index is built
+BUILD_PAGE_SIZE = 1000
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the ``k`` highest scores, best first"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class IVFIndex:
+    """Inverted-file ANN over an index's stored vectors.
+
+    Rows are clustered around ``sqrt(n)`` k-means centroids (trained on a
+    sample); a query scores the centroids, then only the rows in the
+    ``nprobe`` closest lists. After a change, :meth:`reassigned` files the
+    new rows under the same centroids, which is much cheaper than training.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], codec: Codec, rows: int,
+                 nprobe: int = VECTOR_INDEX_NPROBE, seed: int = 0):
+        self.nprobe = max(1, nprobe)
+        self.trained_rows = rows
+        lists = max(1, int(np.sqrt(rows)))
+        rng = np.random.default_rng(seed)
+        sample = normalize_rows(codec.decode(arrays, training_sample(rows, lists, rng)))
+        self.centroids = kmeans(sample, lists, rng, spherical=True)
+        self._assign(arrays, codec, rows)
+
+    def reassigned(self, arrays: Dict[str, np.ndarray], codec: Codec, rows: int) -> "IVFIndex":
+        """A copy with ``arrays`` filed under these centroids; searches holding this one are unaffected"""
+        index = copy.copy(self)
+        index._assign(arrays, codec, rows)
+        return index
+
+    def _assign(self, arrays: Dict[str, np.ndarray], codec: Codec, rows: int):
+        assignment = np.concatenate([np.argmax(codec.decode(arrays, block) @ self.centroids.T, axis=1)
+                                     for block in row_blocks(None, rows, len(self.centroids[0]))])
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def search(self, arrays: Dict[str, np.ndarray], codec: Codec, query: np.ndarray,
+               k: int) -> Tuple[np.ndarray, np.ndarray]:
+        probes = top_k(self.centroids @ query, self.nprobe)
+        rows = np.concatenate([self.lists[p] for p in probes])
+        scores = codec.score(arrays, query, rows)
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+
+class VectorIndex:
+    """One workspace's chunks as contiguous arrays of (possibly quantized) unit vectors.
+
+    Queries are cosine top-k: every row is scored up to ``exact_max`` rows,
+    an :class:`IVFIndex` narrows the scan above that, trained on the first
+    search and retrained once the index has doubled in size. With a lossy
+    codec the best ``rescore`` candidates are re-ranked with full-precision
+    vectors from ``fetch_vectors``. Chunk texts and metadata are kept
+    alongside, so a search never touches Chroma otherwise. Changes replace
+    the arrays rather than editing them, so a search holding the previous
+    ones stays consistent.
+    """
+
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict],
+                 arrays: Dict[str, np.ndarray], codec: Codec, exact_max: int = VECTOR_INDEX_EXACT_MAX,
+                 rescore: int = VECTOR_INDEX_RESCORE):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.arrays = arrays
+        self.codec = codec
+        self.exact_max = exact_max
+        self.rescore = rescore
+        # ids -> full-precision vectors in the same order; set by WorkspaceIndexes
+        self.fetch_vectors: Optional[Callable[[List[str]], List[List[float]]]] = None
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        self._ivf: Optional[IVFIndex] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], metadatas: List[Dict], vectors: np.ndarray,
+              codec: Codec, exact_max: int = VECTOR_INDEX_EXACT_MAX,
+              rescore: int = VECTOR_INDEX_RESCORE) -> "VectorIndex":
+        """Index of full-precision ``vectors``, training ``codec`` on them"""
+        arrays = {}
+        if len(ids):
+            vectors = normalize_rows(vectors)
+            codec.fit(vectors)
+            arrays = codec.encode(vectors)
+        return cls(ids, documents, metadatas, arrays, codec, exact_max, rescore)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values()) + self.codec.nbytes
+
+    @classmethod
+    def load(cls, prefix: str, codec: Codec, exact_max: int = VECTOR_INDEX_EXACT_MAX,
+             rescore: int = VECTOR_INDEX_RESCORE) -> Optional["VectorIndex"]:
+        """Index saved at ``prefix`` with row arrays memory-mapped; None if missing, torn or
+        stored with another codec than ``codec``"""
+        try:
+            with open(f"{prefix}.json", encoding="utf-8") as f:
+                chunks = json.load(f)
+            if chunks.get("quantization") != codec.name:
+                return None
+            arrays = {name: np.load(f"{prefix}.{name}.npy", mmap_mode="r") for name in chunks["arrays"]}
+            with np.load(f"{prefix}.codec.npz") as params:
+                codec.load_params(dict(params))
+        except (OSError, ValueError, KeyError):
+            return None
+        if any(len(array) != len(chunks["ids"]) for array in arrays.values()):
+            return None
+        return cls(chunks["ids"], chunks["documents"], chunks["metadatas"], arrays, codec, exact_max, rescore)
+
+    def save(self, prefix: str):
+        # The chunk list goes last: a torn write leaves row counts that do not match it
+        for name, array in self.arrays.items():
+            with open(f"{prefix}.{name}.npy.tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+        with open(f"{prefix}.codec.npz.tmp", "wb") as f:
+            np.savez(f, **self.codec.params())
+        with open(f"{prefix}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"quantization": self.codec.name, "arrays": list(self.arrays),
+                       "ids": self.ids, "documents": self.documents, "metadatas": self.metadatas}, f)
+        for name in self.arrays:
+            os.replace(f"{prefix}.{name}.npy.tmp", f"{prefix}.{name}.npy")
+        os.replace(f"{prefix}.codec.npz.tmp", f"{prefix}.codec.npz")
+        os.replace(f"{prefix}.json.tmp", f"{prefix}.json")
+
+    def search(self, embedding: List[float], k: int) -> Optional[Tuple[str, List[Tuple[str, float]]]]:
+        """``(engine, [(chunk_id, cosine)])`` best first; None if the query has another dimension"""
+        with self._lock:
+            ids, arrays = self.ids, self.arrays
+            if not ids:
+                return "exact", []
+            if len(embedding) != self.codec.dimensions:
+                return None
+            if len(ids) > self.exact_max and self._ivf is None:
+                self._ivf = IVFIndex(arrays, self.codec, len(ids))
+            ivf = self._ivf
+
+        query = normalize_rows(np.asarray([embedding], dtype=np.float32))[0]
+        rescoring = self.codec.lossy and self.rescore > 0 and self.fetch_vectors is not None
+        candidates = max(k, self.rescore) if rescoring else k
+        if ivf is not None:
+            rows, scores = ivf.search(arrays, self.codec, query, candidates)
+            engine = "ann"
+        else:
+            scores = self.codec.score(arrays, query)
+            rows = top_k(scores, candidates)
+            scores = scores[rows]
+            engine = "exact"
+        if rescoring:
+            rows, scores = self._rescore(ids, rows, scores, query)
+        return engine, [(ids[r], float(s)) for r, s in zip(rows[:k], scores[:k])]
+
+    def _rescore(self, ids: List[str], rows: np.ndarray, scores: np.ndarray,
+                 query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        try:
+            vectors = self.fetch_vectors([ids[r] for r in rows])
+        except Exception as e:
+            print(f"Vector index: full-precision rescoring failed, using quantized scores: {e}")
+            return rows, scores
+        exact = normalize_rows(np.asarray(vectors, dtype=np.float32)) @ query
+        order = np.argsort(-exact)
+        return rows[order], exact[order]
+
+    def get(self, ids: List[str]) -> List[Dict[str, Any]]:
+        """``{"id", "text", "metadata"}`` for the chunks present, in the order given"""
+        with self._lock:
+            rows, documents, metadatas = self._rows, self.documents, self.metadatas
+        return [{"id": chunk_id, "text": documents[rows[chunk_id]], "metadata": metadatas[rows[chunk_id]]}
+                for chunk_id in ids if chunk_id in rows]
+
+    def upsert(self, ids: List[str], texts: List[str], embeddings: List[List[float]], metadatas: List[Dict]):
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        replaced = set(ids)
+        with self._lock:
+            if not self.codec.trained:
+                self.codec.fit(vectors)
+            self._replace([chunk_id not in replaced for chunk_id in self.ids], ids, texts,
+                          self.codec.encode(vectors), metadatas)
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]):
+        with self._lock:
+            updated = list(self.metadatas)
+            for chunk_id, metadata in zip(ids, metadatas):
+                if chunk_id in self._rows:
+                    updated[self._rows[chunk_id]] = metadata
+            self.metadatas = updated
+
+    def delete(self, ids: List[str]):
+        removed = set(ids)
+        with self._lock:
+            self._replace([chunk_id not in removed for chunk_id in self.ids])
+
+    def delete_document(self, document_id: str):
+        with self._lock:
+            self._replace([(m or {}).get("document_id") != document_id for m in self.metadatas])
+
+    def _replace(self, keep: List[bool], ids: List[str] = (), texts: List[str] = (),
+                 encoded: Optional[Dict[str, np.ndarray]] = None, metadatas: List[Dict] = ()):
+        mask = np.array(keep, dtype=bool)
+        if encoded is not None and not mask.any():
+            arrays = encoded
+        else:
+            arrays = {name: array[mask] for name, array in self.arrays.items()}
+            if encoded is not None:
+                arrays = {name: np.concatenate([array, encoded[name]]) for name, array in arrays.items()}
+        self.arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+        self.ids = [c for c, k in zip(self.ids, keep) if k] + list(ids)
+        self.documents = [d for d, k in zip(self.documents, keep) if k] + list(texts)
+        self.metadatas = [m for m, k in zip(self.metadatas, keep) if k] + list(metadatas)
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        if self._ivf is not None and self.exact_max < len(self.ids) <= 2 * self._ivf.trained_rows:
+            self._ivf = self._ivf.reassigned(self.arrays, self.codec, len(self.ids))
+        else:
+            self._ivf = None
+
+
+class WorkspaceIndexes:
+    """In-memory :class:`VectorIndex` per small workspace, backed by Chroma.
+
+    Chroma stays the store of record: an index is built from the workspace
+    collection on its first search (or loaded from its memory-mapped files
+    under ``path`` if they still match the collection's size and the
+    configured quantization), then kept in step by the same writes.
+    Workspaces with more than ``max_chunks`` chunks get no index, and
+    :meth:`get` returns None for them. Writes to a workspace whose index is
+    not loaded, or whose codec needs retraining, drop the saved files instead.
+
+    Building, loading, changing and saving hold only that workspace's lock,
+    so a cold workspace or an ingestion batch never holds up searches in
+    the others. A change removes the saved files and marks the index
+    unsaved; a background thread writes it back at most every
+    ``save_seconds``, and eviction and :meth:`close` write it straight away.
+    If the process dies first, the index is rebuilt from Chroma.
+    """
+
+    def __init__(self, collections, path: str = VECTOR_INDEX_PATH, max_chunks: int = VECTOR_INDEX_MAX_CHUNKS,
+                 exact_max: int = VECTOR_INDEX_EXACT_MAX, cache_size: int = VECTOR_INDEX_CACHE,
+                 enabled: bool = VECTOR_INDEX, quantization: str = VECTOR_INDEX_QUANTIZATION,
+                 rescore: int = VECTOR_INDEX_RESCORE, cache_bytes: int = VECTOR_INDEX_CACHE_MB * 1024 * 1024,
+                 save_seconds: float = VECTOR_INDEX_SAVE_SECONDS):
+        make_codec(quantization)   # fail at startup on a typo
+        self.collections = collections
+        self.path = path
+        self.max_chunks = max_chunks
+        self.exact_max = exact_max
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self.save_seconds = save_seconds
+        self.enabled = enabled
+        self.quantization = quantization
+        self.rescore = rescore
+        self._indexes: "OrderedDict[str, VectorIndex]" = OrderedDict()
+        # Indexes changed since they were last saved, loaded or evicted
+        self._unsaved: Dict[str, VectorIndex] = {}
+        self._too_large = set()
+        self._workspace_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.RLock()
+        self._saver: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self._stats = {engine: {"queries": 0, "ms": 0.0} for engine in ("exact", "ann", "chroma")}
+        if enabled:
+            os.makedirs(path, exist_ok=True)
+
+    def _prefix(self, workspace_id: str) -> str:
+        return os.path.join(self.path, workspace_id)
+
+    def _workspace_lock(self, workspace_id: str) -> threading.Lock:
+        with self._lock:
+            return self._workspace_locks.setdefault(workspace_id, threading.Lock())
+
+    def get(self, workspace_id: str, collection) -> Optional[VectorIndex]:
+        """The workspace's index, built or loaded on first use; None if it is served by Chroma"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            index = self._indexes.get(workspace_id)
+            if index is not None:
+                self._indexes.move_to_end(workspace_id)
+                return index
+            if workspace_id in self._too_large:
+                return None
+
+        # Only searches of this workspace wait for its build
+        with self._workspace_lock(workspace_id):
+            with self._lock:
+                index = self._indexes.get(workspace_id)
+                if index is not None:
+                    self._indexes.move_to_end(workspace_id)
+                    return index
+                if workspace_id in self._too_large:
+                    return None
+                # Evicted but not saved yet: still current
+                index = self._unsaved.get(workspace_id)
+
+            if index is None:
+                count = collection.count()
+                if count > self.max_chunks:
+                    with self._lock:
+                        self._too_large.add(workspace_id)
+                    return None
+                index = VectorIndex.load(self._prefix(workspace_id), make_codec(self.quantization),
+                                         self.exact_max, self.rescore)
+                if index is None or len(index) != count:
+                    index = self._build(workspace_id, collection)
+                index.fetch_vectors = self._full_vectors(collection)
+
+            with self._lock:
+                self._indexes[workspace_id] = index
+                evicted = self._evict()
+        for evicted_id in evicted:
+            self._save(evicted_id)
+        return index
+
+    def _evict(self) -> List[str]:
+        """Drop least recently used indexes over the entry or byte budget; returns those left to save"""
+        evicted = []
+        loaded = sum(index.nbytes for index in self._indexes.values())
+        while len(self._indexes) > 1 and (len(self._indexes) > self.cache_size or loaded > self.cache_bytes):
+            workspace_id, index = self._indexes.popitem(last=False)
+            loaded -= index.nbytes
+            if workspace_id in self._unsaved:
+                evicted.append(workspace_id)
+        return evicted
+
+    def _build(self, workspace_id: str, collection) -> VectorIndex:
+        ids, documents, metadatas, vectors = [], [], [], []
+        offset = 0
+        while True:
+            page = collection.get(include=["embeddings", "documents", "metadatas"],
+                                  limit=BUILD_PAGE_SIZE, offset=offset)
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            documents.extend(page["documents"])
+            metadatas.extend(m or {} for m in page["metadatas"])
+            vectors.extend(page["embeddings"])
+            offset += len(page["ids"])
+        index = VectorIndex.build(ids, documents, metadatas, np.asarray(vectors, dtype=np.float32),
+                                  make_codec(self.quantization), self.exact_max, self.rescore)
+        self._remove_files(workspace_id)
+        index.save(self._prefix(workspace_id))
+        return index
+
+    @staticmethod
+    def _full_vectors(collection) -> Callable[[List[str]], List[List[float]]]:
+        def fetch(ids: List[str]) -> List[List[float]]:
+            result = collection.get(ids=ids, include=["embeddings"])
+            by_id = dict(zip(result["ids"], result["embeddings"]))
+            return [by_id[chunk_id] for chunk_id in ids]
+        return fetch
+
+    def _remove_files(self, workspace_id: str):
+        prefix = self._prefix(workspace_id)
+        # The chunk list first, so a partly removed index never loads
+        for path in [f"{prefix}.json"] + glob.glob(glob.escape(prefix) + ".*"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _changed(self, workspace_id: str, change):
+        """Apply ``change`` to a loaded index and mark it unsaved, or forget the workspace's saved index"""
+        with self._workspace_lock(workspace_id):
+            with self._lock:
+                self._too_large.discard(workspace_id)
+                index = self._indexes.get(workspace_id)
+            if index is not None:
+                change(index)
+                if len(index) > self.max_chunks or index.codec.needs_retraining(len(index)):
+                    with self._lock:
+                        self._indexes.pop(workspace_id, None)
+                    index = None
+            with self._lock:
+                stale = self._unsaved.pop(workspace_id, None) is None
+                if index is not None:
+                    self._unsaved[workspace_id] = index
+            # The saved copy no longer matches; it is written again by the saver
+            if stale or index is None:
+                self._remove_files(workspace_id)
+        if index is not None:
+            self._start_saver()
+
+    def _save(self, workspace_id: str):
+        with self._workspace_lock(workspace_id):
+            with self._lock:
+                index = self._unsaved.pop(workspace_id, None)
+            if index is not None:
+                try:
+                    index.save(self._prefix(workspace_id))
+                except OSError as e:
+                    # Left without files: the next load rebuilds it from Chroma
+                    print(f"Vector index: saving {workspace_id} failed: {e}")
+                    self._remove_files(workspace_id)
+
+    def _start_saver(self):
+        if self._saver is not None or self._closed.is_set():
+            return
+        with self._lock:
+            if self._saver is None:
+                self._saver = threading.Thread(target=self._save_loop, name="vector-index-saver", daemon=True)
+                self._saver.start()
+
+    def _save_loop(self):
+        while not self._closed.wait(self.save_seconds):
+            self.flush()
+
+    def flush(self):
+        """Write every changed index to disk"""
+        with self._lock:
+            workspace_ids = list(self._unsaved)
+        for workspace_id in workspace_ids:
+            self._save(workspace_id)
+
+    def close(self):
+        """Stop the saver and write what is left"""
+        self._closed.set()
+        if self._saver is not None:
+            self._saver.join()
+        if self.enabled:
+            self.flush()
+
+    def upsert(self, workspace_id: str, ids: List[str], texts: List[str],
+               embeddings: List[List[float]], metadatas: List[Dict]):
+        self._changed(workspace_id, lambda index: index.upsert(ids, texts, embeddings, metadatas))
+
+    def update_metadata(self, workspace_id: str, ids: List[str], metadatas: List[Dict]):
+        self._changed(workspace_id, lambda index: index.update_metadata(ids, metadatas))
+
+    def delete(self, workspace_id: str, ids: List[str]):
+        self._changed(workspace_id, lambda index: index.delete(ids))
+
+    def delete_document(self, workspace_id: str, document_id: str):
+        self._changed(workspace_id, lambda index: index.delete_document(document_id))
+
+    def record(self, engine: str, seconds: float):
+        """Count a vector search served by ``engine`` ("exact", "ann" or "chroma")"""
+        with self._lock:
+            self._stats[engine]["queries"] += 1
+            self._stats[engine]["ms"] += seconds * 1000
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "quantization": self.quantization,
+                "loaded_indexes": len(self._indexes),
+                "unsaved_indexes": len(self._unsaved),
+                "indexed_chunks": sum(len(index) for index in self._indexes.values()),
+                "vector_bytes": sum(index.nbytes for index in self._indexes.values()),
+                "engines": {engine: {"queries": s["queries"],
+                                     "avg_ms": round(s["ms"] / s["queries"], 3) if s["queries"] else None}
+                            for engine, s in self._stats.items()}
+            }
@@ -0,0 +1,160 @@
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterator, Tuple
+
+import chromadb
+from chromadb.config import Settings
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "vector_db")
+# Persistence directories new workspaces are spread over; existing workspaces never move
+CHROMA_SHARDS = int(os.getenv("CHROMA_SHARDS", "1"))
+# Open collection handles kept per process (least recently used are dropped)
+CHROMA_HANDLE_CACHE = int(os.getenv("CHROMA_HANDLE_CACHE", "1024"))
+# Most recently active workspaces whose vector indexes are loaded at startup
+CHROMA_WARM_WORKSPACES = int(os.getenv("CHROMA_WARM_WORKSPACES", "50"))
+
+COLLECTION_PREFIX = "workspace_"
+
+
+def collection_name(workspace_id: str) -> str:
+    return f"{COLLECTION_PREFIX}{workspace_id}"
+
+
+def shard_path(shard: int, root: str = CHROMA_PATH) -> str:
+    """Shard 0 is the original store at ``root``; others live in ``root/shard_<n>``"""
+    return root if shard == 0 else os.path.join(root, f"shard_{shard}")
+
+
+class CollectionManager:
+    """Workspace collections across one or more Chroma persistence directories.
+
+    Each workspace's collection lives in exactly one shard. Where existing
+    collections are is read from every shard when the manager is first
+    used; a new workspace goes to the shard its ID hashes to, so raising
+    ``shards`` only spreads new workspaces and never strands old ones.
+    Collection handles are cached (LRU), so a search costs no lookup in
+    Chroma's catalog, and a workspace with no collection is answered from
+    the placement map without touching Chroma at all.
+
+    Only the API process writes vectors, so the cached placement and
+    handles stay authoritative.
+    """
+
+    def __init__(self, root: str = CHROMA_PATH, shards: int = CHROMA_SHARDS,
+                 cache_size: int = CHROMA_HANDLE_CACHE):
+        self.root = root
+        self.shards = max(1, shards)
+        self.cache_size = cache_size
+        self._clients: Dict[int, chromadb.PersistentClient] = {}
+        self._placement: Optional[Dict[str, int]] = None
+        self._handles: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def client(self, shard: int):
+        """PersistentClient for one shard, opened on first use"""
+        with self._lock:
+            if shard not in self._clients:
+                path = shard_path(shard, self.root)
+                os.makedirs(path, exist_ok=True)
+                self._clients[shard] = chromadb.PersistentClient(
+                    path=path,
+                    settings=Settings(anonymized_telemetry=False)
+                )
+            return self._clients[shard]
+
+    def _shard_dirs(self) -> List[int]:
+        # Shards configured now plus any left over from a larger CHROMA_SHARDS
+        shards = set(range(self.shards))
+        if os.path.isdir(self.root):
+            for entry in os.listdir(self.root):
+                if entry.startswith("shard_") and entry[6:].isdigit():
+                    shards.add(int(entry[6:]))
+        return sorted(shards)
+
+    def _load_placement(self) -> Dict[str, int]:
+        with self._lock:
+            if self._placement is None:
+                placement = {}
+                for shard in self._shard_dirs():
+                    for collection in self.client(shard).list_collections():
+                        if collection.name.startswith(COLLECTION_PREFIX):
+                            placement.setdefault(collection.name[len(COLLECTION_PREFIX):], shard)
+                self._placement = placement
+            return self._placement
+
+    def shard_for(self, workspace_id: str) -> int:
+        """Shard holding the workspace, or the one a new collection would be created in"""
+        placement = self._load_placement()
+        if workspace_id in placement:
+            return placement[workspace_id]
+        return zlib.crc32(workspace_id.encode("utf-8")) % self.shards
+
+    def _cache(self, workspace_id: str, collection):
+        self._handles[workspace_id] = collection
+        self._handles.move_to_end(workspace_id)
+        while len(self._handles) > self.cache_size:
+            self._handles.popitem(last=False)
+
+    def get(self, workspace_id: str):
+        """The workspace's collection, or None if nothing was ever indexed in it"""
+        with self._lock:
+            collection = self._handles.get(workspace_id)
+            if collection is not None:
+                self._handles.move_to_end(workspace_id)
+                return collection
+            placement = self._load_placement()
+            if workspace_id not in placement:
+                return None
+            collection = self.client(placement[workspace_id]).get_collection(name=collection_name(workspace_id))
+            self._cache(workspace_id, collection)
+            return collection
+
+    def get_or_create(self, workspace_id: str):
+        with self._lock:
+            collection = self.get(workspace_id)
+            if collection is None:
+                shard = self.shard_for(workspace_id)
+                collection = self.client(shard).get_or_create_collection(name=collection_name(workspace_id))
+                self._placement[workspace_id] = shard
+                self._cache(workspace_id, collection)
+            return collection
+
+    def workspaces(self) -> Iterator[Tuple[str, object]]:
+        """``(workspace_id, collection)`` for every workspace with a collection"""
+        for workspace_id in list(self._load_placement()):
+            collection = self.get(workspace_id)
+            if collection is not None:
+                yield workspace_id, collection
+
+    def warm(self, workspace_ids: List[str]) -> int:
+        """Open the collections and load their vector indexes; returns how many were warmed.
+
+        Chroma loads a collection's HNSW index on its first query, which
+        otherwise lands on the first chat in that workspace.
+        """
+        warmed = 0
+        for workspace_id in workspace_ids:
+            try:
+                collection = self.get(workspace_id)
+                if collection is None:
+                    continue
+                sample = collection.get(limit=1, include=["embeddings"])
+                if sample["ids"]:
+                    collection.query(query_embeddings=sample["embeddings"], n_results=1, include=[])
+                warmed += 1
+            except Exception as e:
+                print(f"Collection warmup failed for workspace {workspace_id}: {e}")
+        return warmed
+
+    def stats(self) -> Dict[str, object]:
+        placement = self._load_placement()
+        per_shard: Dict[int, int] = {}
+        for shard in placement.values():
+            per_shard[shard] = per_shard.get(shard, 0) + 1
+        return {
+            "shards": self.shards,
+            "collections_per_shard": per_shard,
+            "cached_handles": len(self._handles)
+        }
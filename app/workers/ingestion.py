@@ -0,0 +1,482 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import enum
+from typing import Optional, Dict, Any, Set, Tuple
+
+from utils.db_pool import ConnectionPool, DB_PATH
+from utils.embedding_cache import pack_vector, unpack_vector
+from utils.file_processor import process_document
+from models import DocumentStatus
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "600"))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "1.0"))
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", "30"))
+# How often the pool checks for worker processes that died and replaces them
+INGEST_SUPERVISE_INTERVAL = float(os.getenv("INGEST_SUPERVISE_INTERVAL", "2"))
+
+# Staged chunks read back per Chroma write
+STAGED_READ_BATCH = 256
+
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"          # waiting for a worker process
+    RUNNING = "running"        # worker is extracting / chunking / embedding
+    EMBEDDED = "embedded"      # chunks + vectors staged, waiting for the indexer
+    INDEXING = "indexing"      # indexer is writing to Chroma
+    DONE = "done"
+    FAILED = "failed"
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker claimed it; the old owner must stop working on it"""
+
+
+class JobQueue:
+    """SQLite-backed ingestion job queue.
+
+    Jobs are claimed under ``BEGIN IMMEDIATE`` with a lease; a job whose
+    lease expires (its worker crashed) is picked up again by the next claim,
+    unless it has already used up its attempts. Every later write for a job
+    checks in the same transaction that the claiming worker still holds it
+    (``locked_by``), and raises :class:`LeaseLost` otherwise.
+    """
+
+    def __init__(self, pool: ConnectionPool, max_attempts: int = INGEST_MAX_ATTEMPTS,
+                 lease_seconds: float = INGEST_LEASE_SECONDS):
+        self.pool = pool
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+
+    def enqueue(self, document_id: str, conn=None):
+        """Queue a document; pass ``conn`` to enqueue inside the caller's transaction"""
+        sql = "INSERT INTO ingestion_jobs (document_id, status, available_at) VALUES (?, ?, ?)"
+        params = (document_id, JobStatus.QUEUED.value, time.time())
+        if conn is not None:
+            conn.execute(sql, params)
+            return
+        with self.pool.connection() as conn:
+            conn.execute(sql, params)
+            conn.commit()
+
+    def claim(self, worker_id: str, ready: JobStatus, active: JobStatus) -> Optional[Dict[str, Any]]:
+        """Move the oldest ``ready`` job (or an ``active`` one with an expired lease) to ``active``"""
+        now = time.time()
+        # An attempt is one full pass, counted when a worker starts it
+        attempt = 1 if active is JobStatus.RUNNING else 0
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            while True:
+                row = conn.execute('''
+                    SELECT id, document_id, attempts, status FROM ingestion_jobs
+                    WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?)
+                    ORDER BY id LIMIT 1
+                ''', (ready.value, now, active.value, now)).fetchone()
+                if not row:
+                    # Keeps any jobs given up on below
+                    conn.commit()
+                    return None
+                if not (attempt and row[3] == active.value and row[2] >= self.max_attempts):
+                    break
+                # Its worker died on every attempt (crash, OOM kill): running it again would take the next one down
+                error = f"Worker stopped during ingestion on all {row[2]} attempts"
+                conn.execute(
+                    "UPDATE ingestion_jobs SET status = ?, locked_by = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                    (JobStatus.FAILED.value, error, now, row[0])
+                )
+                set_document_status(self.pool, row[1], DocumentStatus.FAILED, error=error, conn=conn)
+                print(f"Ingestion of {row[1]} failed (giving up): {error}")
+
+            conn.execute('''
+                UPDATE ingestion_jobs
+                SET status = ?, locked_by = ?, lease_expires = ?, attempts = attempts + ?, updated_at = ?
+                WHERE id = ?
+            ''', (active.value, worker_id, now + self.lease_seconds, attempt, now, row[0]))
+            conn.commit()
+
+        return {"id": row[0], "document_id": row[1], "attempts": row[2] + attempt, "worker": worker_id}
+
+    def _renew(self, conn, job: Dict[str, Any]):
+        """Extend the job's lease in ``conn``'s transaction; rolls back and raises if it was lost"""
+        cursor = conn.execute("UPDATE ingestion_jobs SET lease_expires = ? WHERE id = ? AND locked_by = ?",
+                              (time.time() + self.lease_seconds, job["id"], job["worker"]))
+        if cursor.rowcount != 1:
+            conn.rollback()
+            raise LeaseLost(f"Job {job['id']} is no longer held by {job['worker']}")
+
+    def _release(self, conn, job: Dict[str, Any], status: JobStatus, available_at: Optional[float] = None,
+                 error: Optional[str] = None):
+        """Move a held job to ``status`` and unlock it; rolls back and raises if the lease was lost"""
+        cursor = conn.execute('''
+            UPDATE ingestion_jobs
+            SET status = ?, locked_by = NULL, available_at = COALESCE(?, available_at),
+                last_error = COALESCE(?, last_error), updated_at = ?
+            WHERE id = ? AND locked_by = ?
+        ''', (status.value, available_at, error, time.time(), job["id"], job["worker"]))
+        if cursor.rowcount != 1:
+            conn.rollback()
+            raise LeaseLost(f"Job {job['id']} is no longer held by {job['worker']}")
+
+    def heartbeat(self, job: Dict[str, Any]):
+        with self.pool.connection() as conn:
+            self._renew(conn, job)
+            conn.commit()
+
+    def clear_staged(self, job: Dict[str, Any]):
+        with self.pool.connection() as conn:
+            self._renew(conn, job)
+            conn.execute("DELETE FROM ingestion_chunks WHERE document_id = ?", (job["document_id"],))
+            conn.commit()
+
+    def stage_batch(self, job: Dict[str, Any], first_index: int, chunks: list, embeddings: list,
+                    chunk_metadata: list):
+        """Store one batch of chunk vectors for the indexer (None: reuse the indexed vector)"""
+        document_id = job["document_id"]
+        with self.pool.connection() as conn:
+            self._renew(conn, job)
+            conn.executemany(
+                "INSERT OR REPLACE INTO ingestion_chunks (document_id, chunk_index, content, embedding, metadata) VALUES (?, ?, ?, ?, ?)",
+                [(document_id, first_index + i, chunk, pack_vector(vector) if vector is not None else b"",
+                  json.dumps(meta))
+                 for i, (chunk, vector, meta) in enumerate(zip(chunks, embeddings, chunk_metadata))]
+            )
+            conn.commit()
+
+    def finish_stage(self, job: Dict[str, Any], document_metadata: Optional[Dict[str, Any]] = None):
+        """Hand the job over to the indexer; ``document_metadata`` is merged into the document's"""
+        document_id = job["document_id"]
+        with self.pool.connection() as conn:
+            self._release(conn, job, JobStatus.EMBEDDED, available_at=time.time())
+            if document_metadata:
+                row = conn.execute("SELECT metadata FROM documents WHERE id = ?", (document_id,)).fetchone()
+                metadata = json.loads(row[0]) if row and row[0] else {}
+                metadata.update(document_metadata)
+                conn.execute("UPDATE documents SET metadata = ? WHERE id = ?", (json.dumps(metadata), document_id))
+            conn.commit()
+
+    def staged_batches(self, document_id: str, batch_size: int = STAGED_READ_BATCH):
+        """Yield ``(first_index, chunks, embeddings, chunk_metadata)`` staged for ``document_id``"""
+        last = -1
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute(
+                    "SELECT chunk_index, content, embedding, metadata FROM ingestion_chunks "
+                    "WHERE document_id = ? AND chunk_index > ? ORDER BY chunk_index LIMIT ?",
+                    (document_id, last, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield (rows[0][0], [r[1] for r in rows], [unpack_vector(r[2]) if r[2] else None for r in rows],
+                   [json.loads(r[3]) if r[3] else {} for r in rows])
+            last = rows[-1][0]
+
+    def known_hashes(self, document_id: str) -> Set[str]:
+        """Content hashes of the chunks currently indexed for a document"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT content_hash FROM document_chunks WHERE document_id = ?",
+                                (document_id,)).fetchall()
+        return {r[0] for r in rows}
+
+    def chunk_manifest(self, document_id: str) -> Dict[str, str]:
+        """``{chunk_id: metadata_hash}`` of the chunks currently indexed for a document"""
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT chunk_id, metadata_hash FROM document_chunks WHERE document_id = ?",
+                                (document_id,)).fetchall()
+        return dict(rows)
+
+    def complete(self, job: Dict[str, Any], manifest: Optional[Dict[str, Tuple[str, str]]] = None):
+        """Finish a job; ``manifest`` (``{chunk_id: (content_hash, metadata_hash)}``) replaces the document's"""
+        document_id = job["document_id"]
+        with self.pool.connection() as conn:
+            self._release(conn, job, JobStatus.DONE)
+            conn.execute("DELETE FROM ingestion_chunks WHERE document_id = ?", (document_id,))
+            if manifest is not None:
+                conn.execute("DELETE FROM document_chunks WHERE document_id = ?", (document_id,))
+                conn.executemany(
+                    "INSERT INTO document_chunks (document_id, chunk_id, content_hash, metadata_hash) VALUES (?, ?, ?, ?)",
+                    [(document_id, cid, content, meta) for cid, (content, meta) in manifest.items()]
+                )
+            conn.execute("UPDATE documents SET status = ? WHERE id = ?",
+                         (DocumentStatus.COMPLETED.value, document_id))
+            conn.commit()
+
+    def fail(self, job: Dict[str, Any], error: str, retry: bool = True) -> bool:
+        """Requeue with a growing delay, or give up; returns True if it will be retried"""
+        retry = retry and job["attempts"] < self.max_attempts
+        with self.pool.connection() as conn:
+            self._release(conn, job, JobStatus.QUEUED if retry else JobStatus.FAILED,
+                          available_at=time.time() + INGEST_RETRY_DELAY * job["attempts"], error=error[:1000])
+            set_document_status(self.pool, job["document_id"],
+                                DocumentStatus.PENDING if retry else DocumentStatus.FAILED,
+                                error=None if retry else error, conn=conn)
+            conn.commit()
+        return retry
+
+
+def set_document_status(pool: ConnectionPool, document_id: str, status: DocumentStatus,
+                        error: Optional[str] = None, conn=None):
+    """Pass ``conn`` to update inside the caller's transaction"""
+    if conn is None:
+        with pool.connection() as conn:
+            set_document_status(pool, document_id, status, error, conn=conn)
+            conn.commit()
+        return
+    if error is None:
+        conn.execute("UPDATE documents SET status = ? WHERE id = ?", (status.value, document_id))
+    else:
+        row = conn.execute("SELECT metadata FROM documents WHERE id = ?", (document_id,)).fetchone()
+        metadata = json.loads(row[0]) if row and row[0] else {}
+        metadata["error"] = error[:1000]
+        conn.execute("UPDATE documents SET status = ?, metadata = ? WHERE id = ?",
+                     (status.value, json.dumps(metadata), document_id))
+
+
+def chunk_id(document_id: str, content_hash: str) -> str:
+    """Vector ID of a chunk: the same text keeps its ID across versions of a document"""
+    return f"{document_id}_{content_hash[:16]}"
+
+
+def metadata_hash(metadata: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+
+
+def get_document(pool: ConnectionPool, document_id: str) -> Optional[Dict[str, Any]]:
+    with pool.connection() as conn:
+        row = conn.execute(
+            "SELECT id, filename, file_path, user_id, workspace_id FROM documents WHERE id = ?",
+            (document_id,)
+        ).fetchone()
+    if not row:
+        return None
+    return {"id": row[0], "filename": row[1], "file_path": row[2], "user_id": row[3], "workspace_id": row[4]}
+
+
+def ingest(queue: JobQueue, pool: ConnectionPool, rag, job: Dict[str, Any]):
+    """Extract, chunk and embed one claimed job's document and stage it for the indexer"""
+    document = get_document(pool, job["document_id"])
+    if not document:
+        queue.fail(job, "Document not found", retry=False)
+        return
+
+    def on_status(status: DocumentStatus):
+        # Renewing first: a worker that lost the job stops before touching the document
+        queue.heartbeat(job)
+        set_document_status(pool, document["id"], status)
+
+    def on_batch(first_index, chunks, embeddings, chunk_metadata):
+        queue.stage_batch(job, first_index, chunks, embeddings, chunk_metadata)
+
+    queue.clear_staged(job)
+    # Chunks already indexed from an earlier version are not embedded again
+    result = process_document(document["id"], document["file_path"], rag, on_batch, on_status,
+                              known_hashes=queue.known_hashes(document["id"]))
+    queue.finish_stage(job, {"pages": len(result["page_offsets"]), "page_offsets": result["page_offsets"]})
+
+
+def run_worker(worker_id: str, db_path: str = DB_PATH, stop_event=None):
+    """Worker process loop: extract -> chunk -> embed, then stage for indexing"""
+    from utils.rag import RAGSystem
+
+    pool = ConnectionPool(db_path, size=2)
+    queue = JobQueue(pool)
+    rag = RAGSystem()
+    parent = os.getppid()
+    print(f"Ingestion worker {worker_id} started")
+
+    # Workers are not daemonic (they run PDF extraction pools), so they
+    # also stop on their own if the process that started them goes away
+    while (stop_event is None or not stop_event.is_set()) and os.getppid() == parent:
+        job = queue.claim(worker_id, JobStatus.QUEUED, JobStatus.RUNNING)
+        if not job:
+            if stop_event is not None:
+                stop_event.wait(INGEST_POLL_INTERVAL)
+            else:
+                time.sleep(INGEST_POLL_INTERVAL)
+            continue
+
+        try:
+            ingest(queue, pool, rag, job)
+        except LeaseLost as e:
+            # Reclaimed after the lease expired: the new owner runs it from the start
+            print(f"Ingestion of {job['document_id']} abandoned: {e}")
+        except Exception as e:
+            try:
+                retried = queue.fail(job, f"{type(e).__name__}: {e}")
+            except LeaseLost as lost:
+                print(f"Ingestion of {job['document_id']} abandoned: {lost}")
+                continue
+            print(f"Ingestion of {job['document_id']} failed ({'will retry' if retried else 'giving up'}): {e}")
+
+    pool.close()
+
+
+class IngestionIndexer(threading.Thread):
+    """Writes staged chunks into Chroma from the API process.
+
+    Chroma's PersistentClient is not safe to share between processes, so all
+    vector writes go through this single thread next to the readers.
+    """
+
+    def __init__(self, pool: ConnectionPool, rag, poll_interval: float = INGEST_POLL_INTERVAL):
+        super().__init__(name="ingestion-indexer", daemon=True)
+        self.pool = pool
+        self.queue = JobQueue(pool)
+        self.rag = rag
+        self.poll_interval = poll_interval
+        # Unique per API process, so a lease is only ever honoured for the indexer that took it
+        self.worker_id = f"{self.name}-{os.getpid()}"
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            self.rag.backfill_lexical_index()
+        except Exception as e:
+            print(f"Keyword index backfill failed: {e}")
+
+        while not self._stop_event.is_set():
+            job = self.queue.claim(self.worker_id, JobStatus.EMBEDDED, JobStatus.INDEXING)
+            if not job:
+                self._stop_event.wait(self.poll_interval)
+                continue
+            try:
+                self.index(job)
+            except LeaseLost as e:
+                print(f"Indexing of {job['document_id']} abandoned: {e}")
+            except Exception as e:
+                try:
+                    self.queue.fail(job, f"{type(e).__name__}: {e}")
+                except LeaseLost as lost:
+                    print(f"Indexing of {job['document_id']} abandoned: {lost}")
+                    continue
+                print(f"Indexing of {job['document_id']} failed: {e}")
+
+    def index(self, job: Dict[str, Any]):
+        """Bring the document's vectors in line with its staged chunks.
+
+        Chunk IDs come from the chunk text, so against the previous version
+        only new text is written with its vector, chunks that merely moved
+        get a metadata update, and chunks that are gone are deleted.
+        """
+        document = get_document(self.pool, job["document_id"])
+        if not document:
+            self.queue.fail(job, "Document not found", retry=False)
+            return
+
+        document_id, workspace_id = document["id"], document["workspace_id"]
+        metadata = {"filename": document["filename"], "user_id": document["user_id"]}
+        previous = self.queue.chunk_manifest(document_id)
+        manifest = {}
+
+        for first_index, chunks, embeddings, chunk_metadata in self.queue.staged_batches(document_id):
+            new, moved = [], []
+            for i, (text, vector, meta) in enumerate(zip(chunks, embeddings, chunk_metadata)):
+                cid = chunk_id(document_id, meta["content_hash"])
+                if cid in manifest:
+                    continue   # the same text repeated within a document is stored once
+                full = {**metadata, **meta, "chunk_index": first_index + i, "document_id": document_id}
+                manifest[cid] = (meta["content_hash"], metadata_hash(full))
+                if vector is not None or cid not in previous:
+                    new.append((cid, text, vector, full))
+                elif previous[cid] != manifest[cid][1]:
+                    moved.append((cid, full))
+
+            if new:
+                vectors = [n[2] for n in new]
+                if any(v is None for v in vectors):
+                    # Only if the previous version changed under the worker; served by the embedding cache
+                    vectors = self.rag.embed_texts([n[1] for n in new])
+                self.rag.upsert_chunks(workspace_id, [n[0] for n in new], [n[1] for n in new],
+                                       vectors, [n[3] for n in new])
+            if moved:
+                self.rag.update_chunk_metadata(workspace_id, [m[0] for m in moved], [m[1] for m in moved])
+            self.queue.heartbeat(job)
+
+        # Documents indexed before manifests were kept have no previous entries
+        stored = previous.keys() if previous else self.rag.document_chunk_ids(workspace_id, document_id)
+        self.rag.delete_chunks(workspace_id, [cid for cid in stored if cid not in manifest])
+
+        if get_document(self.pool, document_id) is None:
+            # Deleted while it was being indexed
+            self.rag.delete_document(document_id, workspace_id)
+            return
+        self.queue.complete(job, manifest)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class IngestionWorkerPool:
+    """A fixed number of worker processes draining the ingestion queue.
+
+    A supervisor thread respawns workers that exit (crashed, OOM-killed)
+    until :meth:`stop` is called.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, db_path: str = DB_PATH,
+                 supervise_interval: float = INGEST_SUPERVISE_INTERVAL):
+        self.workers = workers
+        self.db_path = db_path
+        self.supervise_interval = supervise_interval
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        self._stop_event = self._context.Event()
+        self._processes = []
+        self._supervisor: Optional[threading.Thread] = None
+        self._restarts = 0
+
+    def _spawn(self, i: int):
+        process = self._context.Process(
+            target=run_worker,
+            args=(f"worker-{os.getpid()}-{i}", self.db_path, self._stop_event),
+            name=f"ingestion-worker-{i}"
+        )
+        process.start()
+        return process
+
+    def start(self):
+        if self.workers <= 0:
+            return
+        self._processes = [self._spawn(i) for i in range(self.workers)]
+        self._supervisor = threading.Thread(target=self._supervise, name="ingestion-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _supervise(self):
+        while not self._stop_event.wait(self.supervise_interval):
+            for i, process in enumerate(self._processes):
+                if process.is_alive() or self._stop_event.is_set():
+                    continue
+                process.join()
+                self._restarts += 1
+                print(f"Ingestion worker {process.name} exited with code {process.exitcode}; restarting")
+                self._processes[i] = self._spawn(i)
+
+    def join(self):
+        """Block until the pool is stopped"""
+        if self._supervisor is not None:
+            self._supervisor.join()
+
+    def stop(self, timeout: float = 10):
+        self._stop_event.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+            self._supervisor = None
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+
+if __name__ == "__main__":
+    # Run workers on their own (e.g. a separate container with INGEST_WORKERS=0 on the API)
+    workers = IngestionWorkerPool()
+    workers.start()
+    try:
+        workers.join()
+    except KeyboardInterrupt:
+        workers.stop()
@@ -2,15 +2,21 @@ import time
 from typing import Dict, Any
 import json
 
+from utils.db_pool import ConnectionPool
+from workers.ingestion import JobQueue
+
 class TaskProcessor:
     """Simple background task processor"""
     
-    @staticmethod
-    def process_document(document_data: Dict[str, Any]):
-        """Process document in background"""
-        print(f"Processing document: {document_data.get('filename')}")
-        time.sleep(2)  # Simulate processing
-        print(f"Document processed: {document_data.get('filename')}")
+    _queue = None
+    
+    @classmethod
+    def process_document(cls, document_data: Dict[str, Any]):
+        """Queue document for the ingestion workers"""
+        if cls._queue is None:
+            cls._queue = JobQueue(ConnectionPool(size=2))
+        cls._queue.enqueue(document_data["id"])
+        print(f"Queued document for processing: {document_data.get('filename')}")
         return True
     
     @staticmethod
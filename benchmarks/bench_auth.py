@@ -0,0 +1,80 @@
+"""Microbenchmark of the auth dependency at growing user counts.
+
+Compares the legacy ``users.password_hash`` scan with the indexed session
+lookup (cold, every call hits SQLite) and the warm principal cache.
+
+    python benchmarks/bench_auth.py --users 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.db_pool import ConnectionPool
+from utils.sessions import SessionStore, PrincipalCache, hash_token
+
+
+def setup(pool: ConnectionPool, users: int, sessions: int) -> list:
+    with pool.connection() as conn:
+        conn.execute('''CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT,
+                        email TEXT, password_hash TEXT, role TEXT, workspace_id TEXT,
+                        is_active BOOLEAN DEFAULT TRUE)''')
+        conn.execute('''CREATE TABLE sessions (token_hash TEXT PRIMARY KEY, user_id INTEGER NOT NULL,
+                        created_at REAL NOT NULL, expires_at REAL NOT NULL)''')
+        conn.executemany(
+            "INSERT INTO users (username, email, password_hash, role, workspace_id) VALUES (?, ?, ?, 'user', 'ws')",
+            ((f"user{i}", f"user{i}@example.com", hash_token(f"pw{i}")) for i in range(users))
+        )
+        tokens = [f"token-{i}" for i in range(sessions)]
+        expires = time.time() + 3600
+        conn.executemany(
+            "INSERT INTO sessions (token_hash, user_id, created_at, expires_at) VALUES (?, ?, 0, ?)",
+            ((hash_token(t), random.randint(1, users), expires) for t in tokens)
+        )
+        conn.commit()
+    return tokens
+
+
+def timed(label: str, fn, keys: list):
+    start = time.perf_counter()
+    for key in keys:
+        fn(key)
+    per_call = (time.perf_counter() - start) / len(keys) * 1e6
+    print(f"  {label:<26} {per_call:>12.1f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    for users in args.users:
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = ConnectionPool(os.path.join(tmp, "auth.db"), size=1)
+            tokens = setup(pool, users, min(users, 10_000))
+            keys = [random.choice(tokens) for _ in range(args.lookups)]
+            legacy_keys = [hash_token(f"pw{random.randrange(users)}") for _ in range(max(20, args.lookups // 100))]
+            print(f"{users:,} users")
+
+            def legacy(token):
+                with pool.connection() as conn:
+                    conn.execute("SELECT * FROM users WHERE password_hash = ?", (token,)).fetchone()
+
+            cold = SessionStore(pool, cache=PrincipalCache(ttl=0))
+            warm = SessionStore(pool)
+            for key in keys:
+                warm.resolve(key)
+
+            timed("legacy password_hash scan", legacy, legacy_keys)
+            timed("session index (cold)", cold.resolve, keys)
+            timed("session cache (warm)", warm.resolve, keys)
+            pool.close()
+
+
+if __name__ == "__main__":
+    main()
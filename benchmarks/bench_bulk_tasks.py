@@ -0,0 +1,150 @@
+"""Importing a task backlog: one POST /tasks per task vs the bulk endpoints.
+
+All three paths write through the pooled connection into a database with
+the usage-counter triggers installed, like the app's:
+
+- per task: borrow a connection, insert, commit, re-select by id (``POST /tasks``)
+- bulk: ``insert_tasks`` in chunks of ``TASK_BULK_MAX``, one transaction each (``POST /tasks/bulk``)
+- NDJSON: the body streamed through ``iter_ndjson_batches`` in 64 KiB chunks,
+  decoded and inserted per batch (``POST /tasks/import``; request validation
+  is plain ``json.loads`` here, as pydantic is not needed to time the database)
+
+Then bulk status updates and deletes of every imported task.
+
+    python benchmarks/bench_bulk_tasks.py --tasks 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils import usage
+from utils.bulk_tasks import TASK_BULK_MAX, insert_tasks, update_tasks, delete_tasks, iter_ndjson_batches
+from utils.db_pool import ConnectionPool
+
+SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, workspace_id TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE chats (id TEXT PRIMARY KEY, user_id INTEGER, message TEXT, response TEXT, tools_called TEXT, metadata TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    '''CREATE TABLE tasks (id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT, due_date TIMESTAMP,
+       priority TEXT DEFAULT 'medium', status TEXT DEFAULT 'todo', linked_documents TEXT, user_id INTEGER,
+       created_by_ai BOOLEAN DEFAULT FALSE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    "CREATE INDEX idx_tasks_user_created ON tasks(user_id, created_at, id)",
+    "CREATE INDEX idx_tasks_user_status_priority ON tasks(user_id, status, priority, created_at, id)",
+]
+
+
+def make_pool(path):
+    pool = ConnectionPool(path, size=4)
+    with pool.connection() as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.execute("INSERT INTO users (username, workspace_id) VALUES ('importer', ?)", (str(uuid.uuid4()),))
+        usage.install(conn.cursor())
+        conn.commit()
+    return pool
+
+
+def backlog(count):
+    return [{"title": f"Imported task {i}", "description": f"From the old tracker, item {i}",
+             "due_date": "2026-12-31", "priority": ("low", "medium", "high")[i % 3],
+             "linked_documents": []} for i in range(count)]
+
+
+def per_task(pool, tasks):
+    for task in tasks:
+        task_id = str(uuid.uuid4())
+        with pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO tasks (id, title, description, due_date, priority, linked_documents, user_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (task_id, task["title"], task["description"], task["due_date"], task["priority"],
+                  json.dumps(task["linked_documents"]), 1))
+            conn.commit()
+            conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+
+
+def bulk(pool, tasks):
+    ids = []
+    for start in range(0, len(tasks), TASK_BULK_MAX):
+        with pool.connection() as conn:
+            ids += [row["id"] for row in insert_tasks(conn, 1, tasks[start:start + TASK_BULK_MAX])]
+            conn.commit()
+    return ids
+
+
+async def body_chunks(body, size=64 * 1024):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def ndjson(pool, body):
+    imported = 0
+    async for lines in iter_ndjson_batches(body_chunks(body)):
+        tasks = [json.loads(line) for _, line in lines]
+        with pool.connection() as conn:
+            insert_tasks(conn, 1, tasks)
+            conn.commit()
+        imported += len(tasks)
+    return imported
+
+
+def report(label, count, seconds):
+    print(f"{label:<34} {seconds:>8.2f} s  {count / seconds:>10,.0f} tasks/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--per-task", type=int, default=5000, help="tasks timed through the one-by-one path")
+    args = parser.parse_args()
+
+    tasks = backlog(args.tasks)
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{args.tasks:,} tasks\n")
+
+        pool = make_pool(os.path.join(tmp, "per_task.db"))
+        start = time.perf_counter()
+        per_task(pool, tasks[:args.per_task])
+        elapsed = (time.perf_counter() - start) * args.tasks / args.per_task
+        report(f"POST /tasks x N (from {args.per_task:,})", args.tasks, elapsed)
+        pool.close()
+
+        pool = make_pool(os.path.join(tmp, "bulk.db"))
+        start = time.perf_counter()
+        ids = bulk(pool, tasks)
+        report("POST /tasks/bulk", args.tasks, time.perf_counter() - start)
+
+        updates = [{"id": task_id, "status": "done", "priority": None} for task_id in ids]
+        start = time.perf_counter()
+        for offset in range(0, len(updates), TASK_BULK_MAX):
+            with pool.connection() as conn:
+                update_tasks(conn, 1, updates[offset:offset + TASK_BULK_MAX])
+                conn.commit()
+        report("PATCH /tasks/bulk (status)", args.tasks, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for offset in range(0, len(ids), TASK_BULK_MAX):
+            with pool.connection() as conn:
+                delete_tasks(conn, 1, ids[offset:offset + TASK_BULK_MAX])
+                conn.commit()
+        report("POST /tasks/bulk/delete", args.tasks, time.perf_counter() - start)
+        pool.close()
+
+        pool = make_pool(os.path.join(tmp, "ndjson.db"))
+        body = "\n".join(json.dumps(task) for task in tasks).encode()
+        start = time.perf_counter()
+        imported = asyncio.run(ndjson(pool, body))
+        report(f"POST /tasks/import ({len(body) / 1e6:.0f} MB)", imported, time.perf_counter() - start)
+        with pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] == args.tasks
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Chunking throughput and peak memory on a large generated text file.
+
+Writes a markdown-ish file of ``--mb`` megabytes (headings, paragraphs,
+sentences of varying length), then streams it through the token-aware
+chunker block by block and reports MB/s, chunks and peak traced memory.
+The old approach (read the whole file, split on whitespace, 1000-word
+windows) is measured on a ``--legacy-mb`` slice for comparison, since its
+memory grows with the file.
+
+    python benchmarks/bench_chunker.py --mb 100 --legacy-mb 20
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.chunker import Chunker, iter_text_file
+
+WORDS = ("revenue forecast quarterly budget launch milestone review contract vendor "
+         "compliance roadmap customer retention hiring infrastructure migration the a "
+         "of to and for with on").split()
+
+
+def write_text(path: str, megabytes: float):
+    rng = random.Random(7)
+    target = int(megabytes * 1e6)
+    written, section = 0, 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target:
+            section += 1
+            parts = [f"## Section {section}\n\n"]
+            for _ in range(rng.randint(3, 8)):
+                sentences = []
+                for _ in range(rng.randint(2, 9)):
+                    words = [rng.choice(WORDS) for _ in range(rng.randint(4, 30))]
+                    sentences.append(" ".join(words).capitalize() + rng.choice(".!?."))
+                parts.append(" ".join(sentences) + "\n\n")
+            block = "".join(parts)
+            f.write(block)
+            written += len(block)
+
+
+def legacy_chunks(path: str, limit: int) -> int:
+    # The previous implementation: whole file in memory, fixed word windows
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read(limit)
+    words = text.split()
+    chunks = []
+    for i in range(0, len(words), 1000 - 200):
+        chunks.append(" ".join(words[i:i + 1000]))
+    return len(chunks)
+
+
+def measure(fn):
+    """Result and wall time of an untraced run, then peak memory of a traced one"""
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def streamed_chunks(path: str) -> int:
+    return sum(1 for _ in Chunker().chunks(iter_text_file(path)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, default=100)
+    parser.add_argument("--legacy-mb", type=float, default=20)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "large.md")
+    write_text(path, args.mb)
+    size = os.path.getsize(path) / 1e6
+    print(f"input: {size:.1f} MB")
+
+    legacy_bytes = int(args.legacy_mb * 1e6)
+    chunks, elapsed, peak = measure(lambda: legacy_chunks(path, legacy_bytes))
+    print(f"legacy word windows ({args.legacy_mb:g} MB)  {args.legacy_mb / elapsed:7.1f} MB/s  "
+          f"{chunks:8d} chunks  peak {peak / 1e6:8.1f} MB")
+
+    chunks, elapsed, peak = measure(lambda: streamed_chunks(path))
+    print(f"streaming chunker ({size:.0f} MB)     {size / elapsed:7.1f} MB/s  "
+          f"{chunks:8d} chunks  peak {peak / 1e6:8.1f} MB")
+
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
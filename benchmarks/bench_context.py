@@ -0,0 +1,142 @@
+"""Prompt size and answer coverage: ``context[:2000]`` vs token-budget packing.
+
+Each case is a generated document with one fact sentence ("The access code
+for vault 17 is 4821.") hidden at a random place, chunked by the real
+Chunker. Retrieval is simulated: the chunk holding the fact is placed at a
+rank drawn from a skewed distribution (usually first, sometimes lower),
+the other ranks are filled with its neighbours and chunks of an unrelated
+document. Every strategy then builds the full prompt and reports:
+
+- context / prompt tokens (estimated) and how often the fact made it in
+- how often the context ends mid-sentence
+
+With ``--ollama`` the prompts of the first ``--ollama-cases`` cases are
+sent to a running Ollama and the measured ``prompt_eval_count`` and answer
+latency are reported too (prefill time grows with prompt tokens).
+
+    python benchmarks/bench_context.py --cases 300
+    python benchmarks/bench_context.py --ollama http://localhost:11434 --model mistral
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.chunker import Chunker, estimate_tokens
+from utils.context_packer import pack_context, context_budget, context_window
+
+WORDS = ("system service request data policy team report budget review update process account access "
+         "document meeting project schedule network storage client server release change audit").split()
+# Probability of the fact's chunk being retrieved at rank 1, 2, 3, 4 ...
+RANK_WEIGHTS = [0.55, 0.2, 0.1, 0.05, 0.04, 0.03, 0.02, 0.01]
+CANDIDATES = len(RANK_WEIGHTS)
+NUM_PREDICT = 64
+
+
+def sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def document(rng: random.Random, paragraphs: int, fact: str = None) -> str:
+    text = [" ".join(sentence(rng) for _ in range(rng.randint(3, 8))) for _ in range(paragraphs)]
+    if fact:
+        paragraph = rng.randrange(paragraphs)
+        sentences = text[paragraph].split(". ")
+        sentences.insert(rng.randint(0, len(sentences)), fact.rstrip("."))
+        text[paragraph] = ". ".join(sentences).rstrip(".") + "."
+    return "\n\n".join(text)
+
+
+def chunks_of(document_id: str, text: str):
+    chunks = []
+    for index, chunk in enumerate(Chunker().chunks([text])):
+        meta = {"document_id": document_id, "filename": f"{document_id}.txt", "chunk_index": index,
+                "char_start": chunk["char_start"], "char_end": chunk["char_end"]}
+        chunks.append({"id": f"{document_id}_{index}", "text": chunk["text"], "metadata": meta})
+    return chunks
+
+
+def build_cases(count: int, rng: random.Random):
+    cases = []
+    for i in range(count):
+        fact = f"The access code for vault {i} is {rng.randint(1000, 9999)}."
+        relevant = chunks_of(f"doc{i}", document(rng, 30, fact))
+        other = chunks_of(f"other{i}", document(rng, 30))
+        hit = next(c for c in relevant if fact in c["text"])
+        neighbours = [c for c in relevant if c is not hit and abs(c["metadata"]["chunk_index"]
+                                                                   - hit["metadata"]["chunk_index"]) <= 2]
+        fillers = neighbours + rng.sample(other, min(len(other), CANDIDATES))
+        rng.shuffle(fillers)
+        ranked = fillers[:CANDIDATES - 1]
+        ranked.insert(rng.choices(range(CANDIDATES), RANK_WEIGHTS)[0], hit)
+        cases.append((f"What is the access code for vault {i}?", fact, ranked))
+    return cases
+
+
+def legacy_context(query, ranked):
+    # Previous behaviour: top 3 chunks joined, then the first 2000 characters
+    return "\n".join(c["text"] for c in ranked[:3])[:2000]
+
+
+def run_ollama(url: str, model: str, prompt: str):
+    start = time.perf_counter()
+    data = requests.post(f"{url}/api/generate", json={
+        "model": model, "prompt": prompt, "stream": False,
+        "options": {"temperature": 0, "num_predict": NUM_PREDICT, "num_ctx": context_window(model)}
+    }, timeout=300).json()
+    return data.get("prompt_eval_count"), (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--model", default=os.getenv("OLLAMA_MODEL", "mistral"))
+    parser.add_argument("--ollama", help="Ollama URL; measure real prompt tokens and latency")
+    parser.add_argument("--ollama-cases", type=int, default=20)
+    args = parser.parse_args()
+
+    from utils.rag import RAGSystem, GENERATE_OPTIONS
+    prompt = RAGSystem._prompt
+    cases = build_cases(args.cases, random.Random(args.seed))
+    budget = context_budget(args.model, estimate_tokens(prompt(cases[0][0], "")) + GENERATE_OPTIONS["num_predict"])
+
+    strategies = [("context[:2000]", legacy_context)]
+    for tokens in sorted({300, 600, budget}):
+        strategies.append((f"packed {tokens}", lambda q, ranked, t=tokens: pack_context(ranked, t)["text"]))
+
+    print(f"{args.cases} cases, {CANDIDATES} candidates each, default budget {budget} tokens ({args.model})\n")
+    header = f"{'':<16} {'context tok':>11} {'prompt tok':>10} {'fact found':>10} {'cut mid-sentence':>16}"
+    if args.ollama:
+        header += f" {'ollama prompt tok':>17} {'latency p50 ms':>14}"
+    print(header)
+
+    for name, build in strategies:
+        context_tokens, prompt_tokens, found, cut, latency, evaluated = [], [], 0, 0, [], []
+        for i, (query, fact, ranked) in enumerate(cases):
+            context = build(query, ranked)
+            context_tokens.append(estimate_tokens(context))
+            prompt_tokens.append(estimate_tokens(prompt(query, context)))
+            found += fact in context
+            cut += not context.rstrip().endswith((".", "!", "?"))
+            if args.ollama and i < args.ollama_cases:
+                count, ms = run_ollama(args.ollama, args.model, prompt(query, context))
+                evaluated.append(count or 0)
+                latency.append(ms)
+
+        row = (f"{name:<16} {statistics.median(context_tokens):>11.0f} {statistics.median(prompt_tokens):>10.0f} "
+               f"{found / len(cases):>10.1%} {cut / len(cases):>16.1%}")
+        if args.ollama:
+            row += f" {statistics.median(evaluated):>17.0f} {statistics.median(latency):>14.0f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Load benchmark: per-request sqlite3.connect vs the pooled WAL connection layer.
+
+Each simulated request does the database work of an authenticated ``/chat``
+call (token lookup, chat insert + commit, occasional task insert + commit).
+
+    python benchmarks/bench_db_pool.py --clients 50 --requests 4000
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.db_pool import ConnectionPool
+
+SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, password_hash TEXT, role TEXT, workspace_id TEXT)",
+    "CREATE TABLE chats (id TEXT PRIMARY KEY, user_id INTEGER, message TEXT, response TEXT)",
+    "CREATE TABLE tasks (id TEXT PRIMARY KEY, title TEXT, user_id INTEGER, created_by_ai BOOLEAN)",
+]
+
+
+def setup(db_path: str, users: int) -> list:
+    conn = sqlite3.connect(db_path)
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    tokens = [hashlib.sha256(f"user{i}".encode()).hexdigest() for i in range(users)]
+    conn.executemany(
+        "INSERT INTO users (username, password_hash, role, workspace_id) VALUES (?, ?, 'user', ?)",
+        [(f"user{i}", t, str(uuid.uuid4())) for i, t in enumerate(tokens)],
+    )
+    conn.commit()
+    conn.close()
+    return tokens
+
+
+def chat_work(conn: sqlite3.Connection, token: str, n: int):
+    user = conn.execute("SELECT * FROM users WHERE password_hash = ?", (token,)).fetchone()
+    conn.execute("INSERT INTO chats (id, user_id, message, response) VALUES (?, ?, ?, ?)",
+                 (str(uuid.uuid4()), user[0], "hello", "hi"))
+    conn.commit()
+    if n % 5 == 0:
+        conn.execute("INSERT INTO tasks (id, title, user_id, created_by_ai) VALUES (?, ?, ?, 1)",
+                     (str(uuid.uuid4()), "Task", user[0]))
+        conn.commit()
+
+
+def run(label: str, handler, tokens: list, clients: int, requests: int):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(lambda n: handler(tokens[n % len(tokens)], n), range(requests)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {requests / elapsed:>10.0f} req/s   ({elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before_db = os.path.join(tmp, "before.db")
+        tokens = setup(before_db, args.users)
+
+        def per_request(token, n):
+            conn = sqlite3.connect(before_db, timeout=30)
+            try:
+                chat_work(conn, token, n)
+            finally:
+                conn.close()
+
+        after_db = os.path.join(tmp, "after.db")
+        setup(after_db, args.users)
+        db_pool = ConnectionPool(after_db)
+
+        def pooled(token, n):
+            with db_pool.connection() as conn:
+                chat_work(conn, token, n)
+
+        print(f"{args.clients} concurrent clients, {args.requests} requests, {args.users} users")
+        run("before: connect per request", per_request, tokens, args.clients, args.requests)
+        run("after:  pooled + WAL", pooled, tokens, args.clients, args.requests)
+        db_pool.close()
+
+
+if __name__ == "__main__":
+    main()
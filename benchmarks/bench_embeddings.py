@@ -0,0 +1,110 @@
+"""Embedding throughput against a local stub Ollama server.
+
+The stub answers ``/api/embed`` (batch) and ``/api/embeddings`` (single) with
+a fixed per-request latency plus a small per-text cost, which is roughly how
+a local model server behaves. Reports chunks/sec per batch size and concurrency,
+then compares the embedding backends (the in-process ``onnx`` backend only
+if ``onnxruntime``/``tokenizers`` are installed and ``--onnx-path`` holds a model).
+
+    python benchmarks/bench_embeddings.py --chunks 2000 --latency-ms 20
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.embeddings import BatchEmbedder, HashingEmbedder, OnnxEmbedder
+from utils.ollama_client import OllamaClient
+
+DIM = 384
+
+
+def make_handler(latency: float, per_text: float):
+    class StubOllama(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path == "/api/embed":
+                texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+                time.sleep(latency + per_text * len(texts))
+                body = {"embeddings": [[0.01] * DIM for _ in texts]}
+            else:
+                time.sleep(latency + per_text)
+                body = {"embedding": [0.01] * DIM}
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return StubOllama
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--per-text-ms", type=float, default=0.5)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--onnx-path", default="models/embedding")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.latency_ms / 1000, args.per_text_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    texts = [f"chunk {i} " + "lorem ipsum " * 40 for i in range(args.chunks)]
+    client = OllamaClient(url)
+
+    # Baseline: the old one-request-per-chunk loop, on a sample
+    sample = texts[:200]
+    embedder = BatchEmbedder(client, "stub", batch_size=1, concurrency=1)
+    embedder._batch_supported = False
+    start = time.perf_counter()
+    embedder.embed(sample)
+    print(f"serial /api/embeddings baseline: {len(sample) / (time.perf_counter() - start):8.0f} chunks/s")
+    embedder.close()
+
+    print(f"{'batch':>6} " + " ".join(f"{'conc=' + str(c):>10}" for c in args.concurrency))
+    for batch_size in args.batch_sizes:
+        row = []
+        for concurrency in args.concurrency:
+            embedder = BatchEmbedder(client, "stub", batch_size=batch_size, concurrency=concurrency)
+            start = time.perf_counter()
+            embedder.embed(texts)
+            row.append(args.chunks / (time.perf_counter() - start))
+            embedder.close()
+        print(f"{batch_size:>6} " + " ".join(f"{r:>10.0f}" for r in row))
+
+    print(f"\n{'backend':<16} {'chunks/s':>10} {'dims':>6}")
+    backends = {"ollama (stub)": lambda: BatchEmbedder(client, "stub"), "hashing": HashingEmbedder,
+                "onnx": lambda: OnnxEmbedder(args.onnx_path)}
+    for name, factory in backends.items():
+        try:
+            embedder = factory()
+            start = time.perf_counter()
+            embedder.embed(texts)
+            rate = args.chunks / (time.perf_counter() - start)
+        except Exception as e:   # missing optional packages or model files
+            print(f"{name:<16} skipped: {e}")
+            continue
+        print(f"{name:<16} {rate:>10.0f} {embedder.dimensions:>6}")
+        embedder.close()
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
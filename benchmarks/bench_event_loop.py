@@ -0,0 +1,195 @@
+"""Event-loop lag under mixed upload and chat load, by how handlers reach SQLite.
+
+Chatters read their recent history, "generate" (a short sleep) and insert
+the chat; uploaders write a file to disk chunk by chunk off the loop
+(as ``stream_to_disk`` does; not imported, so this runs without
+Starlette) and insert the document plus its ingestion job. Meanwhile a
+probe sleeps 5 ms at a time and records how late it wakes up: that
+overshoot is the lag every other request on the worker sees.
+
+- ``loop``: queries run inline in the coroutine, as the cancelled-stream
+  save and other small helpers did
+- ``threadpool``: ``run_in_threadpool``-style offload to a 40-thread pool
+  sharing the 16-connection pool, writers contending for SQLite's lock
+- ``async_db``: ``AsyncDatabase`` (reader threads + one writer thread)
+
+    python benchmarks/bench_event_loop.py --chatters 100 --uploaders 4 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.async_db import AsyncDatabase
+from utils.db_pool import ConnectionPool
+
+SCHEMA = [
+    "CREATE TABLE chats (id TEXT PRIMARY KEY, user_id INTEGER, message TEXT, response TEXT, tools_called TEXT, metadata TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE INDEX idx_chats_user ON chats(user_id, created_at)",
+    "CREATE TABLE documents (id TEXT PRIMARY KEY, filename TEXT, file_path TEXT, file_size INTEGER, metadata TEXT, user_id INTEGER, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE ingestion_jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, document_id TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued', available_at REAL)",
+]
+PROBE_INTERVAL = 0.005
+
+
+def recent_chats(conn, user_id):
+    return conn.execute("SELECT id, message, response FROM chats WHERE user_id = ? ORDER BY created_at DESC LIMIT 20",
+                        (user_id,)).fetchall()
+
+
+def insert_chat(conn, user_id):
+    conn.execute("INSERT INTO chats (id, user_id, message, response, metadata) VALUES (?, ?, ?, ?, ?)",
+                 (str(uuid.uuid4()), user_id, "what changed in the Q3 plan?", "The plan moved ...",
+                  json.dumps({"latency_ms": 812.4, "prompt_tokens": 900, "completion_tokens": 140})))
+
+
+def insert_document(conn, path, size):
+    document_id = str(uuid.uuid4())
+    conn.execute("INSERT INTO documents (id, filename, file_path, file_size, metadata, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+                 (document_id, os.path.basename(path), path, size, "{}", 1))
+    conn.execute("INSERT INTO ingestion_jobs (document_id, available_at) VALUES (?, ?)", (document_id, time.time()))
+
+
+class Inline:
+    """Queries on the event loop thread"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def read(self, fn, *args):
+        with self.pool.connection() as conn:
+            return fn(conn, *args)
+
+    async def write(self, fn, *args):
+        with self.pool.connection() as conn:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+
+
+class Threadpool(Inline):
+    """Each query on a thread of a shared pool, like run_in_threadpool"""
+
+    def __init__(self, pool):
+        super().__init__(pool)
+        self.executor = ThreadPoolExecutor(max_workers=40)
+
+    def _read(self, fn, args):
+        with self.pool.connection() as conn:
+            return fn(conn, *args)
+
+    def _write(self, fn, args):
+        with self.pool.connection() as conn:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+
+    async def read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._read, fn, args)
+
+    async def write(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._write, fn, args)
+
+
+def seed(path, chats, users):
+    pool = ConnectionPool(path, size=1)
+    with pool.connection() as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.executemany("INSERT INTO chats (id, user_id, message, response) VALUES (?, ?, ?, ?)",
+                         [(f"c{i}", i % users + 1, "hello", "hi there") for i in range(chats)])
+        conn.commit()
+    pool.close()
+
+
+async def probe(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def chatter(db, user_id, stop, done):
+    while not stop.is_set():
+        await db.read(recent_chats, user_id)
+        await asyncio.sleep(0.005)
+        await db.write(insert_chat, user_id)
+        done["chats"] += 1
+
+
+async def write_to_disk(path, chunk, count):
+    with open(path, "wb") as f:
+        for _ in range(count):
+            await asyncio.to_thread(f.write, chunk)
+            await asyncio.sleep(0)
+    return len(chunk) * count
+
+
+async def uploader(db, directory, size, stop, done):
+    chunk = os.urandom(1024 * 1024)
+    while not stop.is_set():
+        path = os.path.join(directory, f"{uuid.uuid4()}.bin")
+        written = await write_to_disk(path, chunk, size // len(chunk))
+        await db.write(insert_document, path, written)
+        os.remove(path)
+        done["uploads"] += 1
+
+
+async def run(db, args, directory):
+    stop = asyncio.Event()
+    lags, done = [], {"chats": 0, "uploads": 0}
+    tasks = [asyncio.create_task(probe(lags, stop))]
+    tasks += [asyncio.create_task(chatter(db, i % args.users + 1, stop, done)) for i in range(args.chatters)]
+    tasks += [asyncio.create_task(uploader(db, directory, args.upload_mb * 1024 * 1024, stop, done))
+              for _ in range(args.uploaders)]
+    await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return lags, done
+
+
+def report(label, lags, done, seconds):
+    lags = sorted(lag * 1000 for lag in lags)
+    p99 = lags[int(len(lags) * 0.99)]
+    print(f"{label:<12} lag p50 {statistics.median(lags):>7.2f} ms  p99 {p99:>7.2f} ms  max {lags[-1]:>8.2f} ms  "
+          f"{done['chats'] / seconds:>7,.0f} chats/s  {done['uploads'] / seconds:>5.1f} uploads/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chatters", type=int, default=100)
+    parser.add_argument("--uploaders", type=int, default=4)
+    parser.add_argument("--upload-mb", type=int, default=8)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=200000, help="chat rows loaded before the run")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.chatters} chatters, {args.uploaders} uploaders of {args.upload_mb} MB, {args.seconds:.0f} s each\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ("loop", "threadpool", "async_db"):
+            path = os.path.join(tmp, f"{label}.db")
+            seed(path, args.chats, args.users)
+            if label == "async_db":
+                db = AsyncDatabase(path)
+            else:
+                pool = ConnectionPool(path)
+                db = Inline(pool) if label == "loop" else Threadpool(pool)
+            lags, done = asyncio.run(run(db, args, tmp))
+            report(label, lags, done, args.seconds)
+            if label == "async_db":
+                db.close()
+            else:
+                pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Chat logging at 200 concurrent chatters: a commit per write vs the group-committing writer.
+
+Each chatter waits a few ms (the rest of its request), then logs a chat;
+every tenth chat also creates a task, as "create task ..." messages do.
+The database has the usage-counter triggers installed, like the app's.
+
+- ``pool``: the old path. The chat is committed on a pooled connection
+  from a 40-thread pool, and a task gets a second connection and commit.
+  Writers contend for SQLite's lock.
+- ``writer, no batching``: ``AsyncDatabase`` with ``batch_size=1``. One
+  writer thread, one commit per chat (chat and task together).
+- ``group commit``: the default ``AsyncDatabase`` (DB_GROUP_COMMIT_MS,
+  DB_WRITE_BATCH), awaited at NORMAL durability.
+- ``group commit, FULL``: as above, but every batch is fsynced.
+- ``group commit, deferred``: the default for chat logs. The handler only
+  waits to enqueue, so the latency shown is the enqueue time.
+
+Latency is what the handler awaits; throughput is committed chats per
+second.
+
+    python benchmarks/bench_group_commit.py --chatters 200 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils import usage
+from utils.async_db import AsyncDatabase, Durability
+from utils.db_pool import ConnectionPool
+
+SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, workspace_id TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE chats (id TEXT PRIMARY KEY, user_id INTEGER, message TEXT, response TEXT, tools_called TEXT, metadata TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    '''CREATE TABLE tasks (id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT, due_date TIMESTAMP,
+       priority TEXT DEFAULT 'medium', status TEXT DEFAULT 'todo', linked_documents TEXT, user_id INTEGER,
+       created_by_ai BOOLEAN DEFAULT FALSE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+]
+METADATA = json.dumps({"latency_ms": 912.3, "prompt_tokens": 850, "completion_tokens": 130,
+                       "fallback": False, "cached": False, "context_tokens": 700})
+
+
+def insert_chat(conn, user_id, message):
+    conn.execute("INSERT INTO chats (id, user_id, message, response, metadata) VALUES (?, ?, ?, ?, ?)",
+                 (str(uuid.uuid4()), user_id, message, "Sure, here is what I found ...", METADATA))
+
+
+def insert_task(conn, user_id, message):
+    conn.execute("INSERT INTO tasks (id, title, description, user_id, created_by_ai) VALUES (?, ?, ?, ?, ?)",
+                 (str(uuid.uuid4()), "Review Q3 Plan", f"From chat: {message}", user_id, True))
+
+
+def save_chat(conn, user_id, message, with_task):
+    insert_chat(conn, user_id, message)
+    if with_task:
+        insert_task(conn, user_id, message)
+
+
+def make_db(path, users):
+    pool = ConnectionPool(path, size=1)
+    with pool.connection() as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.executemany("INSERT INTO users (username, workspace_id) VALUES (?, ?)",
+                         [(f"user{i}", str(uuid.uuid4())) for i in range(users)])
+        usage.install(conn.cursor())
+        conn.commit()
+    pool.close()
+
+
+class PerRequest:
+    """The old path: each write borrows a pooled connection on a threadpool thread and commits"""
+
+    def __init__(self, path):
+        self.pool = ConnectionPool(path)
+        self.executor = ThreadPoolExecutor(max_workers=40)
+
+    def _commit(self, fn, args):
+        with self.pool.connection() as conn:
+            fn(conn, *args)
+            conn.commit()
+
+    async def log(self, user_id, message, with_task):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._commit, insert_chat, (user_id, message))
+        if with_task:
+            await loop.run_in_executor(self.executor, self._commit, insert_task, (user_id, message))
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+
+
+class Writer:
+    def __init__(self, path, durability, **options):
+        self.db = AsyncDatabase(path, readers=1, **options)
+        self.durability = durability
+
+    async def log(self, user_id, message, with_task):
+        if self.durability is Durability.DEFERRED:
+            self.db.submit_write(save_chat, user_id, message, with_task, durability=self.durability)
+        else:
+            await self.db.write(save_chat, user_id, message, with_task, durability=self.durability)
+
+    def close(self):
+        self.db.close()
+
+
+async def chatter(target, user_id, think_ms, stop, latencies, errors):
+    rng = random.Random(user_id)
+    n = 0
+    while not stop.is_set():
+        await asyncio.sleep(rng.uniform(0, think_ms) / 1000)
+        n += 1
+        start = time.perf_counter()
+        try:
+            await target.log(user_id, "create task review q3 plan" if n % 10 == 0 else "what changed?", n % 10 == 0)
+        except Exception:
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(target, args):
+    stop = asyncio.Event()
+    latencies, errors = [], []
+    tasks = [asyncio.create_task(chatter(target, i % args.users + 1, args.think_ms, stop, latencies, errors))
+             for i in range(args.chatters)]
+    await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return latencies, errors
+
+
+def count_chats(path):
+    pool = ConnectionPool(path, size=1)
+    with pool.connection() as conn:
+        chats = conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+    pool.close()
+    return chats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chatters", type=int, default=200)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--think-ms", type=float, default=10, help="upper bound of the random wait between chats")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    setups = [
+        ("pool", lambda path: PerRequest(path)),
+        ("writer, no batching", lambda path: Writer(path, Durability.NORMAL, batch_size=1, group_commit_ms=0)),
+        ("group commit", lambda path: Writer(path, Durability.NORMAL)),
+        ("group commit, FULL", lambda path: Writer(path, Durability.FULL)),
+        ("group commit, deferred", lambda path: Writer(path, Durability.DEFERRED)),
+    ]
+    print(f"{args.chatters} chatters, {args.seconds:.0f} s each\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, setup in setups:
+            path = os.path.join(tmp, f"{len(os.listdir(tmp))}.db")
+            make_db(path, args.users)
+            target = setup(path)
+            started = time.perf_counter()
+            latencies, errors = asyncio.run(run(target, args))
+            target.close()
+            elapsed = time.perf_counter() - started
+            per_commit = ""
+            if isinstance(target, Writer):
+                per_commit = f"  {target.db.stats()['writes_per_commit']:>6.1f} writes/commit"
+            latencies = sorted(latency * 1000 for latency in latencies)
+            print(f"{label:<24} p50 {latencies[len(latencies) // 2]:>8.2f} ms  "
+                  f"p99 {latencies[int(len(latencies) * 0.99)]:>8.2f} ms  "
+                  f"{count_chats(path) / elapsed:>8,.0f} chats/s  {len(errors):>5} errors{per_commit}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Overhead of the metrics subsystem.
+
+Reports the cost of one histogram observation and one ``span``, then
+drives a minimal ASGI app through :class:`MetricsMiddleware` with metrics
+on and off. The app answers each request with a SQLite query through the
+connection pool (itself instrumented), about the cheapest request the API
+serves, so the percentage is an upper bound for real endpoints. Finally
+times rendering ``/metrics`` with every route and stage populated.
+
+    python benchmarks/bench_metrics.py --requests 20000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils import metrics
+from utils.db_pool import ConnectionPool
+
+
+class Route:
+    def __init__(self, path, endpoint):
+        self.path = path
+        self.endpoint = endpoint
+
+
+def per_call_ns(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--routes", type=int, default=40)
+    args = parser.parse_args()
+
+    histogram = metrics.Histogram("bench_seconds", "", ("stage",))
+
+    def in_span():
+        with metrics.span("bench"):
+            pass
+
+    print(f"histogram observe: {per_call_ns(lambda: histogram.observe(0.004, 'bench'), 200000):.0f} ns")
+    print(f"span:              {per_call_ns(in_span, 200000):.0f} ns\n")
+
+    directory = tempfile.mkdtemp()
+    pool = ConnectionPool(os.path.join(directory, "bench.db"), size=1)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE tasks (id INTEGER PRIMARY KEY, title TEXT)")
+        conn.executemany("INSERT INTO tasks (title) VALUES (?)", [(f"task {i}",) for i in range(100)])
+        conn.commit()
+
+    def list_tasks():
+        with pool.connection() as conn:
+            return conn.execute("SELECT id, title FROM tasks ORDER BY id LIMIT 20").fetchall()
+
+    routes = [Route(f"/route{i}/{{item_id}}", list_tasks) for i in range(args.routes)]
+
+    class App:
+        pass
+
+    application = App()
+    application.routes = routes
+
+    async def endpoint(scope, receive, send):
+        scope["endpoint"] = list_tasks
+        list_tasks()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"[]"})
+
+    middleware = metrics.MetricsMiddleware(endpoint)
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    async def drive(handler):
+        start = time.perf_counter()
+        for i in range(args.requests):
+            await handler({"type": "http", "method": "GET", "path": f"/route/{i}", "app": application},
+                          receive, send)
+        return (time.perf_counter() - start) / args.requests * 1e6
+
+    results = {True: [], False: []}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            metrics.METRICS_ENABLED = enabled
+            results[enabled].append(asyncio.run(drive(middleware)))
+    off, on = statistics.median(results[False]), statistics.median(results[True])
+    print(f"{'metrics':<8} {'us/request':>11}")
+    print(f"{'off':<8} {off:>11.2f}")
+    print(f"{'on':<8} {on:>11.2f}   (+{on - off:.2f} us, {(on - off) / off * 100:+.1f}%)\n")
+
+    for route in routes:
+        for status in (200, 404, 500):
+            metrics.REQUEST_LATENCY.observe(0.01, "GET", route.path, f"{status // 100}xx")
+    start = time.perf_counter()
+    text = metrics.render()
+    print(f"render /metrics: {(time.perf_counter() - start) * 1000:.2f} ms for {text.count(chr(10))} lines")
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
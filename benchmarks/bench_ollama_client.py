@@ -0,0 +1,152 @@
+"""Concurrent Ollama calls: per-call ``requests`` vs the pooled OllamaClient.
+
+A stub server answers ``/api/embed`` and ``/api/generate`` after a fixed
+latency. The same number of calls is made three ways at each concurrency:
+
+* ``requests``  - a new connection per call from a thread pool (the old code path)
+* ``sync pool`` - ``OllamaClient.post`` from a thread pool over keep-alive connections
+* ``async``     - ``OllamaClient.apost`` gathered on one event loop
+
+Concurrency stays within the per-endpoint limits the app uses; the async
+path should match the pooled one without tying up a thread per call. It also
+reports how long a call takes to fail once the circuit breaker has opened
+against a server that is down.
+
+    python benchmarks/bench_ollama_client.py --calls 1000 --latency-ms 20
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.ollama_client import OllamaClient, OllamaUnavailable, CircuitBreaker, ENDPOINT_LIMITS
+
+PAYLOAD = {"model": "stub", "input": ["hello world"]}
+
+
+def make_handler(latency: float):
+    body = json.dumps({"embeddings": [[0.01] * 384]}).encode()
+
+    class StubOllama(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StubOllama
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256    # the default backlog of 5 resets connections under load
+
+
+def serve(latency: float, ports):
+    # Own process, so the stub does not compete with the clients for the GIL
+    server = StubServer(("127.0.0.1", 0), make_handler(latency))
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def run_requests(url: str, calls: int, concurrency: int) -> float:
+    def call(_):
+        response = requests.post(f"{url}/api/embed", json=PAYLOAD, timeout=30)
+        response.raise_for_status()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(call, range(calls)))
+    return calls / (time.perf_counter() - start)
+
+
+def run_sync_pool(client: OllamaClient, calls: int, concurrency: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(lambda _: client.post("embed", "/api/embed", PAYLOAD), range(calls)))
+    return calls / (time.perf_counter() - start)
+
+
+def run_async(client: OllamaClient, calls: int, concurrency: int) -> float:
+    async def go():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def call():
+            async with slots:
+                await client.apost("embed", "/api/embed", PAYLOAD)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(call() for _ in range(calls)))
+        elapsed = time.perf_counter() - start
+        await client.aclose()
+        return calls / elapsed
+
+    return asyncio.run(go())
+
+
+def breaker_fail_fast(calls: int = 200):
+    client = OllamaClient("http://127.0.0.1:9", breaker=CircuitBreaker(failures=3, reset_seconds=60))
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        try:
+            client.post("embed", "/api/embed", PAYLOAD, timeout=2)
+        except OllamaUnavailable:
+            pass
+        timings.append(time.perf_counter() - start)
+    client.close()
+    return timings[0], sum(timings[3:]) / len(timings[3:])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(args.latency_ms / 1000, ports), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{ports.get()}"
+
+    # The per-kind limit would otherwise cap the pooled runs below the tested concurrency
+    ENDPOINT_LIMITS["embed"] = max(args.concurrency)
+
+    print(f"{'concurrency':>11} {'requests':>10} {'sync pool':>10} {'async':>10}   (calls/s)")
+    for concurrency in args.concurrency:
+        client = OllamaClient(url)
+        row = [
+            run_requests(url, args.calls, concurrency),
+            run_sync_pool(client, args.calls, concurrency),
+            run_async(client, args.calls, concurrency),
+        ]
+        client.close()
+        print(f"{concurrency:>11} " + " ".join(f"{r:>10.0f}" for r in row))
+
+    first, open_avg = breaker_fail_fast()
+    print(f"server down: first call {first * 1000:.2f} ms, with breaker open {open_avg * 1000:.3f} ms")
+
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Task listing latency at 1M rows: full listing vs OFFSET vs keyset pages.
+
+Builds a ``tasks`` table with the app's schema and listing indexes, where one
+"power user" owns ``--power-rows`` of the rows and the rest are spread over
+other users. Timestamps have one-second resolution like CURRENT_TIMESTAMP,
+so many rows share a ``created_at`` and the ``id`` tie-break matters.
+
+    python benchmarks/bench_pagination.py --rows 1000000 --power-rows 100000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.pagination import keyset_page
+
+COLUMNS = ["id", "title", "description", "due_date", "priority", "status",
+           "linked_documents", "user_id", "created_by_ai", "created_at"]
+POWER_USER = 1
+PAGE_WALK = 500
+
+
+def build(path: str, rows: int, power_rows: int):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute('''
+        CREATE TABLE tasks (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            due_date TIMESTAMP,
+            priority TEXT DEFAULT 'medium',
+            status TEXT DEFAULT 'todo',
+            linked_documents TEXT,
+            user_id INTEGER,
+            created_by_ai BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    start = time.time() - rows
+    batch = []
+    for i in range(rows):
+        user_id = POWER_USER if i % (rows // power_rows) == 0 else 2 + i % 5000
+        created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + i // 4))
+        batch.append((str(uuid.uuid4()), f"Task {i}", "Follow up on the quarterly report " * 3, None,
+                      random.choice(["low", "medium", "high"]), random.choice(["todo", "in_progress", "done"]),
+                      "[]", user_id, False, created_at))
+        if len(batch) == 50000:
+            conn.executemany(f"INSERT INTO tasks VALUES ({','.join('?' * 10)})", batch)
+            batch = []
+    conn.executemany(f"INSERT INTO tasks VALUES ({','.join('?' * 10)})", batch)
+    conn.commit()
+    return conn
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def legacy(conn):
+    # The old endpoint: every row, SELECT *, serialized in one response
+    rows = conn.execute("SELECT * FROM tasks WHERE user_id = ? ORDER BY created_at DESC", (POWER_USER,)).fetchall()
+    return json.dumps([dict(zip(COLUMNS, r)) for r in rows])
+
+
+def offset_page(conn, offset: int, limit: int):
+    rows = conn.execute("SELECT * FROM tasks WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                        (POWER_USER, limit, offset)).fetchall()
+    return json.dumps([dict(zip(COLUMNS, r)) for r in rows])
+
+
+def keyset(conn, cursor, limit: int, columns=COLUMNS, where="user_id = ?", params=(POWER_USER,)):
+    rows, next_cursor = keyset_page(conn, "tasks", list(columns), where, list(params), cursor, limit)
+    return json.dumps(rows), next_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--power-rows", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    start = time.perf_counter()
+    conn = build(path, args.rows, args.power_rows)
+    print(f"built {args.rows} rows in {time.perf_counter() - start:.1f}s "
+          f"(power user owns {conn.execute('SELECT COUNT(*) FROM tasks WHERE user_id = ?', (POWER_USER,)).fetchone()[0]})")
+
+    deep = args.power_rows // 2
+    ms, body = timed(lambda: legacy(conn), 3)
+    print(f"no index  full listing            {ms:9.2f} ms  {len(body) / 1e6:7.1f} MB")
+
+    conn.execute("CREATE INDEX idx_tasks_user_created ON tasks(user_id, created_at, id)")
+    conn.execute("CREATE INDEX idx_tasks_user_status_priority ON tasks(user_id, status, priority, created_at, id)")
+    conn.execute("ANALYZE")
+
+    ms, body = timed(lambda: legacy(conn), 3)
+    print(f"indexed   full listing            {ms:9.2f} ms  {len(body) / 1e6:7.1f} MB")
+    ms, body = timed(lambda: offset_page(conn, 0, args.limit), args.repeat)
+    print(f"indexed   OFFSET first page       {ms:9.2f} ms  {len(body) / 1e3:7.1f} KB")
+    ms, body = timed(lambda: offset_page(conn, deep, args.limit), args.repeat)
+    print(f"indexed   OFFSET page @{deep:<9} {ms:9.2f} ms")
+
+    ms, (body, _) = timed(lambda: keyset(conn, None, args.limit), args.repeat)
+    print(f"keyset    first page              {ms:9.2f} ms  {len(body) / 1e3:7.1f} KB")
+
+    # Walk to the same depth to get a real cursor
+    cursor, walked = None, 0
+    while walked < deep:
+        step = min(PAGE_WALK, deep - walked)
+        _, cursor = keyset(conn, cursor, step, columns=["id"])
+        walked += step
+    ms, _ = timed(lambda: keyset(conn, cursor, args.limit), args.repeat)
+    print(f"keyset    page @{deep:<15} {ms:9.2f} ms")
+
+    ms, (body, _) = timed(lambda: keyset(conn, cursor, args.limit, columns=["id", "title", "status"]), args.repeat)
+    print(f"keyset    page, fields=id,title,status {ms:6.2f} ms  {len(body) / 1e3:7.1f} KB")
+
+    ms, _ = timed(lambda: keyset(conn, None, args.limit, where="user_id = ? AND status = ? AND priority = ?",
+                                 params=(POWER_USER, "todo", "high")), args.repeat)
+    print(f"keyset    status+priority filter  {ms:9.2f} ms")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""PDF extraction throughput on synthetic multi-hundred-page PDFs.
+
+Compares the old whole-document ``text +=`` loop with the page-streaming
+extractor, serial and with a process pool, in pages/sec. Also reports the
+peak size of text held at once: the whole document for the old loop, one
+chunk window for the streaming chunker.
+
+    python benchmarks/bench_pdf_extraction.py --pages 200 500 --workers 1 2 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pypdf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils import file_processor
+from utils.chunker import Chunker
+from utils.file_processor import iter_pdf_pages
+
+LINES_PER_PAGE = 45
+WORDS = ("revenue forecast quarterly budget launch milestone review contract vendor "
+         "compliance roadmap customer retention hiring infrastructure migration").split()
+
+
+def write_pdf(path: str, pages: int):
+    """Minimal text PDF (Helvetica, one content stream per page)"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        lines = []
+        for line in range(LINES_PER_PAGE):
+            words = " ".join(WORDS[(p * 7 + line * 3 + w) % len(WORDS)] for w in range(12))
+            lines.append(f"1 0 0 1 40 {800 - line * 16} Tm (Page {p + 1} line {line + 1}: {words}) Tj")
+        stream = ("BT /F1 9 Tf " + " ".join(lines) + " ET").encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def legacy_extract(path: str) -> str:
+    # The previous implementation
+    text = ""
+    with open(path, "rb") as file:
+        for page in pypdf.PdfReader(file).pages:
+            text += page.extract_text() + "\n"
+    return text.strip()
+
+
+def streamed(path: str, workers: int):
+    """Extract and chunk page by page; returns (chunks, largest text held at once)"""
+    chunks, peak = 0, 0
+    for chunk in Chunker().chunks(text + "\n" for _, text in iter_pdf_pages(path, workers=workers)):
+        chunks += 1
+        peak = max(peak, len(chunk["text"]))
+    return chunks, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[200, 500])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    # Parallel extraction normally starts at PDF_PARALLEL_MIN_PAGES
+    file_processor.PDF_PARALLEL_MIN_PAGES = 1
+    directory = tempfile.mkdtemp()
+    print(f"cpus: {os.cpu_count()}")
+    for pages in args.pages:
+        path = os.path.join(directory, f"synthetic_{pages}.pdf")
+        write_pdf(path, pages)
+        print(f"\n{pages} pages ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+        start = time.perf_counter()
+        text = legacy_extract(path)
+        elapsed = time.perf_counter() - start
+        print(f"  legacy text +=        {pages / elapsed:8.1f} pages/s   holds {len(text) / 1e3:8.1f} KB of text")
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            chunks, peak = streamed(path, workers)
+            elapsed = time.perf_counter() - start
+            print(f"  streaming workers={workers:<3} {pages / elapsed:8.1f} pages/s   "
+                  f"holds {peak / 1e3:8.1f} KB of text ({chunks} chunks)")
+
+
+if __name__ == "__main__":
+    main()
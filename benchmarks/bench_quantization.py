@@ -0,0 +1,95 @@
+"""Disk size, memory and recall@k of the vector index per quantization mode.
+
+A fixture corpus of ``--chunks`` vectors (Mistral-sized 4096 dimensions by
+default) is drawn around topic centres, as document embeddings cluster by
+topic, and indexed with each codec. Queries are noisy copies of stored
+vectors. For each mode the saved index size on disk, the bytes of vectors
+held in memory, exact-scan latency and recall@k against float32 are
+reported, without and with full-precision re-scoring of the top
+``--rescore`` candidates (served here from an in-memory dict standing in
+for Chroma).
+
+    python benchmarks/bench_quantization.py --chunks 5000 --dimensions 4096
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.quantization import CODECS, make_codec
+from utils.vector_index import VectorIndex
+
+
+def disk_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dimensions", type=int, default=4096)
+    parser.add_argument("--topics", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    topics = rng.normal(size=(args.topics, args.dimensions))
+    vectors = (topics[rng.integers(args.topics, size=args.chunks)]
+               + rng.normal(scale=0.8, size=(args.chunks, args.dimensions))).astype(np.float32)
+    ids = [f"c{i}" for i in range(args.chunks)]
+    by_id = dict(zip(ids, vectors))
+    picks = rng.integers(args.chunks, size=args.queries)
+    queries = [(vectors[i] + rng.normal(scale=0.8, size=args.dimensions)).tolist() for i in picks]
+
+    def fetch(chunk_ids):
+        return [by_id[chunk_id] for chunk_id in chunk_ids]
+
+    print(f"{args.chunks} chunks x {args.dimensions} dims, {args.queries} queries, recall@{args.k}\n")
+    print(f"{'mode':<8} {'disk MB':>8} {'RAM MB':>8} {'p50 ms':>8} {'recall':>7} "
+          f"{'p50 ms':>8} {'recall':>7}")
+    print(f"{'':<8} {'':>8} {'':>8} {'quantized only':>16} {'+ rescore ' + str(args.rescore):>16}")
+
+    root = tempfile.mkdtemp()
+    truth = None
+    try:
+        for name in CODECS:
+            index = VectorIndex.build(ids, [""] * args.chunks, [{}] * args.chunks, vectors, make_codec(name),
+                                      exact_max=args.chunks, rescore=args.rescore)
+            directory = os.path.join(root, name)
+            os.makedirs(directory)
+            index.save(os.path.join(directory, "ws"))
+            index = VectorIndex.load(os.path.join(directory, "ws"), make_codec(name),
+                                     exact_max=args.chunks, rescore=args.rescore)
+
+            row = [disk_bytes(directory) / 1024 / 1024, index.nbytes / 1024 / 1024]
+            for fetch_vectors in (None, fetch):
+                index.fetch_vectors = fetch_vectors
+                latencies, found = [], []
+                for query in queries:
+                    start = time.perf_counter()
+                    found.append([chunk_id for chunk_id, score in index.search(query, args.k)[1]])
+                    latencies.append((time.perf_counter() - start) * 1000)
+                if truth is None:
+                    truth = found
+                recall = statistics.mean(len(set(a) & set(b)) / args.k for a, b in zip(found, truth))
+                row += [statistics.median(latencies), recall]
+                if not index.codec.lossy:
+                    row += row[-2:]
+                    break
+            print(f"{name:<8} {row[0]:>8.1f} {row[1]:>8.1f} {row[2]:>8.2f} {row[3]:>7.3f} "
+                  f"{row[4]:>8.2f} {row[5]:>7.3f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Offline relevance and latency of vector, keyword and hybrid retrieval.
+
+Builds a fixture workspace in a temporary directory (real Chroma collection
+and FTS5 index) from a generated corpus with two kinds of questions:
+
+- identifier queries ("ERR-4012") whose answer is the one incident report
+  quoting that code; each report is also repeated verbatim in a weekly
+  digest document, so duplicate results are visible
+- paraphrase queries that describe a policy with synonyms of its wording,
+  sharing no content words with it
+
+No Ollama is needed: a stand-in embedder hashes words into a bag-of-concepts
+vector where synonyms share a dimension and tokens containing digits are
+dropped, which mimics how a dense model matches meaning but blurs IDs.
+
+    python benchmarks/bench_retrieval.py --incidents 400 --policies 80
+"""
+import argparse
+import hashlib
+import math
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+DIMENSIONS = 256
+WORKSPACE = "bench"
+LIMIT = 3
+
+CONCEPTS = [
+    ("salary", "compensation", "wages"), ("remote", "distributed", "offsite"),
+    ("employees", "staff", "personnel"), ("laptop", "notebook", "computer"),
+    ("refund", "reimbursement", "repayment"), ("travel", "trips", "journeys"),
+    ("vacation", "holiday", "leave"), ("parental", "maternity", "paternity"),
+    ("contractor", "freelancer", "consultant"), ("password", "passphrase", "credential"),
+    ("expenses", "costs", "spending"), ("approval", "signoff", "authorization"),
+    ("manager", "supervisor", "lead"), ("insurance", "coverage", "protection"),
+    ("training", "education", "coaching"), ("overtime", "extra", "additional"),
+    ("relocation", "moving", "transfer"), ("equipment", "hardware", "devices"),
+    ("security", "safety", "protection"), ("onboarding", "induction", "orientation"),
+    ("quarterly", "trimonthly", "seasonal"), ("bonus", "incentive", "reward"),
+    ("meals", "food", "dining"), ("phone", "mobile", "cellphone"),
+    ("deadline", "cutoff", "duedate"), ("receipt", "invoice", "voucher"),
+    ("weekend", "saturday", "sunday"), ("international", "overseas", "abroad"),
+    ("health", "medical", "wellness"), ("retirement", "pension", "superannuation"),
+]
+CANONICAL = {word: group[0] for group in CONCEPTS for word in group}
+SERVICES = ["billing", "search", "checkout", "auth", "reporting", "notifications", "payments", "inventory"]
+JOBS = ["export", "reindex", "backup", "sync", "rollup"]
+COMPONENTS = ["worker pool", "cache", "queue consumer", "database replica", "scheduler"]
+WORD = re.compile(r"\w+")
+
+
+def embed(texts):
+    """Stand-in dense embedder: synonyms share a dimension, tokens with digits are dropped"""
+    vectors = []
+    for text in texts:
+        vector = [0.0] * DIMENSIONS
+        for word in WORD.findall(text.lower()):
+            if any(ch.isdigit() for ch in word):
+                continue
+            bucket = int(hashlib.md5(CANONICAL.get(word, word).encode()).hexdigest(), 16) % DIMENSIONS
+            vector[bucket] += 1.0 if word in CANONICAL else 0.3
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        vectors.append([x / norm for x in vector])
+    return vectors
+
+
+def build_corpus(incidents: int, policies: int, rng: random.Random):
+    """Returns ``(documents, queries)``; documents are ``(document_id, [paragraphs])``,
+    queries are ``(kind, text, relevant paragraph)``"""
+    documents, queries = [], []
+    codes = rng.sample(range(1000, 9999), incidents)
+    reports = []
+    for i, code in enumerate(codes):
+        text = (f"Incident report {i + 1}: the {rng.choice(SERVICES)} service returned error ERR-{code} "
+                f"during the nightly {rng.choice(JOBS)} job. The on-call engineer restarted the "
+                f"{rng.choice(COMPONENTS)} and the error rate returned to normal within "
+                f"{rng.randint(3, 90)} minutes.")
+        reports.append(text)
+        queries.append(("identifier", f"What happened with ERR-{code}?", text))
+    for start in range(0, incidents, 50):
+        documents.append((f"incidents-{start // 50}", reports[start:start + 50]))
+        # The weekly digest quotes the same reports word for word
+        documents.append((f"digest-{start // 50}", reports[start:start + 50]))
+
+    paragraphs = []
+    for i in range(policies):
+        groups = rng.sample(CONCEPTS, 3)
+        text = (f"Policy {i + 1}. The rules for {groups[0][0]} and {groups[1][0]} apply to all "
+                f"{groups[2][0]}; requests go through the usual process described in the handbook.")
+        paragraphs.append(text)
+        queries.append(("paraphrase", f"how do we handle {groups[0][1]} with {groups[1][2]} for {groups[2][1]}",
+                        text))
+    for start in range(0, policies, 20):
+        documents.append((f"handbook-{start // 20}", paragraphs[start:start + 20]))
+    return documents, queries
+
+
+def index_corpus(rag, documents):
+    from utils.file_processor import content_hash
+    from workers.ingestion import chunk_id
+    for document_id, paragraphs in documents:
+        ids, metadatas, offset = [], [], 0
+        for index, text in enumerate(paragraphs):
+            ids.append(chunk_id(document_id, content_hash(text)))
+            metadatas.append({"document_id": document_id, "chunk_index": index,
+                              "char_start": offset, "char_end": offset + len(text)})
+            offset += len(text) + 2
+        rag.upsert_chunks(WORKSPACE, ids, paragraphs, embed(paragraphs), metadatas)
+
+
+def legacy_retrieve(rag, query: str):
+    # The previous search: top ``limit`` vector hits only
+    collection = rag.collections.get(WORKSPACE)
+    results = collection.query(query_embeddings=embed([query]), n_results=LIMIT)
+    return results["documents"][0]
+
+
+def evaluate(name: str, retrieve, queries):
+    by_kind, latencies, duplicates, returned = {}, [], 0, 0
+    for kind, query, relevant in queries:
+        start = time.perf_counter()
+        documents = retrieve(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hit = relevant in documents
+        rank = documents.index(relevant) + 1 if hit else None
+        stats = by_kind.setdefault(kind, {"hits": 0, "rr": 0.0, "n": 0})
+        stats["n"] += 1
+        stats["hits"] += hit
+        stats["rr"] += 1.0 / rank if rank else 0.0
+        duplicates += len(documents) - len(set(documents))
+        returned += len(documents)
+
+    latencies.sort()
+    columns = []
+    for kind in ("identifier", "paraphrase"):
+        stats = by_kind[kind]
+        columns.append(f"{stats['hits'] / stats['n']:6.2f} {stats['rr'] / stats['n']:6.2f}")
+    print(f"{name:<16} {columns[0]}   {columns[1]}   {duplicates / max(returned, 1):9.1%}   "
+          f"{statistics.median(latencies):7.2f} {latencies[int(len(latencies) * 0.95)]:7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incidents", type=int, default=400)
+    parser.add_argument("--policies", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("database", exist_ok=True)
+    from utils import rag as rag_module
+    from utils.rag import RAGSystem
+
+    rag = RAGSystem()
+    rag.embed_texts = lambda texts: embed(texts)
+
+    documents, queries = build_corpus(args.incidents, args.policies, random.Random(args.seed))
+    start = time.perf_counter()
+    index_corpus(rag, documents)
+    chunks = sum(len(p) for _, p in documents)
+    print(f"indexed {chunks} chunks in {time.perf_counter() - start:.1f}s; "
+          f"{len(queries)} queries, top {LIMIT}\n")
+
+    print(f"{'':<16} {'identifier':^13}   {'paraphrase':^13}   {'duplicates':>9}   {'latency ms':^15}")
+    print(f"{'':<16} {'recall':>6} {'MRR':>6}   {'recall':>6} {'MRR':>6}   {'':>9}   {'p50':>7} {'p95':>7}")
+    evaluate("legacy vector", lambda q: legacy_retrieve(rag, q), queries)
+    for name, mode, rerank_results in [("vector", "vector", False), ("lexical", "lexical", False),
+                                       ("hybrid", "hybrid", False), ("hybrid + rerank", "hybrid", True)]:
+        evaluate(name, lambda q: rag.retrieve(q, WORKSPACE, LIMIT, mode=mode,
+                                              rerank_results=rerank_results)["documents"], queries)
+
+    # Same pipeline with deduplication switched off
+    rag_module.dedupe = lambda candidates, limit: candidates[:limit]
+    evaluate("  without dedup", lambda q: rag.retrieve(q, WORKSPACE, LIMIT, mode="hybrid",
+                                                       rerank_results=True)["documents"], queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""/admin/ai-usage at scale: COUNT(*) scans vs trigger-maintained counters.
+
+Loads ``--chats`` chat rows (10M by default, spread over a year and
+``--users`` users) plus tasks, then compares:
+
+- the three ``COUNT(*)`` queries the endpoint used to run vs the counters
+- chats / tokens / average latency per day for the last 30 days, grouped
+  from ``chats`` vs read from ``usage_daily``
+- the one-off backfill that builds the counters for an existing database
+- chat insert + commit throughput with and without the triggers
+
+    python benchmarks/bench_usage.py --chats 10000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils import usage
+from utils.db_pool import ConnectionPool
+
+SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, workspace_id TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE chats (id TEXT PRIMARY KEY, user_id INTEGER, message TEXT, response TEXT, tools_called TEXT, metadata TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE tasks (id TEXT PRIMARY KEY, title TEXT, user_id INTEGER, created_by_ai BOOLEAN DEFAULT FALSE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+]
+BATCH = 50000
+
+
+def timed(label, function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<40} {best * 1000:>10.2f} ms")
+    return result
+
+
+def load(conn, chats, users, seed=0):
+    rng = random.Random(seed)
+    conn.executemany("INSERT INTO users (username, workspace_id) VALUES (?, ?)",
+                     [(f"user{i}", str(uuid.uuid4())) for i in range(users)])
+    now = datetime.utcnow()
+    for start in range(0, chats, BATCH):
+        rows = []
+        for i in range(start, min(start + BATCH, chats)):
+            created = now - timedelta(seconds=rng.randrange(365 * 86400))
+            metadata = json.dumps({"latency_ms": round(rng.uniform(200, 5000), 1),
+                                   "prompt_tokens": rng.randrange(100, 2000),
+                                   "completion_tokens": rng.randrange(20, 500),
+                                   "fallback": rng.random() < 0.02, "cached": rng.random() < 0.1})
+            rows.append((f"c{i}", rng.randrange(1, users + 1), "hello", "hi", metadata,
+                         created.strftime("%Y-%m-%d %H:%M:%S")))
+        conn.executemany("INSERT INTO chats (id, user_id, message, response, metadata, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO tasks (id, title, user_id, created_by_ai, created_at) VALUES (?, ?, ?, ?, ?)",
+                         [(f"t{row[0]}", "Task", row[1], rng.random() < 0.5, row[5]) for row in rows[::10]])
+        conn.commit()
+        print(f"\rloaded {min(start + BATCH, chats):,} chats", end="", flush=True)
+    print()
+
+
+def insert_rate(pool, users, count):
+    start = time.perf_counter()
+    for i in range(count):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO chats (id, user_id, message, response, metadata) VALUES (?, ?, ?, ?, ?)",
+                         (str(uuid.uuid4()), i % users + 1, "hello", "hi",
+                          json.dumps({"latency_ms": 900.0, "prompt_tokens": 800, "completion_tokens": 120})))
+            conn.commit()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--inserts", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "usage.db")
+        pool = ConnectionPool(db_path, size=1)
+        with pool.connection() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            load(conn, args.chats, args.users)
+
+            since = (datetime.utcnow() - timedelta(days=29)).strftime("%Y-%m-%d")
+
+            def scans():
+                return [conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0],
+                        conn.execute("SELECT COUNT(*) FROM tasks WHERE created_by_ai = 1").fetchone()[0],
+                        conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]]
+
+            def grouped():
+                return conn.execute('''
+                    SELECT substr(created_at, 1, 10) AS day, COUNT(*),
+                           SUM(json_extract(metadata, '$.prompt_tokens') + json_extract(metadata, '$.completion_tokens')),
+                           AVG(json_extract(metadata, '$.latency_ms'))
+                    FROM chats WHERE created_at >= ? GROUP BY day
+                ''', (since,)).fetchall()
+
+            print(f"\n{args.chats:,} chats, {args.users} users\n")
+            before = timed("before: 3 x COUNT(*)", scans, repeat=2)
+            timed("before: 30 days grouped from chats", grouped, repeat=2)
+
+            start = time.perf_counter()
+            usage.install(conn.cursor())
+            conn.commit()
+            print(f"{'backfill (once, on upgrade)':<40} {(time.perf_counter() - start) * 1000:>10.2f} ms")
+
+        counters = usage.UsageCounters(pool)
+        totals = timed("after: counters", counters.totals)
+        timed("after: 30 days from usage_daily", lambda: counters.daily(30))
+        assert [totals["chats"], totals["ai_tasks"], totals["users"]] == before
+
+        plain = ConnectionPool(os.path.join(tmp, "plain.db"), size=1)
+        with plain.connection() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.executemany("INSERT INTO users (username, workspace_id) VALUES (?, ?)",
+                             [(f"user{i}", str(uuid.uuid4())) for i in range(args.users)])
+            conn.commit()
+        without = insert_rate(plain, args.users, args.inserts)
+        with_triggers = insert_rate(pool, args.users, args.inserts)
+        print(f"\nchat insert + commit: {without:,.0f}/s without triggers, {with_triggers:,.0f}/s with "
+              f"({(without / with_triggers - 1) * 100:+.1f}% time per insert)")
+        plain.close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
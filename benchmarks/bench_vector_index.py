@@ -0,0 +1,109 @@
+"""Vector search latency by workspace size: in-memory exact / IVF index vs Chroma.
+
+For each size, vectors drawn around ``size / 50`` topic centres (document
+embeddings cluster by topic; uniformly random vectors are the worst case
+for IVF) are indexed, and ``--queries`` vectors near random topics ask for
+the top ``--k``. Reports p50/p99 per engine, the recall of the IVF index
+against the exact top-k, and how long opening a saved (memory-mapped)
+index and answering a first query takes. Chroma is measured when
+``chromadb`` is installed.
+
+    python benchmarks/bench_vector_index.py --sizes 100 500 2000 10000 20000
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from utils.quantization import Codec
+from utils.vector_index import VectorIndex, IVFIndex
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def timed(search, queries):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, results
+
+
+def chroma_search(root, ids, vectors, k):
+    try:
+        import chromadb
+        from chromadb.config import Settings
+    except ImportError:
+        return None
+    client = chromadb.PersistentClient(path=root, settings=Settings(anonymized_telemetry=False))
+    collection = client.get_or_create_collection(name=f"bench_{len(ids)}")
+    for start in range(0, len(ids), 1000):
+        collection.add(ids=ids[start:start + 1000], embeddings=vectors[start:start + 1000].tolist())
+    return lambda query: collection.query(query_embeddings=[query], n_results=k, include=[])["ids"][0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 2000, 5000, 10000, 20000])
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--spread", type=float, default=0.7, help="noise around each topic centre")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    root = tempfile.mkdtemp()
+    print(f"{args.dimensions} dims, top {args.k}, {args.queries} queries per size\n")
+    print(f"{'chunks':>7} {'engine':<8} {'p50 ms':>8} {'p99 ms':>8} {'recall':>7}")
+    try:
+        for size in args.sizes:
+            topics = rng.normal(size=(max(2, size // 50), args.dimensions))
+            vectors = (topics[rng.integers(len(topics), size=size)]
+                       + rng.normal(scale=args.spread, size=(size, args.dimensions))).astype(np.float32)
+            ids = [f"c{i}" for i in range(size)]
+            queries = [q.tolist() for q in topics[rng.integers(len(topics), size=args.queries)]
+                       + rng.normal(scale=args.spread, size=(args.queries, args.dimensions))]
+
+            exact = VectorIndex.build(ids, [""] * size, [{}] * size, vectors, Codec(), exact_max=size)
+            latencies, truth = timed(lambda q: [c for c, s in exact.search(q, args.k)[1]], queries)
+            p50, p99 = percentiles(latencies)
+            print(f"{size:>7} {'exact':<8} {p50:>8.3f} {p99:>8.3f} {'1.000':>7}")
+
+            ann = VectorIndex(ids, [""] * size, [{}] * size, exact.arrays, exact.codec, exact_max=0)
+            start = time.perf_counter()
+            ann._ivf = IVFIndex(ann.arrays, ann.codec, size)
+            build_ms = (time.perf_counter() - start) * 1000
+            latencies, found = timed(lambda q: [c for c, s in ann.search(q, args.k)[1]], queries)
+            recall = statistics.mean(len(set(a) & set(b)) / len(b) for a, b in zip(found, truth))
+            p50, p99 = percentiles(latencies)
+            print(f"{size:>7} {'ivf':<8} {p50:>8.3f} {p99:>8.3f} {recall:>7.3f}   (built in {build_ms:.0f} ms)")
+
+            search = chroma_search(os.path.join(root, "chroma"), ids, vectors, args.k)
+            if search is not None:
+                latencies, found = timed(search, queries)
+                recall = statistics.mean(len(set(a) & set(b)) / len(b) for a, b in zip(found, truth))
+                p50, p99 = percentiles(latencies)
+                print(f"{size:>7} {'chroma':<8} {p50:>8.3f} {p99:>8.3f} {recall:>7.3f}")
+
+            prefix = os.path.join(root, f"ws{size}")
+            exact.save(prefix)
+            start = time.perf_counter()
+            VectorIndex.load(prefix, Codec()).search(queries[0], args.k)
+            print(f"{size:>7} open saved index and first query: {(time.perf_counter() - start) * 1000:.1f} ms\n")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
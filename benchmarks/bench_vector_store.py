@@ -0,0 +1,164 @@
+"""Query latency over many workspaces: per-request collection lookup vs CollectionManager.
+
+Creates ``--workspaces`` collections of ``--chunks`` random vectors each,
+in one persistence directory and again spread over ``--shards``
+directories, then reports for random workspace queries:
+
+* ``lookup per query`` - ``client.get_collection(name)`` before every query (the old code path)
+* ``cached handle``    - ``CollectionManager.get`` then the query
+* ``missing workspace`` - a workspace with no documents, old path (ValueError) vs manager
+
+and, in a fresh process per run, the latency of the first query to a
+workspace with and without ``warm()`` at startup. Store sizes per shard
+are printed so the effect of sharding on per-directory size is visible.
+
+    python benchmarks/bench_vector_store.py --workspaces 1000 --chunks 20 --shards 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+
+def vectors(rng: random.Random, count: int, dimensions: int):
+    return [[rng.uniform(-1, 1) for _ in range(dimensions)] for _ in range(count)]
+
+
+def build(root: str, shards: int, workspaces: int, chunks: int, dimensions: int) -> float:
+    from utils.vector_store import CollectionManager
+    rng = random.Random(1)
+    manager = CollectionManager(root, shards)
+    start = time.perf_counter()
+    for w in range(workspaces):
+        collection = manager.get_or_create(f"ws{w}")
+        collection.add(ids=[f"ws{w}_{i}" for i in range(chunks)], embeddings=vectors(rng, chunks, dimensions),
+                       documents=[f"chunk {i} of workspace {w}" for i in range(chunks)])
+    return time.perf_counter() - start
+
+
+def store_sizes(root: str, shards: int):
+    from utils.vector_store import shard_path
+    sizes = []
+    for shard in range(shards):
+        path, total = shard_path(shard, root), 0
+        for directory, subdirs, files in os.walk(path):
+            if directory != path and os.path.basename(directory).startswith("shard_"):
+                subdirs[:] = []
+                continue
+            total += sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+        sizes.append(total / 1024 / 1024)
+    return sizes
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return (statistics.median(latencies), latencies[int(len(latencies) * 0.99)])
+
+
+def steady_state(root: str, shards: int, workspaces: int, queries: int, dimensions: int):
+    from utils.vector_store import CollectionManager, collection_name
+    rng = random.Random(2)
+    manager = CollectionManager(root, shards)
+    targets = [f"ws{rng.randrange(workspaces)}" for _ in range(queries)]
+    probes = vectors(rng, queries, dimensions)
+    # Touch every index once so both paths below measure warm queries
+    manager.warm([f"ws{w}" for w in range(workspaces)])
+
+    results = {}
+    if shards == 1:
+        client, lookup = manager.client(0), []
+        for workspace_id, probe in zip(targets, probes):
+            start = time.perf_counter()
+            client.get_collection(name=collection_name(workspace_id)).query(query_embeddings=[probe], n_results=3)
+            lookup.append((time.perf_counter() - start) * 1000)
+        results["lookup per query"] = lookup
+
+        missing_old = []
+        for i in range(min(queries, 200)):
+            start = time.perf_counter()
+            try:
+                client.get_collection(name=collection_name(f"empty{i}"))
+            except ValueError:
+                pass
+            missing_old.append((time.perf_counter() - start) * 1000)
+        results["missing, lookup"] = missing_old
+
+    cached = []
+    for workspace_id, probe in zip(targets, probes):
+        start = time.perf_counter()
+        manager.get(workspace_id).query(query_embeddings=[probe], n_results=3)
+        cached.append((time.perf_counter() - start) * 1000)
+    results["cached handle"] = cached
+
+    missing = []
+    for i in range(min(queries, 200)):
+        start = time.perf_counter()
+        manager.get(f"empty{i}")
+        missing.append((time.perf_counter() - start) * 1000)
+    results["missing, manager"] = missing
+    return results
+
+
+def first_queries(root: str, shards: int, workspaces: int, sample: int, dimensions: int, warm: bool):
+    """Runs in a fresh process: latency of the first query to ``sample`` workspaces"""
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+    from utils.vector_store import CollectionManager
+    rng = random.Random(3)
+    manager = CollectionManager(root, shards)
+    targets = [f"ws{w}" for w in rng.sample(range(workspaces), sample)]
+    if warm:
+        manager.warm(targets)
+    latencies = []
+    for workspace_id, probe in zip(targets, vectors(rng, sample, dimensions)):
+        start = time.perf_counter()
+        collection = manager.get(workspace_id)
+        collection.query(query_embeddings=[probe], n_results=3)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workspaces", type=int, default=1000)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--cold-sample", type=int, default=50)
+    args = parser.parse_args()
+
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{args.workspaces} workspaces x {args.chunks} chunks ({args.dimensions} dims), "
+          f"{args.queries} queries to random workspaces\n")
+    print(f"{'':<28} {'p50 ms':>8} {'p99 ms':>8}")
+
+    for shards in sorted({1, args.shards}):
+        root = tempfile.mkdtemp()
+        try:
+            seconds = build(root, shards, args.workspaces, args.chunks, args.dimensions)
+            sizes = ", ".join(f"{size:.1f}" for size in store_sizes(root, shards))
+            print(f"-- {shards} shard(s): built in {seconds:.1f}s, store MB per shard: {sizes}")
+            for name, latencies in steady_state(root, shards, args.workspaces, args.queries,
+                                                args.dimensions).items():
+                p50, p99 = percentiles(latencies)
+                print(f"{name:<28} {p50:>8.3f} {p99:>8.3f}")
+            for warm in (False, True):
+                with spawn.Pool(1) as pool:
+                    latencies = pool.apply(first_queries, (root, shards, args.workspaces, args.cold_sample,
+                                                           args.dimensions, warm))
+                p50, p99 = percentiles(latencies)
+                print(f"{'first query, ' + ('warmed' if warm else 'cold'):<28} {p50:>8.3f} {p99:>8.3f}")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()